@@ -1,16 +1,25 @@
 #!/usr/bin/env python3
+import codecs
+import hashlib
+import importlib.util
+import json
+import multiprocessing
 import os
 import platform
+import re
+import shutil
 import string
+import tempfile
 import time
+import unicodedata
 from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
 
 import chardet
-import hdbscan
+import joblib
 import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.io as pio
 import typer
 from rich import print
 from rich.console import Console
@@ -18,25 +27,68 @@ from rich.live import Live
 from rich.panel import Panel
 from sentence_transformers import SentenceTransformer
 
+# hdbscan, plotly and scikit-learn are imported where they are used. The spawned encoding workers re-import
+# this script and only need SentenceTransformer.
+
 # Check if the system is Windows
 IS_WINDOWS = platform.system() == 'Windows'
 
 if IS_WINDOWS:
+    import msvcrt
     import win32com.client as win32
     win32c = win32.constants
+else:
+    import fcntl
 
 app = typer.Typer()
 
-live = Live(auto_refresh=False)  # Initialize Live with auto_refresh set to False
-live.start()  # Start the Live context manager
+live = Live(auto_refresh=False)  # Initialize Live with auto_refresh set to False, main() starts it
 
 startTime = time.time()  # start timing the script
 
+# Encoding detection only reads the start of the file, so very large keyword exports are never fully scanned
+ENCODING_SAMPLE_SIZE = 1024 * 1024
+BYTE_ORDER_MARKS = [
+    (codecs.BOM_UTF32_LE, "UTF-32"),
+    (codecs.BOM_UTF32_BE, "UTF-32"),
+    (codecs.BOM_UTF8, "UTF-8-SIG"),
+    (codecs.BOM_UTF16_LE, "UTF-16"),
+    (codecs.BOM_UTF16_BE, "UTF-16"),
+]
+
 COMMON_COLUMN_NAMES = [
     "Keyword", "Keywords", "keyword", "keywords",
     "Search Terms", "Search terms", "Search term", "Search Term"
 ]
 
+# Embeddings are cached across runs, keyed by model and normalised keyword, so overlapping keyword lists
+# only encode the new keywords
+EMBEDDING_CACHE_DIR = os.environ.get(
+    "KEYWORD_EMBEDDING_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "keyword-clustering", "embeddings"))
+EMBEDDING_DTYPES = ["float32", "float16"]
+
+# Keywords are encoded in batches by a pool of processes with one model each, every worker using
+# ENCODE_THREADS_PER_WORKER threads. Short lists are encoded in process, loading the worker models costs more.
+ENCODE_BATCH_SIZE = 64
+ENCODE_THREADS_PER_WORKER = 4
+ENCODE_PARALLEL_MIN_KEYWORDS = 20000
+ENCODE_BATCHES_IN_FLIGHT = 4
+ENCODE_COPY_ROWS = 65536  # rows copied at a time between memory-mapped matrices
+
+# HDBSCAN's core distances degrade on raw 384/768 dimensional embeddings, they can be reduced first. The fitted
+# reducer is stored next to the embedding cache and reused by later runs of the same model.
+REDUCTION_METHODS = ["none", "pca", "umap"]
+REDUCTION_DIMENSIONS = 32
+REDUCTION_FIT_SAMPLE_SIZE = 100000
+
+# Every output is stored with the centroids of its clusters, so that an incremental run can add new keywords
+# to the existing clusters and only cluster the keywords that fit none of them
+CENTROIDS_SUFFIX = "_centroids.npz"
+CENTROID_BLOCK_SIZE = 4096
+
+# The model of an encoding worker process, loaded once by its initializer
+worker_model = None
+
 def print_messages(message):
     panel = Panel.fit(message, title="[b]Clustering Progess[/b]", style="cyan", border_style="black")
     live.update(panel)
@@ -74,22 +126,388 @@ def get_model(model_name: str):
     model = SentenceTransformer(model_name)
     return model
 
-def load_file(file_path: str):
-    """Load a CSV file and return a DataFrame."""
-    result = chardet.detect(open(file_path, 'rb').read())
-    encoding_value = result["encoding"]
+def normalise_keyword(keyword: str):
+    """Normalise a keyword for the embedding cache: NFKC, lower case and single spaces."""
+    return ' '.join(unicodedata.normalize('NFKC', keyword).lower().split())
+
+class EmbeddingCache:
+    """Persistent keyword embeddings for one SentenceTransformer model.
+
+    The vectors are appended to a raw float32/float16 matrix that is read through a memory map, with the
+    64 bit hashes of the normalised keywords in the same row order as the index. Only keywords that are
+    not in the cache yet are encoded.
+    """
+
+    def __init__(self, model, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR, dtype: str = "float32"):
+        self.model = model
+        self.dtype = np.dtype(dtype)
+        safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', model_name)[-80:]
+        model_hash = hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:8]
+        self.directory = os.path.join(cache_dir, f"{safe_name}-{model_hash}-{self.dtype.name}")
+        self.matrix_path = os.path.join(self.directory, "embeddings.bin")
+        self.index_path = os.path.join(self.directory, "index.bin")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.lock_path = os.path.join(self.directory, "append.lock")
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        """Memory map the cached matrix and sort the hash index for lookups."""
+        meta = {"rows": 0, "dimension": None}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        self.rows, self.dimension = meta["rows"], meta["dimension"]
+
+        # Rows past the recorded count were left by an interrupted run and are ignored
+        if self.rows:
+            self.matrix = np.memmap(self.matrix_path, dtype=self.dtype, mode='r', shape=(self.rows, self.dimension))
+            hashes = np.fromfile(self.index_path, dtype=np.uint64, count=self.rows)
+        else:
+            self.matrix = None
+            hashes = np.array([], dtype=np.uint64)
+        self.sorted_rows = np.argsort(hashes, kind='stable')
+        self.sorted_hashes = hashes[self.sorted_rows]
+
+    @staticmethod
+    def hash_keywords(keywords):
+        """Return the 64 bit hash of each normalised keyword."""
+        return np.array([int.from_bytes(hashlib.blake2b(keyword.encode('utf-8'), digest_size=8).digest(), 'little')
+                         for keyword in keywords], dtype=np.uint64)
+
+    def lookup(self, hashes):
+        """Return the cache row of each hash, -1 when it is not cached."""
+        rows = np.full(len(hashes), -1, dtype=np.int64)
+        if not len(self.sorted_hashes):
+            return rows
+        positions = np.minimum(np.searchsorted(self.sorted_hashes, hashes), len(self.sorted_hashes) - 1)
+        found = self.sorted_hashes[positions] == hashes
+        rows[found] = self.sorted_rows[positions[found]]
+        return rows
+
+    @contextmanager
+    def lock(self):
+        """Hold an exclusive lock on the cache directory, so that concurrent runs append one at a time."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a+b') as lock_file:
+            if IS_WINDOWS:
+                # msvcrt gives up after ten attempts a second apart, so keep waiting for the other run
+                while True:
+                    try:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if IS_WINDOWS:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def append(self, hashes, embeddings):
+        """Append new embeddings to the cache and return their rows."""
+        with self.lock():
+            # Another run may have added rows since the cache was loaded
+            self._load()
+            self.dimension = embeddings.shape[1]
+            with open(self.matrix_path, 'ab') as matrix_file:
+                matrix_file.truncate(self.rows * self.dimension * self.dtype.itemsize)
+                # Written block by block, so memory-mapped embeddings are never copied whole into memory
+                for start in range(0, len(embeddings), ENCODE_COPY_ROWS):
+                    block = embeddings[start:start + ENCODE_COPY_ROWS]
+                    matrix_file.write(np.ascontiguousarray(block, dtype=self.dtype))
+            with open(self.index_path, 'ab') as index_file:
+                index_file.truncate(self.rows * 8)
+                index_file.write(hashes.astype(np.uint64).tobytes())
+
+            # The metadata is replaced last, so the new rows only count once they are fully written
+            new_rows = np.arange(self.rows, self.rows + len(hashes))
+            temp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as meta_file:
+                json.dump({"rows": self.rows + len(hashes), "dimension": self.dimension, "dtype": self.dtype.name},
+                          meta_file)
+            os.replace(temp_path, self.meta_path)
+            self._load()
+        return new_rows
+
+    def encode(self, keywords, batch_size: int = 32, show_progress_bar: bool = False):
+        """Return float32 embeddings of the keywords, encoding only the ones missing from the cache.
+
+        The embeddings are copied from the cache into a memory-mapped matrix of the encoder.
+        """
+        codes, unique_keywords = pd.factorize(pd.Series([normalise_keyword(str(k)) for k in keywords], dtype=object))
+        hashes = self.hash_keywords(unique_keywords)
+        rows = self.lookup(hashes)
+        missing = np.flatnonzero(rows < 0)
+        self.hits += len(rows) - len(missing)
+        self.misses += len(missing)
+        if len(missing):
+            new_embeddings = self.model.encode([unique_keywords[i] for i in missing], batch_size=batch_size,
+                                               show_progress_bar=show_progress_bar, convert_to_numpy=True)
+            rows[missing] = self.append(hashes[missing], new_embeddings)
+        if not len(rows):
+            return np.zeros((0, self.dimension or 0), dtype=np.float32)
+        return copy_rows(self.matrix, rows[codes], self.model.create_matrix(len(codes), self.dimension))
+
+def copy_rows(matrix, rows, out):
+    """Copy matrix[rows] into out block by block and return out."""
+    for start in range(0, len(rows), ENCODE_COPY_ROWS):
+        out[start:start + ENCODE_COPY_ROWS] = matrix[rows[start:start + ENCODE_COPY_ROWS]]
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+def init_encoding_worker(model_name: str, threads: int):
+    """Load one SentenceTransformer model per encoding process."""
+    global worker_model
+    import torch
+    torch.set_num_threads(threads)
+    worker_model = SentenceTransformer(model_name, device="cpu")
+
+def encode_batch_in_worker(start: int, keywords):
+    """Encode one batch of keywords with the model of this worker process."""
+    return start, worker_model.encode(keywords, batch_size=len(keywords), show_progress_bar=False,
+                                      convert_to_numpy=True).astype(np.float32)
+
+class ParallelEncoder:
+    """Encode keywords in length-sorted batches straight into a memory-mapped matrix.
+
+    Duplicate keywords are encoded once. On CPU, large lists are spread over a pool of processes with one
+    model each, the batches are written into the matrix as they finish.
+    """
+
+    def __init__(self, model, model_name: str, device: str = "cpu", workers: int = None,
+                 batch_size: int = ENCODE_BATCH_SIZE, directory: str = None):
+        self.model = model
+        self.model_name = model_name
+        self.workers = 1 if device != "cpu" else (workers or max(1, (os.cpu_count() or 1) // ENCODE_THREADS_PER_WORKER))
+        self.batch_size = batch_size
+        self.directory = tempfile.mkdtemp(prefix="keyword-embeddings-", dir=directory)
+
+    def encode(self, keywords, batch_size: int = None, show_progress_bar: bool = False, convert_to_numpy: bool = True):
+        """Return the embeddings of the keywords in a memory-mapped float32 matrix."""
+        batch_size = batch_size or self.batch_size
+        codes, unique_keywords = pd.factorize(pd.Series(list(keywords), dtype=object))
+        unique_keywords = list(unique_keywords)
+        embeddings = self.create_matrix(len(unique_keywords), self.model.get_sentence_embedding_dimension())
+
+        # Batches of keywords of similar length need little padding
+        order = np.argsort([len(keyword) for keyword in unique_keywords], kind="stable")
+        batches = [(start, [unique_keywords[i] for i in order[start:start + batch_size]])
+                   for start in range(0, len(order), batch_size)]
+
+        if self.workers > 1 and len(unique_keywords) >= ENCODE_PARALLEL_MIN_KEYWORDS:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=init_encoding_worker,
+                                     initargs=(self.model_name, threads)) as executor:
+                # Only a few batches per worker are in flight, so finished embeddings never pile up in memory
+                pending = set()
+                for batch in batches:
+                    pending.add(executor.submit(encode_batch_in_worker, *batch))
+                    if len(pending) >= self.workers * ENCODE_BATCHES_IN_FLIGHT:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self.write_batches(embeddings, order, done)
+                self.write_batches(embeddings, order, wait(pending).done)
+        else:
+            for start, batch in batches:
+                embeddings[order[start:start + len(batch)]] = self.model.encode(
+                    batch, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+
+        embeddings.flush()
+        if len(unique_keywords) == len(codes):
+            return embeddings
+        return copy_rows(embeddings, codes, self.create_matrix(len(codes), embeddings.shape[1]))
+
+    def create_matrix(self, rows: int, dimension: int):
+        """Create a memory-mapped float32 matrix in the directory of this encoder."""
+        path = os.path.join(self.directory, f"embeddings-{len(os.listdir(self.directory))}.npy")
+        return np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(rows, dimension))
+
+    @staticmethod
+    def write_batches(embeddings, order, futures):
+        """Write finished batches into the rows of their keywords."""
+        for future in futures:
+            start, batch_embeddings = future.result()
+            embeddings[order[start:start + len(batch_embeddings)]] = batch_embeddings
+
+    def close(self):
+        """Remove the memory-mapped matrices."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def get_reducer_path(cache_dir: str, model_name: str, method: str, dimensions: int):
+    """Return the path of the fitted reducer of a model, method and target dimension."""
+    safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', model_name)[-80:]
+    model_hash = hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cache_dir, "reducers", f"{safe_name}-{model_hash}-{method}-{dimensions}.joblib")
+
+def reduce_embeddings(embeddings, method: str, dimensions: int, model_name: str, cache_dir: str, refit: bool = False):
+    """Reduce the embeddings before clustering, reusing the reducer fitted by an earlier run when there is one.
+
+    Returns the reduced embeddings and whether a stored reducer was reused.
+    """
+    if method == "none" or dimensions >= embeddings.shape[1]:
+        return embeddings, False
+
+    path = get_reducer_path(cache_dir, model_name, method, dimensions)
+    if not refit and os.path.exists(path):
+        return np.asarray(joblib.load(path).transform(embeddings), dtype=np.float32), True
+
+    if len(embeddings) <= dimensions:
+        return embeddings, False
+    if method == "pca":
+        from sklearn.decomposition import PCA
+        reducer = PCA(n_components=dimensions, svd_solver="randomized", random_state=0)
+    else:
+        import umap
+        reducer = umap.UMAP(n_components=dimensions, metric="cosine")
+
+    # The reducer is fitted on a sample, projecting the rest is much cheaper than fitting on it
+    sample = embeddings
+    if len(embeddings) > REDUCTION_FIT_SAMPLE_SIZE:
+        rng = np.random.default_rng(0)
+        sample = embeddings[np.sort(rng.choice(len(embeddings), REDUCTION_FIT_SAMPLE_SIZE, replace=False))]
+    reducer.fit(sample)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump(reducer, path)
+    return np.asarray(reducer.transform(embeddings), dtype=np.float32), False
+
+def normalise_embeddings(embeddings):
+    """Return L2 normalised float32 embeddings, so that dot products are cosine similarities."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+class ClusterCentroids:
+    """Centroids of the clusters of an output, kept up to date as keywords are added to the clusters.
+
+    Every cluster keeps the sum and the count of the normalised embeddings of its keywords, its centroid is the
+    normalised sum. Keywords in no_cluster have no centroid.
+    """
+
+    def __init__(self, model_name: str, hubs=(), spokes=(), sums=None, counts=None):
+        self.model_name = model_name
+        self.hubs = list(hubs)
+        self.spokes = list(spokes)
+        self.sums = np.zeros((0, 0), dtype=np.float32) if sums is None else np.asarray(sums, dtype=np.float32)
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        self.rows = {spoke: row for row, spoke in enumerate(self.spokes)}
+
+    @classmethod
+    def load(cls, path: str):
+        """Load the centroids stored with an output."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(str(data["model_name"]), data["hubs"].tolist(), data["spokes"].tolist(), data["sums"],
+                       data["counts"])
+
+    def save(self, path: str):
+        """Store the centroids, next to the output they belong to."""
+        np.savez(path, model_name=np.array(self.model_name), hubs=np.array(self.hubs, dtype=str),
+                 spokes=np.array(self.spokes, dtype=str), sums=self.sums, counts=self.counts)
+
+    def add(self, hubs, spokes, embeddings):
+        """Add keywords to the centroids of their spokes, creating the centroids of new spokes."""
+        spokes = np.asarray(spokes, dtype=object)
+        clustered = spokes != "no_cluster"
+        codes, names = pd.factorize(spokes[clustered])
+        if not len(names):
+            return
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=len(names))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.add.reduceat(normalise_embeddings(embeddings)[clustered][order], starts, axis=0)
+        # A new spoke takes the hub of its first keyword
+        first_hubs = np.asarray(hubs, dtype=object)[clustered][order[starts]]
+
+        rows = np.array([self.rows.get(name, -1) for name in names], dtype=np.int64)
+        existing = rows >= 0
+        if not len(self.sums):
+            self.sums = np.zeros((0, sums.shape[1]), dtype=np.float32)
+        self.sums[rows[existing]] += sums[existing]
+        self.counts[rows[existing]] += counts[existing]
+        for name, hub in zip(names[~existing], first_hubs[~existing]):
+            self.rows[name] = len(self.spokes)
+            self.spokes.append(name)
+            self.hubs.append(hub)
+        self.sums = np.concatenate([self.sums, sums[~existing]])
+        self.counts = np.concatenate([self.counts, counts[~existing]])
+
+    def assign(self, embeddings, min_similarity: float):
+        """Return the row of the nearest centroid of each embedding, -1 when it is below min_similarity."""
+        embeddings = normalise_embeddings(embeddings)
+        nearest = np.full(len(embeddings), -1, dtype=np.int64)
+        if not self.spokes:
+            return nearest
+        centroids = normalise_embeddings(self.sums)
+        for start in range(0, len(embeddings), CENTROID_BLOCK_SIZE):
+            scores = embeddings[start:start + CENTROID_BLOCK_SIZE] @ centroids.T
+            best = scores.argmax(axis=1)
+            similar = scores[np.arange(len(best)), best] >= min_similarity
+            nearest[start:start + CENTROID_BLOCK_SIZE][similar] = best[similar]
+        return nearest
+
+def get_centroids_path(output_path: str):
+    """Return the path of the centroids stored with an output."""
+    return os.path.splitext(output_path)[0] + CENTROIDS_SUFFIX
+
+def load_previous_output(file_path: str):
+    """Load an earlier output, the workbook written by this tool or a CSV file with hub, spoke and keyword columns."""
+    if os.path.splitext(file_path)[1].lower() in ('.xlsx', '.xls'):
+        return pd.read_excel(file_path, sheet_name='Clustered Keywords')
+    return load_file(file_path)
+
+def detect_encoding(file_path: str, sample_size: int = ENCODING_SAMPLE_SIZE):
+    """Detect the encoding from the byte order mark, or with chardet on a bounded sample of the file."""
+    with open(file_path, 'rb') as file:
+        sample = file.read(sample_size)
+
+    for byte_order_mark, encoding_value in BYTE_ORDER_MARKS:
+        if sample.startswith(byte_order_mark):
+            return encoding_value
+
+    encoding_value = chardet.detect(sample)["encoding"] or "utf-8"
+    # An ASCII-only sample says nothing about the rest of the file, UTF-8 is a safe superset
+    if encoding_value.lower() == "ascii":
+        encoding_value = "utf-8"
+
+    # Fall back when the sample does not decode, it may end part way through a character
+    for candidate in (encoding_value, "utf-8"):
+        try:
+            codecs.getincrementaldecoder(candidate)().decode(sample, final=False)
+            return candidate
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return "latin-1"
+
+def load_file(file_path: str, usecols=None, chunksize: int = None):
+    """Load a CSV file and return a DataFrame, or an iterator of DataFrames when chunksize is set."""
+    encoding_value = detect_encoding(file_path)
     white_space = False if encoding_value != "UTF-16" else True
 
     df = pd.read_csv(
         file_path,
         encoding=encoding_value,
+        encoding_errors='replace',
         delim_whitespace=white_space,
         on_bad_lines='skip',
+        usecols=usecols,
+        chunksize=chunksize,
     )
     return df
 
 def create_chart(df, chart_type, output_path, volume):
     """Create a sunburst chart or a treemap."""
+    import plotly.express as px
+    import plotly.io as pio
+
     if volume is not None:
         chart_df = df.groupby(['hub', 'spoke'])[volume].sum().reset_index(name='cluster_size')
     else:
@@ -124,19 +542,31 @@ def create_chart(df, chart_type, output_path, volume):
 
 @app.command()
 def main(
+        cache: bool = typer.Option(True, help="Whether to reuse the keyword embeddings cached by earlier runs."),
+        cache_dir: str = typer.Option(EMBEDDING_CACHE_DIR, help="Directory of the keyword embedding cache."),
         chart_type: str = typer.Option("treemap", help="Type of chart to generate. 'sunburst' or 'treemap'."),
         column_name: str = typer.Option(None, help='Name of the column in your CSV to be processed.'),
         device: str = typer.Option("cpu", help="Device to be used by SentenceTransformer. 'cpu' or 'cuda'."),
+        embedding_dtype: str = typer.Option("float32", help="Precision of the cached embeddings. 'float32' or 'float16'."),
+        encode_batch_size: int = typer.Option(ENCODE_BATCH_SIZE, help="Number of keywords encoded per batch."),
+        encode_workers: int = typer.Option(None, help="Number of encoding processes on CPU. Defaults to one per 4 CPU cores."),
         excel_pivot: bool = typer.Option(False, help="Whether to save the output as an Excel pivot table."),
         file_path: str = typer.Argument(..., help='Path to your CSV file.'),
         min_cluster_size: int = typer.Option(2, help="Minimum cluster size for HDBSCAN."),
+        min_similarity: float = typer.Option(0.80, help="Minimum similarity of a new keyword to an existing cluster with --previous-output."),
         model_name: str = typer.Option("all-MiniLM-L6-v2",
                                        help="Name of the SentenceTransformer model to use. For available models, refer to https://www.sbert.net/docs/pretrained_models.html"),
         output_path: str = typer.Option(None, help='Path where the output CSV will be saved.'),
+        previous_output: str = typer.Option(None, help="Earlier output to update. Its clustered keywords keep their clusters, new and no_cluster keywords join the nearest cluster above --min-similarity or are clustered among themselves."),
+        reduction: str = typer.Option("none", help="Dimensionality reduction before HDBSCAN. 'none', 'pca' or 'umap' (needs umap-learn)."),
+        reduction_dimensions: int = typer.Option(REDUCTION_DIMENSIONS, help="Number of dimensions the embeddings are reduced to."),
+        refit_reducer: bool = typer.Option(False, help="Whether to fit a new reducer instead of reusing the stored one."),
         remove_dupes: bool = typer.Option(True, help="Whether to remove duplicates from the dataset."),
         stem: bool = typer.Option(False, "--stem", help="Whether to perform stemming on the 'hub' column.", show_default=False),
         volume: str = typer.Option(None, help='Name of the column containing numerical values. If --volume is used, the keyword with the largest volume will be used as the name of the cluster. If not, the shortest word will be used.')
 ):
+    live.start()  # Start the Live context manager
+
     # Clear the screen
     if platform.system() == 'Windows':
         os.system('cls')
@@ -154,6 +584,18 @@ def main(
         print("[bold magenta]Invalid device. Valid options are 'cpu' and 'cuda'.[/bold magenta]")
         return
 
+    if embedding_dtype not in EMBEDDING_DTYPES:
+        print("[bold magenta]Invalid embedding dtype. Valid options are 'float32' and 'float16'.[/bold magenta]")
+        return
+
+    if reduction not in REDUCTION_METHODS:
+        print("[bold magenta]Invalid reduction. Valid options are 'none', 'pca' and 'umap'.[/bold magenta]")
+        return
+
+    if reduction == "umap" and importlib.util.find_spec("umap") is None:
+        print("[bold magenta]UMAP is not installed. Install umap-learn or use --reduction pca.[/bold magenta]")
+        return
+
     try:
         model = get_model(model_name)
     except Exception as e:
@@ -183,19 +625,45 @@ def main(
         print(f"[bold magenta]The column name {volume} is not in the DataFrame.[/bold magenta]")
         return
 
+    previous = None
+    centroids = None
+    if previous_output is not None:
+        try:
+            previous = load_previous_output(previous_output)
+        except FileNotFoundError as e:
+            print(f"[bold magenta]The file {previous_output} does not exist.[/bold magenta]")
+            return
+        except ValueError as e:
+            print(f"[bold magenta]Failed to load the previous output: {e}[/bold magenta]")
+            return
+
+        if not {'hub', 'spoke', 'keyword'}.issubset(previous.columns):
+            print(f"[bold magenta]The previous output {previous_output} needs hub, spoke and keyword columns.[/bold magenta]")
+            return
+
+        centroids_path = get_centroids_path(previous_output)
+        if os.path.exists(centroids_path):
+            centroids = ClusterCentroids.load(centroids_path)
+            if centroids.model_name != model_name:
+                print(f"[bold magenta]The previous output was clustered with {centroids.model_name}, use the same --model-name to update it.[/bold magenta]")
+                return
+
     # Print options
     options_message = (
         f"[cyan]File path:[/cyan] [bold magenta]{file_path}[/bold magenta]\n"
         f"[cyan]Column name:[/cyan] [bold magenta]{column_name}[/bold magenta]\n"
         f"[cyan]Output path:[/cyan] [bold magenta]{output_path}[/bold magenta]\n"
+        f"[cyan]Previous output:[/cyan] [bold magenta]{previous_output}[/bold magenta]\n"
         f"[cyan]Chart type:[/cyan] [bold magenta]{chart_type}[/bold magenta]\n"
         f"[cyan]Device:[/cyan] [bold magenta]{device}[/bold magenta]\n"
         f"[cyan]SentenceTransformer model:[/cyan] [bold magenta]{model_name}[/bold magenta]\n"
         f"[cyan]Minimum cluster size:[/cyan] [bold magenta]{min_cluster_size}[/bold magenta]\n"
+        f"[cyan]Reduction:[/cyan] [bold magenta]{reduction if reduction == 'none' else f'{reduction} to {reduction_dimensions} dimensions'}[/bold magenta]\n"
         f"[cyan]Remove duplicates:[/cyan] [bold magenta]{remove_dupes}[/bold magenta]\n"
         f"[cyan]Excel Pivot:[/cyan] [bold magenta]{excel_pivot}[/bold magenta]\n"
         f"[cyan]Volume column:[/cyan] [bold magenta]{volume}[/bold magenta]\n"
-        f"[cyan]Stemming enabled:[/cyan] [bold magenta]{stem}[/bold magenta]"
+        f"[cyan]Stemming enabled:[/cyan] [bold magenta]{stem}[/bold magenta]\n"
+        f"[cyan]Embedding cache:[/cyan] [bold magenta]{cache_dir if cache else 'disabled'}[/bold magenta]"
     )
     panel = Panel.fit(options_message, title="[b]Using The Following Options[/b]", style="magenta", border_style="black")
     console.print(panel)
@@ -209,77 +677,183 @@ def main(
     df['keyword'] = df['keyword'].astype(str)
     from_list = df['keyword'].to_list()
 
-    embedding_model = SentenceTransformer(model_name, device=device)
-    embeddings = embedding_model.encode(from_list)
+    # Time spent in each stage, reported with the results
+    stage_times = {}
+    stage_start = time.time()
 
-    # clustering started message
-    message = "Clustering keywords, this can take a while!"
-    print_messages(message)
-
-    # Create the HDBSCAN clusterer and fit it to our embeddings
-    clusterer = hdbscan.HDBSCAN(min_cluster_size=min_cluster_size)
-    cluster_labels = clusterer.fit_predict(embeddings)
-
-    # Create a DataFrame with the cluster assignments
-    df_cluster = pd.DataFrame({'keyword': from_list, 'cluster': cluster_labels})
-
-    # Join the original DataFrame with the cluster assignments
-    df = df.join(df_cluster.set_index('keyword'), on='keyword')
-
-    # Create the 'hub' and 'spoke' columns
-    df['hub'] = df.groupby('cluster')['keyword'].transform(lambda x: create_unigram(' '.join(x), stem))
-    df['spoke'] = df['cluster'].apply(lambda x: 'no_cluster' if x == -1 else x)
-
-    df['cluster_size'] = df['spoke'].map(df.groupby('spoke')['spoke'].count())
-    df.insert(0, 'spoke', df.pop('spoke'))
-    df['keyword_len'] = df['keyword'].astype(str).apply(len)
-    if volume is not None:
-        df[volume] = df[volume].astype(str).replace({'': '0', 'nan': '0'}).str.replace('\D', '', regex=True).astype(int)
-
-        df = df.sort_values(by=volume, ascending=False)
-    else:
-        df = df.sort_values(by="keyword_len", ascending=True)
-
-    df['spoke'], df['hub'] = df['spoke'].astype(str), df['hub'].astype(str)
-
-    df = df[
-        ['hub', 'spoke', 'cluster_size'] + [col for col in df.columns if col not in ['hub', 'spoke', 'cluster_size']]]
-    
-    # If volume is used, sort by volume. Otherwise, sort by keyword length.
-    if volume is not None:
-        df[volume] = df[volume].replace({'': 0, np.nan: 0}).astype(int)
-        df = df.sort_values(by=volume, ascending=False)
-    else:
+    embedding_model = SentenceTransformer(model_name, device=device)
+    encoder = ParallelEncoder(embedding_model, model_name, device, encode_workers, encode_batch_size)
+    # The memory-mapped embeddings are removed even when a later stage fails
+    try:
+        keyword_encoder = encoder
+        embedding_cache = None
+        if cache:
+            # Only the keywords missing from the cache reach the encoder
+            embedding_cache = EmbeddingCache(encoder, model_name, cache_dir, embedding_dtype)
+            keyword_encoder = embedding_cache
+
+        # clustering started message
+        message = "Clustering keywords, this can take a while!"
+
+        df_incremental = None
+        if previous is not None:
+            # Keywords of the previous output keep their hub and spoke
+            previous = previous.dropna(subset=['keyword'])
+            previous_clusters = previous[['hub', 'spoke']].astype(str)
+            previous_clusters.index = previous['keyword'].astype(str).map(normalise_keyword)
+            previous_clusters = previous_clusters[~previous_clusters.index.duplicated()]
+            # Keywords the previous output left in no_cluster are clustered again, with the new keywords
+            previous_clusters = previous_clusters[previous_clusters['spoke'] != "no_cluster"]
+            keys = df['keyword'].map(normalise_keyword)
+            known = keys.isin(previous_clusters.index).to_numpy()
+            df_known = df[known].copy()
+            df_known['hub'] = keys[known].map(previous_clusters['hub']).to_numpy()
+            df_known['spoke'] = keys[known].map(previous_clusters['spoke']).to_numpy()
+
+            if centroids is None:
+                # The output predates the stored centroids, they are rebuilt from its keywords once
+                centroids = ClusterCentroids(model_name)
+                if len(previous):
+                    centroids.add(previous['hub'].astype(str), previous['spoke'].astype(str),
+                                  keyword_encoder.encode(previous['keyword'].astype(str).to_list(),
+                                                         batch_size=encode_batch_size))
+
+            # New and unclustered keywords join the nearest existing cluster when it is similar enough
+            df_new = df[~known]
+            nearest = np.full(len(df_new), -1, dtype=np.int64)
+            embeddings = None
+            if len(df_new):
+                embeddings = keyword_encoder.encode(df_new['keyword'].to_list(), batch_size=encode_batch_size)
+                nearest = centroids.assign(embeddings, min_similarity)
+            assigned = nearest >= 0
+            df_assigned = df_new[assigned].copy()
+            df_assigned['hub'] = [centroids.hubs[row] for row in nearest[assigned]]
+            df_assigned['spoke'] = [centroids.spokes[row] for row in nearest[assigned]]
+            if assigned.any():
+                centroids.add(df_assigned['hub'], df_assigned['spoke'], embeddings[assigned])
+            df_incremental = pd.concat([df_known, df_assigned])
+
+            # Only the keywords that fit no existing cluster are clustered, among themselves
+            df = df_new[~assigned]
+            embeddings = embeddings[~assigned] if embeddings is not None else None
+            from_list = df['keyword'].to_list()
+            message += (f"\n{len(df_known)} keywords kept their cluster, {len(df_assigned)} new or unclustered "
+                        f"keywords joined an existing cluster, {len(from_list)} keywords left to cluster.")
+        else:
+            embeddings = keyword_encoder.encode(from_list, batch_size=encode_batch_size)
+        stage_times["encoding"] = time.time() - stage_start
+        print_messages(message)
+
+        # The centroids are computed from the embeddings before reduction
+        keyword_embeddings = embeddings
+        cluster_labels = np.full(len(from_list), -1, dtype=np.int64)
+        # HDBSCAN needs more keywords than the minimum cluster size, fewer are left in no_cluster
+        if len(from_list) > min_cluster_size:
+            stage_start = time.time()
+            embeddings, reused_reducer = reduce_embeddings(embeddings, reduction, reduction_dimensions, model_name,
+                                                           cache_dir, refit_reducer)
+            if reduction != "none":
+                stage_times["reduction (stored reducer)" if reused_reducer else "reduction"] = time.time() - stage_start
+
+            # Create the HDBSCAN clusterer and fit it to our embeddings
+            stage_start = time.time()
+            import hdbscan
+            clusterer = hdbscan.HDBSCAN(min_cluster_size=min_cluster_size)
+            cluster_labels = clusterer.fit_predict(embeddings)
+            stage_times["clustering"] = time.time() - stage_start
+        stage_start = time.time()
+
+        # Create a DataFrame with the cluster assignments
+        df_cluster = pd.DataFrame({'keyword': pd.Series(from_list, dtype=object), 'cluster': cluster_labels})
+
+        # Join the original DataFrame with the cluster assignments
+        df = df.join(df_cluster.set_index('keyword'), on='keyword')
+
+        # Create the 'hub' and 'spoke' columns
+        df['hub'] = df.groupby('cluster')['keyword'].transform(lambda x: create_unigram(' '.join(x), stem))
+        df['spoke'] = df['cluster'].apply(lambda x: 'no_cluster' if x == -1 else x)
+
+        df['cluster_size'] = df['spoke'].map(df.groupby('spoke')['spoke'].count())
+        df.insert(0, 'spoke', df.pop('spoke'))
         df['keyword_len'] = df['keyword'].astype(str).apply(len)
-        df = df.sort_values(by="keyword_len", ascending=True)
-
-    # Use the first keyword in each sorted group as the cluster name.
-    df['spoke'] = df.groupby('spoke')['keyword'].transform('first')
-    df.loc[df["cluster"] == -1, "hub"] = "no_cluster"
-    df.loc[df["cluster"] == -1, "spoke"] = "no_cluster"
+        if volume is not None:
+            df[volume] = df[volume].astype(str).replace({'': '0', 'nan': '0'}).str.replace('\D', '', regex=True).astype(int)
 
-    df.sort_values(["spoke", "cluster_size"], ascending=[True, False], inplace=True)
-
-    df['spoke'] = (df['spoke'].str.split()).str.join(' ')
+            df = df.sort_values(by=volume, ascending=False)
+        else:
+            df = df.sort_values(by="keyword_len", ascending=True)
 
-    message += f"\nAll keywords clustered successfully. Took {round(time.time() - startTime, 2)} seconds!"
-    print_messages(message)
+        df['spoke'], df['hub'] = df['spoke'].astype(str), df['hub'].astype(str)
 
-    if output_path is None:
-        output_path = os.path.splitext(file_path)[0] + '_output.csv'
+        df = df[
+            ['hub', 'spoke', 'cluster_size'] + [col for col in df.columns if col not in ['hub', 'spoke', 'cluster_size']]]
+    
+        # If volume is used, sort by volume. Otherwise, sort by keyword length.
+        if volume is not None:
+            df[volume] = df[volume].replace({'': 0, np.nan: 0}).astype(int)
+            df = df.sort_values(by=volume, ascending=False)
+        else:
+            df['keyword_len'] = df['keyword'].astype(str).apply(len)
+            df = df.sort_values(by="keyword_len", ascending=True)
 
-    # drop unused columns
-    df.drop(columns=['cluster_size', 'keyword_len'], inplace=True)
+        # Use the first keyword in each sorted group as the cluster name.
+        df['spoke'] = df.groupby('spoke')['keyword'].transform('first')
+        df.loc[df["cluster"] == -1, "hub"] = "no_cluster"
+        df.loc[df["cluster"] == -1, "spoke"] = "no_cluster"
 
-    # logic to fix no_cluster hub and spoke names
-    df["hub"] = df["hub"].apply(lambda x: "no_cluster" if x == "noclust" else x)
-    df["hub"] = df["hub"].apply(lambda x: "no_cluster" if x == "nocluster" else x)
-    df.loc[df["hub"] == "no_cluster", "spoke"] = "no_cluster"
+        df.sort_values(["spoke", "cluster_size"], ascending=[True, False], inplace=True)
 
-    create_chart(df, chart_type, output_path, volume)
+        df['spoke'] = (df['spoke'].str.split()).str.join(' ')
 
-    output_dir = os.getcwd()
-    output_path = os.path.join(output_dir, output_path + '_output.xlsx')
+        if df_incremental is not None:
+            df = pd.concat([df_incremental, df])
+            df['cluster_size'] = df['spoke'].map(df['spoke'].value_counts())
+            df['keyword_len'] = df['keyword'].astype(str).apply(len)
+            if volume is not None:
+                df[volume] = df[volume].astype(str).replace({'': '0', 'nan': '0'}).str.replace('\D', '', regex=True).astype(int)
+                df = df.sort_values(by=volume, ascending=False)
+            else:
+                df = df.sort_values(by="keyword_len", ascending=True)
+            df = df[
+                ['hub', 'spoke', 'cluster_size'] + [col for col in df.columns if col not in ['hub', 'spoke', 'cluster_size']]]
+            df.sort_values(["spoke", "cluster_size"], ascending=[True, False], inplace=True)
+        stage_times["naming"] = time.time() - stage_start
+
+        message += f"\nAll keywords clustered successfully. Took {round(time.time() - startTime, 2)} seconds!"
+        message += "\nStage timings: " + ", ".join(f"{stage} {round(seconds, 2)}s" for stage, seconds in stage_times.items())
+        if embedding_cache is not None:
+            message += (f"\nEmbedding cache: {embedding_cache.hits} hits, "
+                        f"{embedding_cache.misses} keywords encoded.")
+        print_messages(message)
+
+        if output_path is None:
+            output_path = os.path.splitext(file_path)[0] + '_output.csv'
+
+        # drop unused columns
+        df.drop(columns=['cluster_size', 'keyword_len'], inplace=True)
+
+        # logic to fix no_cluster hub and spoke names
+        df["hub"] = df["hub"].apply(lambda x: "no_cluster" if x == "noclust" else x)
+        df["hub"] = df["hub"].apply(lambda x: "no_cluster" if x == "nocluster" else x)
+        df.loc[df["hub"] == "no_cluster", "spoke"] = "no_cluster"
+
+        create_chart(df, chart_type, output_path, volume)
+
+        output_dir = os.getcwd()
+        output_path = os.path.join(output_dir, output_path + '_output.xlsx')
+
+        # The centroids are stored with the output for the next incremental run, only the keywords clustered by this
+        # run are added to them
+        if centroids is None:
+            centroids = ClusterCentroids(model_name)
+        if from_list:
+            keyword_rows = dict(zip(from_list, range(len(from_list))))
+            df_clustered = df[df['keyword'].isin(keyword_rows)]
+            centroids.add(df_clustered['hub'], df_clustered['spoke'],
+                          keyword_embeddings[[keyword_rows[keyword] for keyword in df_clustered['keyword']]])
+        centroids.save(get_centroids_path(output_path))
+    finally:
+        encoder.close()
 
     if excel_pivot and IS_WINDOWS:
         try:
@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
+import codecs
+import hashlib
+import json
 import os
 import platform
+import re
 import string
 import time
+import unicodedata
 from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
 
 import chardet
 import numpy as np
@@ -17,14 +24,19 @@ from rich import print
 from rich.console import Console
 from rich.live import Live
 from rich.panel import Panel
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
 from sentence_transformers import SentenceTransformer
 
 # Check if the system is Windows
 IS_WINDOWS = platform.system() == 'Windows'
 
 if IS_WINDOWS:
+    import msvcrt
     import win32com.client as win32
     win32c = win32.constants
+else:
+    import fcntl
 
 app = typer.Typer()
 
@@ -33,24 +45,70 @@ live.start()  # Start the Live context manager
 
 startTime = time.time()  # start timing the script
 
+# Encoding detection only reads the start of the file, so very large keyword exports are never fully scanned
+ENCODING_SAMPLE_SIZE = 1024 * 1024
+BYTE_ORDER_MARKS = [
+    (codecs.BOM_UTF32_LE, "UTF-32"),
+    (codecs.BOM_UTF32_BE, "UTF-32"),
+    (codecs.BOM_UTF8, "UTF-8-SIG"),
+    (codecs.BOM_UTF16_LE, "UTF-16"),
+    (codecs.BOM_UTF16_BE, "UTF-16"),
+]
+
 COMMON_COLUMN_NAMES = [
     "Keyword", "Keywords", "keyword", "keywords",
     "Search Terms", "Search terms", "Search term", "Search Term"
 ]
 
+# Embeddings are cached across runs, keyed by model and normalised keyword, so overlapping keyword lists
+# only encode the new keywords
+EMBEDDING_CACHE_DIR = os.environ.get(
+    "KEYWORD_EMBEDDING_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "keyword-clustering", "embeddings"))
+EMBEDDING_DTYPES = ["float32", "float16"]
+
+# The ANN engine never builds the full similarity matrix: the embeddings are indexed in inverted lists around
+# k-means centroids (IVF) and every keyword is only linked to its top-k neighbours. With top-k 1 each keyword is
+# linked to its best match, as PolyFuzz links it, so both engines give the same clusters at the same threshold.
+# A larger top-k chains the clusters: every extra link above the threshold can merge two clusters.
+CLUSTERING_ENGINES = ["polyfuzz", "ann"]
+ANN_TOP_K = 1
+ANN_PROBES = 16
+ANN_EXACT_SIZE = 20000  # up to this many keywords every keyword is compared with every other one
+ANN_LISTS_PER_SQRT = 4
+ANN_TRAINING_POINTS_PER_LIST = 64
+ANN_KMEANS_ITERATIONS = 10
+ANN_BLOCK_SIZE = 4096
+ANN_BLOCK_ELEMENTS = 2 ** 24
+
+# Every output is stored with the centroids of its clusters, so that an incremental run can add new keywords
+# to the existing clusters and only cluster the keywords that fit none of them
+CENTROIDS_SUFFIX = "_centroids.npz"
+CENTROID_BLOCK_SIZE = 4096
+
 def print_messages(message):
     panel = Panel.fit(message, title="[b]Clustering Progess[/b]", style="cyan", border_style="black")
     live.update(panel)
     live.refresh()  # Manually refresh the Live display
 
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+@lru_cache(maxsize=1)
+def get_stemmer():
+    """Create the PorterStemmer once, it is shared by every call."""
+    from nltk.stem import PorterStemmer
+    return PorterStemmer()
+
+@lru_cache(maxsize=None)
+def stem_word(word: str):
+    """Stem a word, memoised as the same words repeat across clusters."""
+    return get_stemmer().stem(word)
+
 def stem_and_remove_punctuation(text: str, stem: bool):
     # Remove punctuation
-    text = text.translate(str.maketrans('', '', string.punctuation))
+    text = text.translate(PUNCTUATION_TABLE)
     # Stem the text if the stem flag is True
     if stem:
-        from nltk.stem import PorterStemmer
-        stemmer = PorterStemmer()
-        text = ' '.join([stemmer.stem(word) for word in text.split()])
+        text = ' '.join([stem_word(word) for word in text.split()])
     return text
 
 def create_unigram(cluster: str, stem: bool):
@@ -75,17 +133,374 @@ def get_model(model_name: str):
     model = SentenceTransformer(model_name)
     return model
 
-def load_file(file_path: str):
-    """Load a CSV file and return a DataFrame."""
-    result = chardet.detect(open(file_path, 'rb').read())
-    encoding_value = result["encoding"]
+def normalise_keyword(keyword: str):
+    """Normalise a keyword for the embedding cache: NFKC, lower case and single spaces."""
+    return ' '.join(unicodedata.normalize('NFKC', keyword).lower().split())
+
+class EmbeddingCache:
+    """Persistent keyword embeddings for one SentenceTransformer model.
+
+    The vectors are appended to a raw float32/float16 matrix that is read through a memory map, with the
+    64 bit hashes of the normalised keywords in the same row order as the index. Only keywords that are
+    not in the cache yet are encoded.
+    """
+
+    def __init__(self, model, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR, dtype: str = "float32"):
+        self.model = model
+        self.dtype = np.dtype(dtype)
+        safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', model_name)[-80:]
+        model_hash = hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:8]
+        self.directory = os.path.join(cache_dir, f"{safe_name}-{model_hash}-{self.dtype.name}")
+        self.matrix_path = os.path.join(self.directory, "embeddings.bin")
+        self.index_path = os.path.join(self.directory, "index.bin")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.lock_path = os.path.join(self.directory, "append.lock")
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        """Memory map the cached matrix and sort the hash index for lookups."""
+        meta = {"rows": 0, "dimension": None}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        self.rows, self.dimension = meta["rows"], meta["dimension"]
+
+        # Rows past the recorded count were left by an interrupted run and are ignored
+        if self.rows:
+            self.matrix = np.memmap(self.matrix_path, dtype=self.dtype, mode='r', shape=(self.rows, self.dimension))
+            hashes = np.fromfile(self.index_path, dtype=np.uint64, count=self.rows)
+        else:
+            self.matrix = None
+            hashes = np.array([], dtype=np.uint64)
+        self.sorted_rows = np.argsort(hashes, kind='stable')
+        self.sorted_hashes = hashes[self.sorted_rows]
+
+    @staticmethod
+    def hash_keywords(keywords):
+        """Return the 64 bit hash of each normalised keyword."""
+        return np.array([int.from_bytes(hashlib.blake2b(keyword.encode('utf-8'), digest_size=8).digest(), 'little')
+                         for keyword in keywords], dtype=np.uint64)
+
+    def lookup(self, hashes):
+        """Return the cache row of each hash, -1 when it is not cached."""
+        rows = np.full(len(hashes), -1, dtype=np.int64)
+        if not len(self.sorted_hashes):
+            return rows
+        positions = np.minimum(np.searchsorted(self.sorted_hashes, hashes), len(self.sorted_hashes) - 1)
+        found = self.sorted_hashes[positions] == hashes
+        rows[found] = self.sorted_rows[positions[found]]
+        return rows
+
+    @contextmanager
+    def lock(self):
+        """Hold an exclusive lock on the cache directory, so that concurrent runs append one at a time."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a+b') as lock_file:
+            if IS_WINDOWS:
+                # msvcrt gives up after ten attempts a second apart, so keep waiting for the other run
+                while True:
+                    try:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if IS_WINDOWS:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def append(self, hashes, embeddings):
+        """Append new embeddings to the cache and return their rows."""
+        embeddings = np.asarray(embeddings, dtype=self.dtype)
+        with self.lock():
+            # Another run may have added rows since the cache was loaded
+            self._load()
+            self.dimension = embeddings.shape[1]
+            with open(self.matrix_path, 'ab') as matrix_file:
+                matrix_file.truncate(self.rows * self.dimension * self.dtype.itemsize)
+                matrix_file.write(embeddings.tobytes())
+            with open(self.index_path, 'ab') as index_file:
+                index_file.truncate(self.rows * 8)
+                index_file.write(hashes.astype(np.uint64).tobytes())
+
+            # The metadata is replaced last, so the new rows only count once they are fully written
+            new_rows = np.arange(self.rows, self.rows + len(hashes))
+            temp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as meta_file:
+                json.dump({"rows": self.rows + len(hashes), "dimension": self.dimension, "dtype": self.dtype.name},
+                          meta_file)
+            os.replace(temp_path, self.meta_path)
+            self._load()
+        return new_rows
+
+    def encode(self, keywords, batch_size: int = 32, show_progress_bar: bool = False):
+        """Return float32 embeddings of the keywords, encoding only the ones missing from the cache."""
+        codes, unique_keywords = pd.factorize(pd.Series([normalise_keyword(str(k)) for k in keywords], dtype=object))
+        hashes = self.hash_keywords(unique_keywords)
+        rows = self.lookup(hashes)
+        missing = np.flatnonzero(rows < 0)
+        self.hits += len(rows) - len(missing)
+        self.misses += len(missing)
+        if len(missing):
+            new_embeddings = self.model.encode([unique_keywords[i] for i in missing], batch_size=batch_size,
+                                               show_progress_bar=show_progress_bar, convert_to_numpy=True)
+            rows[missing] = self.append(hashes[missing], new_embeddings)
+        if not len(rows):
+            return np.zeros((0, self.dimension or 0), dtype=np.float32)
+        return np.asarray(self.matrix[rows], dtype=np.float32)[codes]
+
+class EncodedKeywords:
+    """Embeddings of the keywords encoded before fitting, looked up by keyword instead of encoded again."""
+
+    def __init__(self, keywords, embeddings):
+        self.rows = dict(zip(keywords, range(len(keywords))))
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+
+    def encode(self, keywords, **kwargs):
+        """Return the embeddings of keywords that were encoded before fitting."""
+        return self.embeddings[[self.rows[keyword] for keyword in keywords]]
+
+def normalise_embeddings(embeddings):
+    """Return L2 normalised float32 embeddings, so that dot products are cosine similarities."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+def top_k_columns(scores, k: int):
+    """Return the column indices of the k largest scores of each row, best first."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+def nearest_centroids(embeddings, centroids, n_probes: int):
+    """Return the n_probes most similar centroids of each embedding."""
+    probes = np.empty((len(embeddings), min(n_probes, len(centroids))), dtype=np.int64)
+    for start in range(0, len(embeddings), ANN_BLOCK_SIZE):
+        probes[start:start + ANN_BLOCK_SIZE] = top_k_columns(embeddings[start:start + ANN_BLOCK_SIZE] @ centroids.T,
+                                                             n_probes)
+    return probes
+
+def train_ivf_centroids(embeddings, n_lists: int, seed: int = 0):
+    """Train the coarse quantiser of the IVF index with spherical k-means on a sample of the embeddings."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(embeddings), n_lists * ANN_TRAINING_POINTS_PER_LIST)
+    sample = embeddings[np.sort(rng.choice(len(embeddings), sample_size, replace=False))]
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)]
+    for _ in range(ANN_KMEANS_ITERATIONS):
+        assignment = nearest_centroids(sample, centroids, 1)[:, 0]
+        counts = np.bincount(assignment, minlength=n_lists)
+        present = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+        # Lists that received no sample keep their previous centroid
+        sums = np.add.reduceat(sample[np.argsort(assignment, kind='stable')], starts, axis=0)
+        centroids[present] = normalise_embeddings(sums)
+    return centroids
+
+def merge_neighbours(neighbours, similarities, rows, candidates, candidate_similarities):
+    """Merge candidate neighbours into the running top-k of the given rows."""
+    merged = np.concatenate([neighbours[rows], candidates], axis=1)
+    merged_similarities = np.concatenate([similarities[rows], candidate_similarities], axis=1)
+    top = top_k_columns(merged_similarities, neighbours.shape[1])
+    neighbours[rows] = np.take_along_axis(merged, top, axis=1)
+    similarities[rows] = np.take_along_axis(merged_similarities, top, axis=1)
+
+def ann_top_k_neighbours(embeddings, top_k: int = ANN_TOP_K, n_probes: int = ANN_PROBES):
+    """Return the approximate top-k neighbours of each normalised embedding and their cosine similarities.
+
+    The embeddings are split into inverted lists by their nearest k-means centroid and each keyword is only
+    compared with the lists of its n_probes nearest centroids. Missing neighbours are -1 with similarity -inf.
+    """
+    n = len(embeddings)
+    n_lists = 1 if n <= ANN_EXACT_SIZE else int(np.sqrt(n) * ANN_LISTS_PER_SQRT)
+    if n_lists == 1:
+        list_ids = np.zeros(n, dtype=np.int64)
+        probes = np.zeros((n, 1), dtype=np.int64)
+    else:
+        centroids = train_ivf_centroids(embeddings, n_lists)
+        probes = nearest_centroids(embeddings, centroids, n_probes)
+        list_ids = nearest_centroids(embeddings, centroids, 1)[:, 0]
+
+    list_order = np.argsort(list_ids, kind='stable')
+    list_offsets = np.concatenate(([0], np.cumsum(np.bincount(list_ids, minlength=n_lists))))
+    probe_lists = probes.ravel()
+    probe_queries = np.repeat(np.arange(n), probes.shape[1])[np.argsort(probe_lists, kind='stable')]
+    probe_offsets = np.concatenate(([0], np.cumsum(np.bincount(probe_lists, minlength=n_lists))))
+
+    neighbours = np.full((n, top_k), -1, dtype=np.int64)
+    similarities = np.full((n, top_k), -np.inf, dtype=np.float32)
+    for list_id in range(n_lists):
+        members = list_order[list_offsets[list_id]:list_offsets[list_id + 1]]
+        queries = probe_queries[probe_offsets[list_id]:probe_offsets[list_id + 1]]
+        if not len(members) or not len(queries):
+            continue
+        member_embeddings = embeddings[members]
+        # Queries are scored in blocks, so the similarity matrix in memory stays bounded
+        block_size = max(1, ANN_BLOCK_ELEMENTS // len(members))
+        for start in range(0, len(queries), block_size):
+            block = queries[start:start + block_size]
+            scores = embeddings[block] @ member_embeddings.T
+            scores[block[:, None] == members[None, :]] = -np.inf
+            top = top_k_columns(scores, top_k)
+            merge_neighbours(neighbours, similarities, block, members[top], np.take_along_axis(scores, top, axis=1))
+    return neighbours, similarities
+
+def cluster_keywords_with_ann(from_list, embeddings, min_similarity: float, top_k: int = ANN_TOP_K,
+                              n_probes: int = ANN_PROBES):
+    """Cluster keywords as the connected components of their top-k neighbour graph above min_similarity.
+
+    Returns the matches in the layout of PolyFuzz's get_matches(): From, To, Similarity and Group.
+    """
+    if not len(from_list):
+        return pd.DataFrame(columns=['From', 'To', 'Similarity', 'Group'])
+    neighbours, similarities = ann_top_k_neighbours(normalise_embeddings(embeddings), top_k, n_probes)
+
+    n = len(from_list)
+    rows, columns = np.nonzero(similarities >= min_similarity)
+    targets = neighbours[rows, columns]
+    graph = csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, targets)), shape=(n, n))
+    labels = connected_components(graph, directed=False)[1]
+
+    # A keyword can be linked only by its neighbours' lists, its similarity is that of its strongest link
+    best_similarity = similarities[:, 0].copy() if top_k else np.full(n, -np.inf, dtype=np.float32)
+    np.maximum.at(best_similarity, targets, similarities[rows, columns])
+
+    # Every cluster is named after its first keyword, as PolyFuzz names its groups
+    keywords = np.asarray(from_list, dtype=object)
+    first_keywords = np.unique(labels, return_index=True)[1]
+    nearest = np.where(np.isfinite(similarities[:, 0]), neighbours[:, 0], -1) if top_k else np.full(n, -1)
+    return pd.DataFrame({
+        'From': keywords,
+        'To': np.where(nearest >= 0, keywords[np.maximum(nearest, 0)], None),
+        'Similarity': np.where(np.isfinite(best_similarity), best_similarity, 0).round(3),
+        'Group': keywords[first_keywords[labels]],
+    })
+
+class ClusterCentroids:
+    """Centroids of the clusters of an output, kept up to date as keywords are added to the clusters.
+
+    Every cluster keeps the sum and the count of the normalised embeddings of its keywords, its centroid is the
+    normalised sum. Keywords in no_cluster have no centroid.
+    """
+
+    def __init__(self, model_name: str, hubs=(), spokes=(), sums=None, counts=None):
+        self.model_name = model_name
+        self.hubs = list(hubs)
+        self.spokes = list(spokes)
+        self.sums = np.zeros((0, 0), dtype=np.float32) if sums is None else np.asarray(sums, dtype=np.float32)
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        self.rows = {spoke: row for row, spoke in enumerate(self.spokes)}
+
+    @classmethod
+    def load(cls, path: str):
+        """Load the centroids stored with an output."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(str(data["model_name"]), data["hubs"].tolist(), data["spokes"].tolist(), data["sums"],
+                       data["counts"])
+
+    def save(self, path: str):
+        """Store the centroids, next to the output they belong to."""
+        np.savez(path, model_name=np.array(self.model_name), hubs=np.array(self.hubs, dtype=str),
+                 spokes=np.array(self.spokes, dtype=str), sums=self.sums, counts=self.counts)
+
+    def add(self, hubs, spokes, embeddings):
+        """Add keywords to the centroids of their spokes, creating the centroids of new spokes."""
+        spokes = np.asarray(spokes, dtype=object)
+        clustered = spokes != "no_cluster"
+        codes, names = pd.factorize(spokes[clustered])
+        if not len(names):
+            return
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=len(names))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.add.reduceat(normalise_embeddings(embeddings)[clustered][order], starts, axis=0)
+        # A new spoke takes the hub of its first keyword
+        first_hubs = np.asarray(hubs, dtype=object)[clustered][order[starts]]
+
+        rows = np.array([self.rows.get(name, -1) for name in names], dtype=np.int64)
+        existing = rows >= 0
+        if not len(self.sums):
+            self.sums = np.zeros((0, sums.shape[1]), dtype=np.float32)
+        self.sums[rows[existing]] += sums[existing]
+        self.counts[rows[existing]] += counts[existing]
+        for name, hub in zip(names[~existing], first_hubs[~existing]):
+            self.rows[name] = len(self.spokes)
+            self.spokes.append(name)
+            self.hubs.append(hub)
+        self.sums = np.concatenate([self.sums, sums[~existing]])
+        self.counts = np.concatenate([self.counts, counts[~existing]])
+
+    def assign(self, embeddings, min_similarity: float):
+        """Return the row of the nearest centroid of each embedding, -1 when it is below min_similarity."""
+        embeddings = normalise_embeddings(embeddings)
+        nearest = np.full(len(embeddings), -1, dtype=np.int64)
+        if not self.spokes:
+            return nearest
+        centroids = normalise_embeddings(self.sums)
+        for start in range(0, len(embeddings), CENTROID_BLOCK_SIZE):
+            scores = embeddings[start:start + CENTROID_BLOCK_SIZE] @ centroids.T
+            best = scores.argmax(axis=1)
+            similar = scores[np.arange(len(best)), best] >= min_similarity
+            nearest[start:start + CENTROID_BLOCK_SIZE][similar] = best[similar]
+        return nearest
+
+def get_centroids_path(output_path: str):
+    """Return the path of the centroids stored with an output."""
+    return os.path.splitext(output_path)[0] + CENTROIDS_SUFFIX
+
+def load_previous_output(file_path: str):
+    """Load an earlier output, the workbook written by this tool or a CSV file with hub, spoke and keyword columns."""
+    if os.path.splitext(file_path)[1].lower() in ('.xlsx', '.xls'):
+        return pd.read_excel(file_path, sheet_name='Clustered Keywords')
+    return load_file(file_path)
+
+def detect_encoding(file_path: str, sample_size: int = ENCODING_SAMPLE_SIZE):
+    """Detect the encoding from the byte order mark, or with chardet on a bounded sample of the file."""
+    with open(file_path, 'rb') as file:
+        sample = file.read(sample_size)
+
+    for byte_order_mark, encoding_value in BYTE_ORDER_MARKS:
+        if sample.startswith(byte_order_mark):
+            return encoding_value
+
+    encoding_value = chardet.detect(sample)["encoding"] or "utf-8"
+    # An ASCII-only sample says nothing about the rest of the file, UTF-8 is a safe superset
+    if encoding_value.lower() == "ascii":
+        encoding_value = "utf-8"
+
+    # Fall back when the sample does not decode, it may end part way through a character
+    for candidate in (encoding_value, "utf-8"):
+        try:
+            codecs.getincrementaldecoder(candidate)().decode(sample, final=False)
+            return candidate
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return "latin-1"
+
+def load_file(file_path: str, usecols=None, chunksize: int = None):
+    """Load a CSV file and return a DataFrame, or an iterator of DataFrames when chunksize is set."""
+    encoding_value = detect_encoding(file_path)
     white_space = False if encoding_value != "UTF-16" else True
 
     df = pd.read_csv(
         file_path,
         encoding=encoding_value,
+        encoding_errors='replace',
         delim_whitespace=white_space,
         on_bad_lines='skip',
+        usecols=usecols,
+        chunksize=chunksize,
     )
     return df
 
@@ -125,15 +540,22 @@ def create_chart(df, chart_type, output_path, volume):
 
 @app.command()
 def main(
+        ann_probes: int = typer.Option(ANN_PROBES, help="Number of inverted lists searched per keyword by the ann engine."),
+        ann_top_k: int = typer.Option(ANN_TOP_K, help="Number of nearest neighbours linked per keyword by the ann engine. 1 links each keyword to its best match as polyfuzz does, larger values chain more keywords into the same clusters."),
+        cache: bool = typer.Option(True, help="Whether to reuse the keyword embeddings cached by earlier runs."),
+        cache_dir: str = typer.Option(EMBEDDING_CACHE_DIR, help="Directory of the keyword embedding cache."),
         chart_type: str = typer.Option("treemap", help="Type of chart to generate. 'sunburst' or 'treemap'."),
         column_name: str = typer.Option(None, help='Name of the column in your CSV to be processed.'),
         device: str = typer.Option("cpu", help="Device to be used by SentenceTransformer. 'cpu' or 'cuda'."),
+        embedding_dtype: str = typer.Option("float32", help="Precision of the cached embeddings. 'float32' or 'float16'."),
+        engine: str = typer.Option("polyfuzz", help="Clustering engine. 'polyfuzz' or 'ann', which scales to millions of keywords."),
         excel_pivot: bool = typer.Option(False, help="Whether to save the output as an Excel pivot table."),
         file_path: str = typer.Argument(..., help='Path to your CSV file.'),
         min_similarity: float = typer.Option(0.80, help="Minimum similarity for clustering."),
         model_name: str = typer.Option("all-MiniLM-L6-v2",
                                        help="Name of the SentenceTransformer model to use. For available models, refer to https://www.sbert.net/docs/pretrained_models.html"),
         output_path: str = typer.Option(None, help='Path where the output CSV will be saved.'),
+        previous_output: str = typer.Option(None, help="Earlier output to update. Its clustered keywords keep their clusters, new and no_cluster keywords join the nearest cluster above --min-similarity or are clustered among themselves."),
         remove_dupes: bool = typer.Option(True, help="Whether to remove duplicates from the dataset."),
         stem: bool = typer.Option(False, "--stem", help="Whether to perform stemming on the 'hub' column.", show_default=False),
         volume: str = typer.Option(None, help='Name of the column containing numerical values. If --volume is used, the keyword with the largest volume will be used as the name of the cluster. If not, the shortest word will be used.')
@@ -155,6 +577,14 @@ def main(
         print("[bold magenta]Invalid device. Valid options are 'cpu' and 'cuda'.[/bold magenta]")
         return
 
+    if engine not in CLUSTERING_ENGINES:
+        print("[bold magenta]Invalid engine. Valid options are 'polyfuzz' and 'ann'.[/bold magenta]")
+        return
+
+    if embedding_dtype not in EMBEDDING_DTYPES:
+        print("[bold magenta]Invalid embedding dtype. Valid options are 'float32' and 'float16'.[/bold magenta]")
+        return
+
     try:
         model = get_model(model_name)
     except Exception as e:
@@ -184,19 +614,45 @@ def main(
         print(f"[bold magenta]The column name {volume} is not in the DataFrame.[/bold magenta]")
         return
 
+    previous = None
+    centroids = None
+    if previous_output is not None:
+        try:
+            previous = load_previous_output(previous_output)
+        except FileNotFoundError as e:
+            print(f"[bold magenta]The file {previous_output} does not exist.[/bold magenta]")
+            return
+        except ValueError as e:
+            print(f"[bold magenta]Failed to load the previous output: {e}[/bold magenta]")
+            return
+
+        if not {'hub', 'spoke', 'keyword'}.issubset(previous.columns):
+            print(f"[bold magenta]The previous output {previous_output} needs hub, spoke and keyword columns.[/bold magenta]")
+            return
+
+        centroids_path = get_centroids_path(previous_output)
+        if os.path.exists(centroids_path):
+            centroids = ClusterCentroids.load(centroids_path)
+            if centroids.model_name != model_name:
+                print(f"[bold magenta]The previous output was clustered with {centroids.model_name}, use the same --model-name to update it.[/bold magenta]")
+                return
+
         # Print options
     options_message = (
         f"[cyan]File path:[/cyan] [bold magenta]{file_path}[/bold magenta]\n"
         f"[cyan]Column name:[/cyan] [bold magenta]{column_name}[/bold magenta]\n"
         f"[cyan]Output path:[/cyan] [bold magenta]{output_path}[/bold magenta]\n"
+        f"[cyan]Previous output:[/cyan] [bold magenta]{previous_output}[/bold magenta]\n"
         f"[cyan]Chart type:[/cyan] [bold magenta]{chart_type}[/bold magenta]\n"
         f"[cyan]Device:[/cyan] [bold magenta]{device}[/bold magenta]\n"
         f"[cyan]SentenceTransformer model:[/cyan] [bold magenta]{model_name}[/bold magenta]\n"
         f"[cyan]Minimum similarity:[/cyan] [bold magenta]{min_similarity}[/bold magenta]\n"
+        f"[cyan]Clustering engine:[/cyan] [bold magenta]{engine}[/bold magenta]\n"
         f"[cyan]Remove duplicates:[/cyan] [bold magenta]{remove_dupes}[/bold magenta]\n"
         f"[cyan]Excel Pivot:[/cyan] [bold magenta]{excel_pivot}[/bold magenta]\n"
         f"[cyan]Volume column:[/cyan] [bold magenta]{volume}[/bold magenta]\n"
-        f"[cyan]Stemming enabled:[/cyan] [bold magenta]{stem}[/bold magenta]"
+        f"[cyan]Stemming enabled:[/cyan] [bold magenta]{stem}[/bold magenta]\n"
+        f"[cyan]Embedding cache:[/cyan] [bold magenta]{cache_dir if cache else 'disabled'}[/bold magenta]"
     )
     panel = Panel.fit(options_message, title="[b]Using The Following Options[/b]", style="magenta", border_style="black")
     console.print(panel)
@@ -212,38 +668,90 @@ def main(
 
     embedding_model = SentenceTransformer(model_name, device=device)
     distance_model = SentenceEmbeddings(embedding_model)
+    embedding_cache = None
+    if cache:
+        embedding_cache = EmbeddingCache(embedding_model, model_name, cache_dir, embedding_dtype)
+
+    encoder = embedding_cache if embedding_cache is not None else embedding_model
+    embeddings = None
 
     # clustering started message
     message = "Clustering keywords, this can take a while!"
     print_messages(message)
 
+    df_incremental = None
+    if previous is not None:
+        # Keywords of the previous output keep their hub and spoke
+        previous = previous.dropna(subset=['keyword'])
+        previous_clusters = previous[['hub', 'spoke']].astype(str)
+        previous_clusters.index = previous['keyword'].astype(str).map(normalise_keyword)
+        previous_clusters = previous_clusters[~previous_clusters.index.duplicated()]
+        # Keywords the previous output left in no_cluster are clustered again, with the new keywords
+        previous_clusters = previous_clusters[previous_clusters['spoke'] != "no_cluster"]
+        keys = df['keyword'].map(normalise_keyword)
+        known = keys.isin(previous_clusters.index).to_numpy()
+        df_known = df[known].copy()
+        df_known['hub'] = keys[known].map(previous_clusters['hub']).to_numpy()
+        df_known['spoke'] = keys[known].map(previous_clusters['spoke']).to_numpy()
+
+        if centroids is None:
+            # The output predates the stored centroids, they are rebuilt from its keywords once
+            centroids = ClusterCentroids(model_name)
+            if len(previous):
+                centroids.add(previous['hub'].astype(str), previous['spoke'].astype(str),
+                              encoder.encode(previous['keyword'].astype(str).to_list()))
+
+        # New and unclustered keywords join the nearest existing cluster when it is similar enough
+        df_new = df[~known]
+        nearest = np.full(len(df_new), -1, dtype=np.int64)
+        if len(df_new):
+            embeddings = np.asarray(encoder.encode(df_new['keyword'].to_list()), dtype=np.float32)
+            nearest = centroids.assign(embeddings, min_similarity)
+        assigned = nearest >= 0
+        df_assigned = df_new[assigned].copy()
+        df_assigned['hub'] = [centroids.hubs[row] for row in nearest[assigned]]
+        df_assigned['spoke'] = [centroids.spokes[row] for row in nearest[assigned]]
+        if assigned.any():
+            centroids.add(df_assigned['hub'], df_assigned['spoke'], embeddings[assigned])
+        df_incremental = pd.concat([df_known, df_assigned])
+
+        # Only the keywords that fit no existing cluster are clustered, among themselves
+        df = df_new[~assigned]
+        embeddings = embeddings[~assigned] if embeddings is not None else None
+        from_list = df['keyword'].to_list()
+        message += (f"\n{len(df_known)} keywords kept their cluster, {len(df_assigned)} new or unclustered "
+                    f"keywords joined an existing cluster, {len(from_list)} keywords left to cluster.")
+        print_messages(message)
+
+    if not from_list:
+        df_cluster = pd.DataFrame(columns=['From', 'To', 'Similarity', 'Group'])
+    elif engine == "ann":
+        if embeddings is None:
+            embeddings = encoder.encode(from_list)
+        df_cluster = cluster_keywords_with_ann(from_list, embeddings, min_similarity, ann_top_k, ann_probes)
+    else:
+        # PolyFuzz encodes through the model of the distance model, the keywords encoded once here stand in for it
+        if embeddings is None:
+            embeddings = encoder.encode(from_list)
+        distance_model.embedding_model = EncodedKeywords(from_list, embeddings)
+        model = PolyFuzz(distance_model)
+        model = model.fit(from_list)
+        model.group(link_min_similarity=min_similarity)
 
-    model = PolyFuzz(distance_model)
-    model = model.fit(from_list)
-    model.group(link_min_similarity=min_similarity)
-
-    df_cluster = model.get_matches()
-    df_cluster["Group"] = df_cluster.apply(lambda row: "no_cluster" if row["Similarity"] < min_similarity else row["Group"], axis=1)
+        df_cluster = model.get_matches()
+    df_cluster["Group"] = np.where(df_cluster["Similarity"] < min_similarity, "no_cluster", df_cluster["Group"])
 
     # this logic moves exact matches back into the right group. Sometimes they can stray when they have an identical
     # match score with a different group. for example 2 socks vs two socks with score the same.
 
-    data_dict = df_cluster.groupby('Group')['From'].apply(list).to_dict()
-
-    # Check for each Group if it exists in its corresponding From values
-    for group, from_values in data_dict.items():
-        if group not in from_values:
-            # If it doesn't exist, add it to the From values of that Group
-            from_values.append(group)
-
-    # Convert the updated dictionary back to a DataFrame
-    df_missing = pd.DataFrame([(k, v) for k, vs in data_dict.items() for v in vs], columns=['Group', 'From'])
-
-    df_missing = pd.concat([df_cluster, df_missing], ignore_index=True)
-    df_missing['Match'] = df_missing['From'] == df_missing['Group']
-    df_missing = df_missing[df_missing["Match"].isin([True])]
-    df_missing = df_missing.drop('Match', axis=1)
-    df_missing.drop_duplicates(subset=["Group", "From"], keep="first", inplace=True)
+    # Every group gets a row mapping it to itself: the first such row of the matches, or a new one for the groups
+    # that are not a keyword of their own group, in group order
+    df_self = df_cluster[df_cluster['From'] == df_cluster['Group']]
+    df_self = df_self.drop_duplicates(subset=["Group", "From"], keep="first")
+    groups = pd.Index(sorted(df_cluster['Group'].dropna().unique()))
+    missing_groups = groups[~groups.isin(df_self['Group'])]
+    df_missing = pd.concat([df_self, pd.DataFrame({'Group': missing_groups, 'From': missing_groups})],
+                           ignore_index=True)
     df_missing['Similarity'] = 1
     df_cluster = pd.concat([df_cluster, df_missing])
     df_cluster = df_cluster.sort_values(by="Similarity", ascending=False)
@@ -255,7 +763,7 @@ def main(
     df['cluster_size'] = df['spoke'].map(df.groupby('spoke')['spoke'].count())
     df.loc[df["cluster_size"] == 1, "spoke"] = "no_cluster"
     df.insert(0, 'spoke', df.pop('spoke'))
-    df['keyword_len'] = df['keyword'].astype(str).apply(len)
+    df['keyword_len'] = df['keyword'].astype(str).str.len()
     if volume is not None:
         df[volume] = df[volume].astype(str).replace({'': '0', 'nan': '0'}).str.replace('\D', '', regex=True).astype(int)
 
@@ -263,9 +771,9 @@ def main(
     else:
         df = df.sort_values(by="keyword_len", ascending=True)
 
-    df.insert(0, 'hub', df['spoke'].apply(lambda x: create_unigram(x, stem)))
-
-    df['hub'] = df['hub'].apply(lambda x: stem_and_remove_punctuation(x, stem))
+    # The hub only depends on the spoke, so it is worked out once per cluster
+    hubs = {spoke: stem_and_remove_punctuation(create_unigram(spoke, stem), stem) for spoke in df['spoke'].unique()}
+    df.insert(0, 'hub', df['spoke'].map(hubs))
 
     df = df[
         ['hub', 'spoke', 'cluster_size'] + [col for col in df.columns if col not in ['hub', 'spoke', 'cluster_size']]]
@@ -275,7 +783,7 @@ def main(
         df[volume] = df[volume].replace({'': 0, np.nan: 0}).astype(int)
         df = df.sort_values(by=volume, ascending=False)
     else:
-        df['keyword_len'] = df['keyword'].astype(str).apply(len)
+        df['keyword_len'] = df['keyword'].astype(str).str.len()
         df = df.sort_values(by="keyword_len", ascending=True)
 
     # Use the first keyword in each sorted group as the cluster name.
@@ -285,7 +793,23 @@ def main(
 
     df['spoke'] = (df['spoke'].str.split()).str.join(' ')
 
+    if df_incremental is not None:
+        df = pd.concat([df_incremental, df])
+        df['cluster_size'] = df['spoke'].map(df['spoke'].value_counts())
+        df['keyword_len'] = df['keyword'].astype(str).str.len()
+        if volume is not None:
+            df[volume] = df[volume].astype(str).replace({'': '0', 'nan': '0'}).str.replace('\D', '', regex=True).astype(int)
+            df = df.sort_values(by=volume, ascending=False)
+        else:
+            df = df.sort_values(by="keyword_len", ascending=True)
+        df = df[
+            ['hub', 'spoke', 'cluster_size'] + [col for col in df.columns if col not in ['hub', 'spoke', 'cluster_size']]]
+        df.sort_values(["spoke", "cluster_size"], ascending=[True, False], inplace=True)
+
     message += f"\nAll keywords clustered successfully. Took {round(time.time() - startTime, 2)} seconds!"
+    if embedding_cache is not None:
+        message += (f"\nEmbedding cache: {embedding_cache.hits} hits, "
+                    f"{embedding_cache.misses} keywords encoded.")
     print_messages(message)
 
 
@@ -296,8 +820,7 @@ def main(
     df.drop(columns=['cluster_size', 'keyword_len'], inplace=True)
 
     # logic to fix no_cluster hub and spoke names
-    df["hub"] = df["hub"].apply(lambda x: "no_cluster" if x == "noclust" else x)
-    df["hub"] = df["hub"].apply(lambda x: "no_cluster" if x == "nocluster" else x)
+    df["hub"] = df["hub"].replace({"noclust": "no_cluster", "nocluster": "no_cluster"})
     df.loc[df["hub"] == "no_cluster", "spoke"] = "no_cluster"
 
     create_chart(df, chart_type, output_path, volume)
@@ -305,6 +828,17 @@ def main(
     output_dir = os.getcwd()
     output_path = os.path.join(output_dir, output_path+ '_output.xlsx')
 
+    # The centroids are stored with the output for the next incremental run, only the keywords clustered by this
+    # run are added to them
+    if centroids is None:
+        centroids = ClusterCentroids(model_name)
+    if from_list:
+        keyword_rows = dict(zip(from_list, range(len(from_list))))
+        df_clustered = df[df['keyword'].isin(keyword_rows)]
+        centroids.add(df_clustered['hub'], df_clustered['spoke'],
+                      np.asarray(embeddings)[[keyword_rows[keyword] for keyword in df_clustered['keyword']]])
+    centroids.save(get_centroids_path(output_path))
+
     if excel_pivot and IS_WINDOWS:
         try:
             # Save the DataFrame to an Excel file
@@ -9,15 +9,23 @@ The script accepts several parameters:
 - MODEL_NAME: The name of the SentenceTransformer model to be used.
 - MIN_SIMILARITY: The minimum similarity for two keywords to be considered in the same cluster.
 - REMOVE_DUPES: Whether to remove duplicate keywords.
+- CACHE_EMBEDDINGS: Whether to reuse the keyword embeddings cached by earlier runs, stored in EMBEDDING_CACHE_DIR
+  with EMBEDDING_DTYPE ('float32' or 'float16') precision. Only keywords missing from the cache are encoded.
 
 To use the script, make sure the required libraries are installed (`pip install sentence_transformers polyfuzz nltk plotly pandas chardet`), adjust the parameters as needed, and run the script. The progress of the script will be printed to the console.
 """
 
 import time
+import hashlib
+import json
+import re
+import unicodedata
 import chardet
+import numpy as np
 import pandas as pd
 import os
 from collections import Counter
+from contextlib import contextmanager
 from sentence_transformers import SentenceTransformer
 from polyfuzz import PolyFuzz
 from polyfuzz.models import SentenceEmbeddings
@@ -25,6 +33,11 @@ import plotly.express as px
 import plotly.io as pio
 from rich import print
 
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
 # File paths and column name specified outside of the function
 FILE_PATH = "/python_scripts/waw_keywords.csv"
 COLUMN_NAME = "Keyword"
@@ -40,6 +53,10 @@ MODEL_NAME = "paraphrase-MiniLM-L3-v2"  # fastest, lowest semantic matching
 MIN_SIMILARITY = 0.85
 REMOVE_DUPES = True
 
+CACHE_EMBEDDINGS = True
+EMBEDDING_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "keyword-clustering", "embeddings")
+EMBEDDING_DTYPE = "float32"
+
 
 def create_unigram(cluster: str):
     """Create unigram from the cluster and return the most common word."""
@@ -77,6 +94,133 @@ def load_file(file_path: str):
     return df
 
 
+def normalise_keyword(keyword: str):
+    """Normalise a keyword for the embedding cache: NFKC, lower case and single spaces."""
+    return ' '.join(unicodedata.normalize('NFKC', keyword).lower().split())
+
+
+class EmbeddingCache:
+    """Persistent keyword embeddings for one SentenceTransformer model.
+
+    The vectors are appended to a raw float32/float16 matrix that is read through a memory map, with the
+    64 bit hashes of the normalised keywords in the same row order as the index. Only keywords that are
+    not in the cache yet are encoded.
+    """
+
+    def __init__(self, model, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR, dtype: str = "float32"):
+        self.model = model
+        self.dtype = np.dtype(dtype)
+        safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', model_name)[-80:]
+        model_hash = hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:8]
+        self.directory = os.path.join(cache_dir, f"{safe_name}-{model_hash}-{self.dtype.name}")
+        self.matrix_path = os.path.join(self.directory, "embeddings.bin")
+        self.index_path = os.path.join(self.directory, "index.bin")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.lock_path = os.path.join(self.directory, "append.lock")
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        """Memory map the cached matrix and sort the hash index for lookups."""
+        meta = {"rows": 0, "dimension": None}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        self.rows, self.dimension = meta["rows"], meta["dimension"]
+
+        # Rows past the recorded count were left by an interrupted run and are ignored
+        if self.rows:
+            self.matrix = np.memmap(self.matrix_path, dtype=self.dtype, mode='r', shape=(self.rows, self.dimension))
+            hashes = np.fromfile(self.index_path, dtype=np.uint64, count=self.rows)
+        else:
+            self.matrix = None
+            hashes = np.array([], dtype=np.uint64)
+        self.sorted_rows = np.argsort(hashes, kind='stable')
+        self.sorted_hashes = hashes[self.sorted_rows]
+
+    @staticmethod
+    def hash_keywords(keywords):
+        """Return the 64 bit hash of each normalised keyword."""
+        return np.array([int.from_bytes(hashlib.blake2b(keyword.encode('utf-8'), digest_size=8).digest(), 'little')
+                         for keyword in keywords], dtype=np.uint64)
+
+    def lookup(self, hashes):
+        """Return the cache row of each hash, -1 when it is not cached."""
+        rows = np.full(len(hashes), -1, dtype=np.int64)
+        if not len(self.sorted_hashes):
+            return rows
+        positions = np.minimum(np.searchsorted(self.sorted_hashes, hashes), len(self.sorted_hashes) - 1)
+        found = self.sorted_hashes[positions] == hashes
+        rows[found] = self.sorted_rows[positions[found]]
+        return rows
+
+    @contextmanager
+    def lock(self):
+        """Hold an exclusive lock on the cache directory, so that concurrent runs append one at a time."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a+b') as lock_file:
+            if os.name == 'nt':
+                # msvcrt gives up after ten attempts a second apart, so keep waiting for the other run
+                while True:
+                    try:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if os.name == 'nt':
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def append(self, hashes, embeddings):
+        """Append new embeddings to the cache and return their rows."""
+        embeddings = np.asarray(embeddings, dtype=self.dtype)
+        with self.lock():
+            # Another run may have added rows since the cache was loaded
+            self._load()
+            self.dimension = embeddings.shape[1]
+            with open(self.matrix_path, 'ab') as matrix_file:
+                matrix_file.truncate(self.rows * self.dimension * self.dtype.itemsize)
+                matrix_file.write(embeddings.tobytes())
+            with open(self.index_path, 'ab') as index_file:
+                index_file.truncate(self.rows * 8)
+                index_file.write(hashes.astype(np.uint64).tobytes())
+
+            # The metadata is replaced last, so the new rows only count once they are fully written
+            new_rows = np.arange(self.rows, self.rows + len(hashes))
+            temp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as meta_file:
+                json.dump({"rows": self.rows + len(hashes), "dimension": self.dimension, "dtype": self.dtype.name},
+                          meta_file)
+            os.replace(temp_path, self.meta_path)
+            self._load()
+        return new_rows
+
+    def encode(self, keywords, batch_size: int = 32, show_progress_bar: bool = False):
+        """Return float32 embeddings of the keywords, encoding only the ones missing from the cache."""
+        codes, unique_keywords = pd.factorize(pd.Series([normalise_keyword(str(k)) for k in keywords], dtype=object))
+        hashes = self.hash_keywords(unique_keywords)
+        rows = self.lookup(hashes)
+        missing = np.flatnonzero(rows < 0)
+        self.hits += len(rows) - len(missing)
+        self.misses += len(missing)
+        if len(missing):
+            new_embeddings = self.model.encode([unique_keywords[i] for i in missing], batch_size=batch_size,
+                                               show_progress_bar=show_progress_bar, convert_to_numpy=True)
+            rows[missing] = self.append(hashes[missing], new_embeddings)
+        if not len(rows):
+            return np.zeros((0, self.dimension or 0), dtype=np.float32)
+        return np.asarray(self.matrix[rows], dtype=np.float32)[codes]
+
+
 def create_chart(df, chart_type):
     """Create a sunburst chart or a treemap."""
     if chart_type == "sunburst":
@@ -125,6 +269,10 @@ def main():
 
     embedding_model = SentenceTransformer(MODEL_NAME, device=DEVICE)
     distance_model = SentenceEmbeddings(embedding_model)
+    if CACHE_EMBEDDINGS:
+        # PolyFuzz encodes through the model of the distance model, the cache stands in for it
+        distance_model.embedding_model = EmbeddingCache(embedding_model, MODEL_NAME, EMBEDDING_CACHE_DIR,
+                                                        EMBEDDING_DTYPE)
 
     startTime = time.time()
     print("[bold green]Starting to cluster keywords...[/bold green]")
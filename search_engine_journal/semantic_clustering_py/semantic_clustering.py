@@ -1,13 +1,299 @@
 import sys
 import os
 import time
+import hashlib
+import json
+import re
+import unicodedata
+import numpy as np
 import pandas as pd
 import questionary
 import glob
-from sentence_transformers import SentenceTransformer, util
+from contextlib import contextmanager
+from sentence_transformers import SentenceTransformer
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+MODEL_NAME = 'paraphrase-MiniLM-L3-v2'
+# Embeddings are cached across runs, so overlapping keyword lists only encode the new keywords
+EMBEDDING_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "keyword-clustering", "embeddings")
+EMBEDDING_DTYPE = "float32"
+MIN_SIMILARITY = 0.75
+# Keywords are encoded once and their neighbours above MIN_SIMILARITY found in blocks of rows, so the similarity
+# matrix is never held in memory. A community is at most COMMUNITY_MAX_SIZE keywords.
+COMMUNITY_MIN_SIZE = 2
+COMMUNITY_MAX_SIZE = 1000
+COMMUNITY_BLOCK_ELEMENTS = 2 ** 24
+# Set to an earlier output CSV to update it: its clustered keywords keep their cluster, new and unclustered
+# keywords join the nearest cluster above MIN_SIMILARITY and only the rest are clustered. The centroids of the
+# clusters are stored next to every output.
+PREVIOUS_OUTPUT = None
+CENTROIDS_SUFFIX = "_centroids.npz"
+CENTROID_BLOCK_SIZE = 4096
+NO_CLUSTER_NAME = "zzz_no_cluster"
+
+
+def normalise_keyword(keyword: str):
+    """Normalise a keyword for the embedding cache: NFKC, lower case and single spaces."""
+    return ' '.join(unicodedata.normalize('NFKC', keyword).lower().split())
+
+
+class EmbeddingCache:
+    """Persistent keyword embeddings for one SentenceTransformer model.
+
+    The vectors are appended to a raw float32/float16 matrix that is read through a memory map, with the
+    64 bit hashes of the normalised keywords in the same row order as the index. Only keywords that are
+    not in the cache yet are encoded.
+    """
+
+    def __init__(self, model, model_name: str, cache_dir: str, dtype: str = "float32"):
+        self.model = model
+        self.dtype = np.dtype(dtype)
+        safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', model_name)[-80:]
+        model_hash = hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:8]
+        self.directory = os.path.join(cache_dir, f"{safe_name}-{model_hash}-{self.dtype.name}")
+        self.matrix_path = os.path.join(self.directory, "embeddings.bin")
+        self.index_path = os.path.join(self.directory, "index.bin")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.lock_path = os.path.join(self.directory, "append.lock")
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        """Memory map the cached matrix and sort the hash index for lookups."""
+        meta = {"rows": 0, "dimension": None}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        self.rows, self.dimension = meta["rows"], meta["dimension"]
+
+        # Rows past the recorded count were left by an interrupted run and are ignored
+        if self.rows:
+            self.matrix = np.memmap(self.matrix_path, dtype=self.dtype, mode='r', shape=(self.rows, self.dimension))
+            hashes = np.fromfile(self.index_path, dtype=np.uint64, count=self.rows)
+        else:
+            self.matrix = None
+            hashes = np.array([], dtype=np.uint64)
+        self.sorted_rows = np.argsort(hashes, kind='stable')
+        self.sorted_hashes = hashes[self.sorted_rows]
+
+    @staticmethod
+    def hash_keywords(keywords):
+        """Return the 64 bit hash of each normalised keyword."""
+        return np.array([int.from_bytes(hashlib.blake2b(keyword.encode('utf-8'), digest_size=8).digest(), 'little')
+                         for keyword in keywords], dtype=np.uint64)
+
+    def lookup(self, hashes):
+        """Return the cache row of each hash, -1 when it is not cached."""
+        rows = np.full(len(hashes), -1, dtype=np.int64)
+        if not len(self.sorted_hashes):
+            return rows
+        positions = np.minimum(np.searchsorted(self.sorted_hashes, hashes), len(self.sorted_hashes) - 1)
+        found = self.sorted_hashes[positions] == hashes
+        rows[found] = self.sorted_rows[positions[found]]
+        return rows
+
+    @contextmanager
+    def lock(self):
+        """Hold an exclusive lock on the cache directory, so that concurrent runs append one at a time."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a+b') as lock_file:
+            if os.name == 'nt':
+                # msvcrt gives up after ten attempts a second apart, so keep waiting for the other run
+                while True:
+                    try:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if os.name == 'nt':
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def append(self, hashes, embeddings):
+        """Append new embeddings to the cache and return their rows."""
+        embeddings = np.asarray(embeddings, dtype=self.dtype)
+        with self.lock():
+            # Another run may have added rows since the cache was loaded
+            self._load()
+            self.dimension = embeddings.shape[1]
+            with open(self.matrix_path, 'ab') as matrix_file:
+                matrix_file.truncate(self.rows * self.dimension * self.dtype.itemsize)
+                matrix_file.write(embeddings.tobytes())
+            with open(self.index_path, 'ab') as index_file:
+                index_file.truncate(self.rows * 8)
+                index_file.write(hashes.astype(np.uint64).tobytes())
+
+            # The metadata is replaced last, so the new rows only count once they are fully written
+            new_rows = np.arange(self.rows, self.rows + len(hashes))
+            temp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as meta_file:
+                json.dump({"rows": self.rows + len(hashes), "dimension": self.dimension, "dtype": self.dtype.name},
+                          meta_file)
+            os.replace(temp_path, self.meta_path)
+            self._load()
+        return new_rows
+
+    def encode(self, keywords, batch_size: int = 32, show_progress_bar: bool = False):
+        """Return float32 embeddings of the keywords, encoding only the ones missing from the cache."""
+        codes, unique_keywords = pd.factorize(pd.Series([normalise_keyword(str(k)) for k in keywords], dtype=object))
+        hashes = self.hash_keywords(unique_keywords)
+        rows = self.lookup(hashes)
+        missing = np.flatnonzero(rows < 0)
+        self.hits += len(rows) - len(missing)
+        self.misses += len(missing)
+        if len(missing):
+            new_embeddings = self.model.encode([unique_keywords[i] for i in missing], batch_size=batch_size,
+                                               show_progress_bar=show_progress_bar, convert_to_numpy=True)
+            rows[missing] = self.append(hashes[missing], new_embeddings)
+        if not len(rows):
+            return np.zeros((0, self.dimension or 0), dtype=np.float32)
+        return np.asarray(self.matrix[rows], dtype=np.float32)[codes]
+
+
+def normalise_embeddings(embeddings):
+    """Return L2 normalised float32 embeddings, so that dot products are cosine similarities."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+class ClusterCentroids:
+    """Centroids of the clusters of an output, kept up to date as keywords are added to the clusters.
+
+    Every cluster keeps the sum and the count of the normalised embeddings of its keywords, its centroid is the
+    normalised sum. Unclustered keywords have no centroid.
+    """
+
+    def __init__(self, model_name: str, names=(), sums=None, counts=None):
+        self.model_name = model_name
+        self.names = list(names)
+        self.sums = np.zeros((0, 0), dtype=np.float32) if sums is None else np.asarray(sums, dtype=np.float32)
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        self.rows = {name: row for row, name in enumerate(self.names)}
+
+    @classmethod
+    def load(cls, path: str):
+        """Load the centroids stored with an output."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(str(data["model_name"]), data["names"].tolist(), data["sums"], data["counts"])
+
+    def save(self, path: str):
+        """Store the centroids, next to the output they belong to."""
+        np.savez(path, model_name=np.array(self.model_name), names=np.array(self.names, dtype=str), sums=self.sums,
+                 counts=self.counts)
+
+    def add(self, names, embeddings):
+        """Add keywords to the centroids of their clusters, creating the centroids of new clusters."""
+        names = np.asarray(names, dtype=object)
+        clustered = names != NO_CLUSTER_NAME
+        codes, cluster_names = pd.factorize(names[clustered])
+        if not len(cluster_names):
+            return
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=len(cluster_names))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.add.reduceat(normalise_embeddings(embeddings)[clustered][order], starts, axis=0)
+
+        rows = np.array([self.rows.get(name, -1) for name in cluster_names], dtype=np.int64)
+        existing = rows >= 0
+        if not len(self.sums):
+            self.sums = np.zeros((0, sums.shape[1]), dtype=np.float32)
+        self.sums[rows[existing]] += sums[existing]
+        self.counts[rows[existing]] += counts[existing]
+        for name in cluster_names[~existing]:
+            self.rows[name] = len(self.names)
+            self.names.append(name)
+        self.sums = np.concatenate([self.sums, sums[~existing]])
+        self.counts = np.concatenate([self.counts, counts[~existing]])
+
+    def assign(self, embeddings, min_similarity: float):
+        """Return the row of the nearest centroid of each embedding, -1 when it is below min_similarity."""
+        embeddings = normalise_embeddings(embeddings)
+        nearest = np.full(len(embeddings), -1, dtype=np.int64)
+        if not self.names:
+            return nearest
+        centroids = normalise_embeddings(self.sums)
+        for start in range(0, len(embeddings), CENTROID_BLOCK_SIZE):
+            scores = embeddings[start:start + CENTROID_BLOCK_SIZE] @ centroids.T
+            best = scores.argmax(axis=1)
+            similar = scores[np.arange(len(best)), best] >= min_similarity
+            nearest[start:start + CENTROID_BLOCK_SIZE][similar] = best[similar]
+        return nearest
+
+
+def find_neighbours(embeddings, threshold: float, max_neighbours: int = COMMUNITY_MAX_SIZE):
+    """Return the neighbours of each keyword with a cosine similarity of at least threshold, most similar first.
+
+    Every keyword is its own first neighbour. The neighbours of keyword i are neighbours[offsets[i]:offsets[i + 1]],
+    at most max_neighbours of them.
+    """
+    embeddings = normalise_embeddings(embeddings)
+    n = len(embeddings)
+    counts = np.zeros(n, dtype=np.int64)
+    neighbours = [np.zeros(0, dtype=np.int64)]
+    block_size = max(1, COMMUNITY_BLOCK_ELEMENTS // max(n, 1))
+    for start in range(0, n, block_size):
+        scores = embeddings[start:start + block_size] @ embeddings.T
+        block_rows = np.arange(len(scores))
+        scores[block_rows, start + block_rows] = np.inf
+        rows, columns = np.divmod(np.flatnonzero(scores >= threshold), n)
+        order = np.lexsort((-scores[rows, columns], rows))
+        rows, columns = rows[order], columns[order]
+        # Only the max_neighbours most similar neighbours of a keyword are kept
+        row_counts = np.bincount(rows, minlength=len(scores))
+        ranks = np.arange(len(rows)) - np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+        kept = ranks < max_neighbours
+        counts[start:start + len(scores)] = np.minimum(row_counts, max_neighbours)
+        neighbours.append(columns[kept])
+    return np.concatenate(([0], np.cumsum(counts))), np.concatenate(neighbours)
+
+
+def extract_communities(offsets, neighbours, min_size: int = COMMUNITY_MIN_SIZE):
+    """Extract communities of at least min_size keywords, largest first, with every keyword in at most one.
+
+    As with repeated util.community_detection calls on the keywords left over, every pass ranks the remaining
+    keywords by their number of remaining neighbours and a community keeps the neighbours not taken by a larger
+    one. Passes only update the mask of remaining keywords, nothing is encoded or scored again.
+    """
+    n = len(offsets) - 1
+    remaining = np.ones(n, dtype=bool)
+    neighbour_rows = np.repeat(np.arange(n), np.diff(offsets))
+    communities = []
+    while True:
+        sizes = np.bincount(neighbour_rows, weights=remaining[neighbours], minlength=n).astype(np.int64)
+        sizes[~remaining] = 0
+        candidates = np.flatnonzero(sizes >= min_size)
+        if not len(candidates):
+            return communities
+        for row in candidates[np.argsort(-sizes[candidates], kind='stable')]:
+            members = neighbours[offsets[row]:offsets[row + 1]]
+            members = members[remaining[members]]
+            if len(members) >= min_size:
+                communities.append(members)
+                remaining[members] = False
+
+
+def get_centroids_path(output_path: str):
+    """Return the path of the centroids stored with an output."""
+    return os.path.splitext(output_path)[0] + CENTROIDS_SUFFIX
+
 
 # Model for computing sentence embeddings. We use one trained for similar questions detection
-model = SentenceTransformer('paraphrase-MiniLM-L3-v2')  #1861  /  7.7
+model = SentenceTransformer(MODEL_NAME)  #1861  /  7.7
+embedding_cache = EmbeddingCache(model, MODEL_NAME, EMBEDDING_CACHE_DIR, EMBEDDING_DTYPE)
   
   
 # use glob to get all the csv files 
@@ -29,43 +315,70 @@ choice = questionary.select("Please select your keyword column", choices=cols).a
 # store the data
 cluster_name_list = []
 corpus_sentences_list = []
-df_all = []
 
 corpus_set = set(df[choice])
-corpus_set_all = corpus_set
 
-cluster = True
+# Cluster names of the keywords that are not clustered by this run, in an incremental run
+incremental_names = {}
+centroids = ClusterCentroids(MODEL_NAME)
+if PREVIOUS_OUTPUT:
+    previous = pd.read_csv(PREVIOUS_OUTPUT).dropna(subset=['Keyword'])
+    previous['Keyword'] = previous['Keyword'].astype(str)
+    centroids_path = get_centroids_path(PREVIOUS_OUTPUT)
+    if os.path.exists(centroids_path):
+        centroids = ClusterCentroids.load(centroids_path)
+    else:
+        # The output predates the stored centroids, they are rebuilt from its keywords once
+        centroids.add(previous['Cluster Name'].astype(str), embedding_cache.encode(previous['Keyword'].to_list()))
+    if centroids.model_name != MODEL_NAME:
+        sys.exit("The previous output was clustered with {}, set MODEL_NAME to update it.".format(centroids.model_name))
 
-while cluster:
+    # Keywords of the previous output keep their cluster, the ones it left in NO_CLUSTER_NAME are clustered again
+    # with the new keywords
+    previous = previous.drop_duplicates(subset='Keyword')
+    previous_names = dict(zip(previous['Keyword'].map(normalise_keyword), previous['Cluster Name'].astype(str)))
+    new_keywords = []
+    for keyword in corpus_set:
+        previous_name = previous_names.get(normalise_keyword(str(keyword)))
+        if previous_name is None or previous_name == NO_CLUSTER_NAME:
+            new_keywords.append(keyword)
+        else:
+            incremental_names[keyword] = previous_name
+    kept = len(incremental_names)
 
-    corpus_sentences = list(corpus_set)
-    check_len = len(corpus_sentences)
+    # New and unclustered keywords join the nearest existing cluster when it is similar enough
+    if new_keywords:
+        new_embeddings = embedding_cache.encode(new_keywords, batch_size=256, show_progress_bar=True)
+        nearest = centroids.assign(new_embeddings, MIN_SIMILARITY)
+        assigned = nearest >= 0
+        for keyword, row in zip(new_keywords, nearest):
+            if row >= 0:
+                incremental_names[keyword] = centroids.names[row]
+        centroids.add([centroids.names[row] for row in nearest[assigned]], new_embeddings[assigned])
 
-    corpus_embeddings = model.encode(corpus_sentences, batch_size=256, show_progress_bar=True, convert_to_tensor=True)
-    clusters = util.community_detection(corpus_embeddings, min_community_size=2, threshold=0.75, init_max_size=len(corpus_embeddings))
+    # Only the keywords that fit no existing cluster are clustered, among themselves
+    corpus_set = corpus_set - set(incremental_names)
+    print("{} keywords kept their cluster, {} new or unclustered keywords joined an existing cluster, "
+          "{} left to cluster".format(kept, len(incremental_names) - kept, len(corpus_set)))
 
-    for keyword, cluster in enumerate(clusters):
-        print("\nCluster {}, #{} Elements ".format(keyword + 1, len(cluster)))
-
-        for sentence_id in cluster[0:]:
-            print("\t", corpus_sentences[sentence_id])
-            corpus_sentences_list.append(corpus_sentences[sentence_id])
-            cluster_name_list.append("Cluster {}, #{} Elements ".format(keyword + 1, len(cluster)))
-
-    df_new = pd.DataFrame(None)
-    df_new['Cluster Name'] = cluster_name_list
-    df_new["Keyword"] = corpus_sentences_list
+corpus_set_all = corpus_set
 
-    df_all.append(df_new)
-    have = set(df_new["Keyword"])
+# The keywords are encoded once, the communities are extracted from their neighbours
+corpus_sentences = list(corpus_set)
+corpus_embeddings = embedding_cache.encode(corpus_sentences, batch_size=256, show_progress_bar=True)
+offsets, neighbours = find_neighbours(corpus_embeddings, MIN_SIMILARITY)
+clusters = extract_communities(offsets, neighbours, COMMUNITY_MIN_SIZE)
 
-    corpus_set = corpus_set_all - have
-    remaining = len(corpus_set)
+for keyword, cluster in enumerate(clusters):
+    print("\nCluster {}, #{} Elements ".format(keyword + 1, len(cluster)))
 
-    if check_len == remaining:
-        break
+    for sentence_id in cluster[0:]:
+        print("\t", corpus_sentences[sentence_id])
+        corpus_sentences_list.append(corpus_sentences[sentence_id])
+        cluster_name_list.append("Cluster {}, #{} Elements ".format(keyword + 1, len(cluster)))
 
-df_new = pd.concat(df_all)
+df_new = pd.DataFrame({'Cluster Name': pd.Series(cluster_name_list, dtype=object),
+                       'Keyword': pd.Series(corpus_sentences_list, dtype=object)})
 
 
 df = df.merge(df_new.drop_duplicates('Keyword'), how='left', on="Keyword")
@@ -78,7 +391,11 @@ df = df.sort_values(by="Length", ascending=True)
 df['Cluster Name'] = df.groupby('Cluster Name')['Keyword'].transform('first')
 df.sort_values(['Cluster Name', "Keyword"], ascending=[True, True], inplace=True)
 
-df['Cluster Name'] = df['Cluster Name'].fillna("zzz_no_cluster")
+# Keywords that kept or joined an existing cluster are not renamed, so cluster names stay stable between runs
+if incremental_names:
+    df['Cluster Name'] = df['Keyword'].map(incremental_names).fillna(df['Cluster Name'])
+
+df['Cluster Name'] = df['Cluster Name'].fillna(NO_CLUSTER_NAME)
 
 del df['Length']
 
@@ -94,4 +411,11 @@ newpath = path + 'output'
 if not os.path.exists(newpath):
     os.makedirs(newpath)
 
-df.to_csv(path + newpath + "test.csv")
\ No newline at end of file
+output_path = os.path.join(newpath, "test.csv")
+df.to_csv(output_path)
+
+# The centroids are stored with the output for the next incremental run, only the keywords clustered by this run
+# are added to them
+df_clustered = df[df['Keyword'].isin(corpus_set_all)]
+centroids.add(df_clustered['Cluster Name'], embedding_cache.encode(df_clustered['Keyword'].astype(str).to_list()))
+centroids.save(get_centroids_path(output_path))
\ No newline at end of file
@@ -0,0 +1,182 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from wayback_urls import (CDX_MAX_REQUEST_INTERVAL, AdaptiveRateLimiter, build_cdx_filters, evict_cdx_cache,
+                          get_cached_unique_urls, get_year_folder_table, get_year_status_table, MIMETYPE_FILTERS,
+                          STATUS_FILTERS)
+
+# Several domains are fetched at once, each with its own pool of page workers, but all requests to the
+# CDX server share one rate limiter, which is the global request budget of the batch
+DOMAIN_WORKERS = 4
+REQUESTS_PER_SECOND = 2.0
+TOP_FOLDERS = 10
+TOP_CHANGING_PAGES = 100
+# Fetch mode of each output table, as in the app: yearly captures for the folder and status tables and one
+# capture per content change for the snapshots and the change counts
+TABLE_FETCH_MODES = {'snapshots': 'digest', 'folders': 'yearly', 'statuses': 'yearly', 'changes': 'digest'}
+
+logger = logging.getLogger('wayback_batch')
+
+
+def log_event(event, level=logging.INFO, **fields):
+    # One JSON object per line, so the log can be parsed by whatever runs the batch
+    logger.log(level, json.dumps({'time': round(time.time(), 3), 'event': event, **fields}, default=str))
+
+
+def read_domains(path):
+    with open(path, 'r', encoding='utf-8') as domains_file:
+        domains = [line.strip() for line in domains_file]
+    # Blank lines and comments are skipped, duplicates only fetched once
+    return list(dict.fromkeys(domain for domain in domains if domain and not domain.startswith('#')))
+
+
+def make_domain_report(domain):
+    levels = {'error': logging.ERROR, 'warning': logging.WARNING, 'info': logging.INFO}
+
+    def report(level, message, **fields):
+        log_event('fetch_' + level, levels[level], domain=domain, message=message, **fields)
+    return report
+
+
+def make_domain_progress(domain, mode):
+    def on_progress(finished, total):
+        log_event('fetch_progress', domain=domain, mode=mode, pages_finished=finished, pages_total=total)
+    return on_progress
+
+
+def build_domain_tables(domain, snapshots_by_mode, top_folders=TOP_FOLDERS, top_changing_pages=TOP_CHANGING_PAGES):
+    snapshots = snapshots_by_mode[TABLE_FETCH_MODES['snapshots']]
+    snapshot_table = snapshots.to_frame(('url', 'timestamp', 'statuscode'))
+    snapshot_table['digest'] = snapshots.digests.astype(str)
+
+    # The year tables are wide, one column per folder or status group, and are stored long
+    folder_table = get_year_folder_table(snapshots_by_mode[TABLE_FETCH_MODES['folders']], top_folders)
+    folder_table = folder_table.rename_axis(index='year', columns='folder').stack().astype('int64')
+    folder_table = folder_table.rename('urls').reset_index()
+    status_table = get_year_status_table(snapshots_by_mode[TABLE_FETCH_MODES['statuses']])
+    status_table = status_table.rename_axis(index='year', columns='status_group').stack().rename('urls').reset_index()
+
+    changes = snapshots_by_mode[TABLE_FETCH_MODES['changes']].url_index().top_changing_pages(top_changing_pages)
+    change_table = pd.DataFrame(changes, columns=['page', 'changes'])
+    change_table.insert(0, 'rank', range(1, len(change_table) + 1))
+
+    tables = {'snapshots': snapshot_table, 'folders': folder_table, 'statuses': status_table,
+              'changes': change_table}
+    for table in tables.values():
+        table['domain'] = domain
+    return tables
+
+
+def write_domain_tables(output_dir, tables):
+    # Each table is a Parquet dataset partitioned by domain (output_dir/<table>/domain=<domain>/), a rerun
+    # replaces the partitions of the domains it fetched and leaves the others alone
+    for name, table in tables.items():
+        pq.write_to_dataset(pa.Table.from_pandas(table, preserve_index=False), os.path.join(output_dir, name),
+                            partition_cols=['domain'], existing_data_behavior='delete_matching')
+
+
+def process_domain(domain, output_dir, rate_limiter, filters=(), force_refresh=False, top_folders=TOP_FOLDERS,
+                   top_changing_pages=TOP_CHANGING_PAGES):
+    start_time = time.perf_counter()
+    log_event('domain_started', domain=domain)
+    report = make_domain_report(domain)
+
+    snapshots_by_mode = {}
+    for mode in dict.fromkeys(TABLE_FETCH_MODES.values()):
+        snapshots, failed_pages = get_cached_unique_urls(domain, force_refresh=force_refresh, mode=mode,
+                                                         filters=filters, report=report,
+                                                         on_progress=make_domain_progress(domain, mode),
+                                                         rate_limiter=rate_limiter, evict=False)
+        if snapshots is None:
+            raise RuntimeError(f"Unable to fetch the {mode} snapshots")
+        if failed_pages:
+            # A partial history would be written as if it were complete, the next run resumes the missing pages
+            raise RuntimeError(f"{failed_pages} pages of the {mode} snapshots could not be fetched")
+        snapshots_by_mode[mode] = snapshots
+
+    tables = build_domain_tables(domain, snapshots_by_mode, top_folders, top_changing_pages)
+    write_domain_tables(output_dir, tables)
+    log_event('domain_finished', domain=domain, seconds=round(time.perf_counter() - start_time, 3),
+              rows={name: len(table) for name, table in tables.items()})
+
+
+def run_batch(domains, output_dir, domain_workers=DOMAIN_WORKERS, requests_per_second=REQUESTS_PER_SECOND,
+              filters=(), force_refresh=False, top_folders=TOP_FOLDERS, top_changing_pages=TOP_CHANGING_PAGES):
+    # Returns the domains that failed
+    rate_limiter = AdaptiveRateLimiter(min_interval=1.0 / requests_per_second,
+                                       max_interval=max(CDX_MAX_REQUEST_INTERVAL, 1.0 / requests_per_second))
+    os.makedirs(output_dir, exist_ok=True)
+    log_event('batch_started', domains=len(domains), domain_workers=domain_workers,
+              requests_per_second=requests_per_second, output_dir=output_dir)
+    start_time = time.perf_counter()
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=domain_workers) as executor:
+        futures = {executor.submit(process_domain, domain, output_dir, rate_limiter, filters, force_refresh,
+                                   top_folders, top_changing_pages): domain
+                   for domain in domains}
+        for future in as_completed(futures):
+            domain = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                # One failing domain must not stop the rest of the portfolio
+                failed.append(domain)
+                log_event('domain_failed', logging.ERROR, domain=domain, error=f"{type(e).__name__}: {e}")
+
+    # Evicting while other domains are still being fetched could delete their cache directories mid-run
+    evict_cdx_cache()
+
+    log_event('batch_finished', seconds=round(time.perf_counter() - start_time, 3),
+              succeeded=len(domains) - len(failed), failed=sorted(failed))
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch and analyse the Wayback Machine history of many domains.")
+    parser.add_argument("domains", nargs='*', help="Domains to process.")
+    parser.add_argument("--domains-file", help="File with one domain per line, # starts a comment.")
+    parser.add_argument("--output-dir", default="wayback-output",
+                        help="Directory of the Parquet datasets, partitioned by domain.")
+    parser.add_argument("--domain-workers", type=int, default=DOMAIN_WORKERS,
+                        help="Number of domains processed concurrently.")
+    parser.add_argument("--requests-per-second", type=float, default=REQUESTS_PER_SECOND,
+                        help="Request budget shared by all domains. It is lowered while the server answers 429.")
+    parser.add_argument("--mimetype", action='append', default=[], choices=list(MIMETYPE_FILTERS),
+                        help="Only fetch captures of this MIME type, can be repeated.")
+    parser.add_argument("--status", action='append', default=[], choices=list(STATUS_FILTERS),
+                        help="Only fetch captures with this status class, can be repeated.")
+    parser.add_argument("--top-folders", type=int, default=TOP_FOLDERS,
+                        help="Folders kept in the folder table, the rest are counted as Other.")
+    parser.add_argument("--top-changing-pages", type=int, default=TOP_CHANGING_PAGES,
+                        help="Pages kept in the change table.")
+    parser.add_argument("--force-refresh", action='store_true',
+                        help="Ignore the local cache and fetch the full history again.")
+    args = parser.parse_args()
+
+    domains = list(args.domains)
+    if args.domains_file:
+        domains += read_domains(args.domains_file)
+    domains = list(dict.fromkeys(domains))
+    if not domains:
+        parser.error("no domains given")
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stderr)
+    failed = run_batch(domains, args.output_dir, domain_workers=args.domain_workers,
+                       requests_per_second=args.requests_per_second,
+                       filters=build_cdx_filters(args.mimetype, args.status), force_refresh=args.force_refresh,
+                       top_folders=args.top_folders, top_changing_pages=args.top_changing_pages)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,79 @@
 import streamlit as st
 import requests
 import json
+import hashlib
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from diff_match_patch import diff_match_patch
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse, urlunparse
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import plotly.express as px
 import plotly.graph_objs as go
 import time
 
-# Initialize session state variables
-if 'vis_type' not in st.session_state:
-    st.session_state.vis_type = "Stacked Line Chart"
-if 'show_results' not in st.session_state:
-    st.session_state.show_results = False
-if 'unique_urls' not in st.session_state:
-    st.session_state.unique_urls = []
-if 'domain' not in st.session_state:
-    st.session_state.domain = ""
-if 'active_tab' not in st.session_state:
-    st.session_state.active_tab = "Folder Visualisation"
-if 'top_folders_count' not in st.session_state:
-    st.session_state.top_folders_count = 10
-if 'frequently_changed_pages' not in st.session_state:
-    st.session_state.frequently_changed_pages = []
+CDX_URL = "http://web.archive.org/cdx/search/cdx"
+# Concurrent CDX page requests, sharing one pooled session and one rate limiter
+CDX_WORKERS = 4
+CDX_MIN_REQUEST_INTERVAL = 0.5
+CDX_MAX_REQUEST_INTERVAL = 30.0
+CDX_MAX_RETRIES = 5
+CDX_TIMEOUT = 120
+# Fetch modes push deduplication to the CDX server: one capture per URL per year, per content change
+# or per URL, and the digest field is dropped where no analysis reads it
+CDX_FETCH_MODES = {
+    'full': {'fl': 'original,timestamp,statuscode,digest'},
+    'yearly': {'fl': 'original,timestamp,statuscode', 'collapse': 'timestamp:4'},
+    'digest': {'fl': 'original,timestamp,statuscode,digest', 'collapse': 'digest'},
+    'urlkey': {'fl': 'original,timestamp,statuscode,digest', 'collapse': 'urlkey'},
+}
+ANALYSIS_FETCH_MODES = {
+    "Folder Visualisation": 'yearly',
+    "Status Code Visualisation": 'yearly',
+    "Frequently Changed Pages": 'digest',
+    "Download URLs": 'full',
+}
+MIMETYPE_FILTERS = {
+    "HTML": "text/html",
+    "Images": "image/.*",
+    "CSS": "text/css",
+    "JavaScript": "(application|text)/(x-)?javascript",
+    "PDF": "application/pdf",
+}
+STATUS_FILTERS = {"2xx": "2..", "3xx": "3..", "4xx": "4..", "5xx": "5.."}
+STATUS_GROUPS = ['1xx', '2xx', '3xx', '4xx', '5xx', 'Unknown']
+
+# Per-domain cache of CDX results. Within the TTL the cache is used as is, after it only the snapshots
+# newer than the newest cached one are requested. Least recently used domains are evicted over the size limit.
+CDX_CACHE_DIR = os.environ.get('WAYBACK_CACHE_DIR',
+                               os.path.join(os.path.expanduser('~'), '.cache', 'wayback-url-tool'))
+CDX_CACHE_TTL = float(os.environ.get('WAYBACK_CACHE_TTL_HOURS', 24)) * 3600
+CDX_CACHE_MAX_BYTES = int(float(os.environ.get('WAYBACK_CACHE_MAX_GB', 5)) * 1024 ** 3)
+# Only one thread evicts at a time, Streamlit sessions and batch domains share the process
+CDX_CACHE_EVICTION_LOCK = threading.Lock()
+# robots.txt bodies are stored under their CDX digest, so each version is only ever downloaded once
+ROBOTS_TXT_STORE_DIR = os.path.join(CDX_CACHE_DIR, 'robots-txt')
+# Finished CDX pages are written here, so an interrupted fetch resumes where it stopped
+CDX_CHECKPOINT_DIR = os.environ.get('WAYBACK_CHECKPOINT_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'wayback-cdx-checkpoints'))
+
+ABOUT_TEXT = """
+    This app leverages the Wayback Machine's CDX server to analyze and visualise the historical evolution of websites.
+
+    1. URL Retrieval: Fetches all archived URLs for a given domain from the Internet Archive.
+    2. Folder Structure Visualisation: Displays how the website's folder structure has changed over time.
+    3. Status Code Analysis: Shows the distribution of HTTP status codes across the site's history.
+    4. Frequently Changed Pages: Identifies and lists the pages that have been modified most often.
+    5. robots.txt Evolution: Tracks and visualises changes to the site's robots.txt file over time.
+    6. Rover from Failed Migrations
+"""
 
 
 def clean_url(url):
@@ -32,9 +83,349 @@ def clean_url(url):
     return clean
 
 
-def get_unique_urls(domain):
+class AdaptiveRateLimiter:
+    # Spaces requests from all threads at least `interval` apart. The interval doubles on 429/5xx
+    # responses and shrinks back towards the minimum on successes.
+    def __init__(self, min_interval=CDX_MIN_REQUEST_INTERVAL, max_interval=CDX_MAX_REQUEST_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_request_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            request_time = max(now, self.next_request_time)
+            # Jitter keeps the worker threads from retrying in lockstep
+            self.next_request_time = request_time + self.interval * random.uniform(0.8, 1.2)
+        time.sleep(max(0.0, request_time - now))
+
+    def slow_down(self):
+        with self.lock:
+            self.interval = min(self.interval * 2, self.max_interval)
+
+    def speed_up(self):
+        with self.lock:
+            self.interval = max(self.interval * 0.9, self.min_interval)
+
+
+def create_cdx_session(pool_size=CDX_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def request_with_backoff(session, url, rate_limiter, params=None, max_retries=CDX_MAX_RETRIES):
+    for attempt in range(max_retries + 1):
+        rate_limiter.wait()
+        try:
+            response = session.get(url, params=params, timeout=CDX_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            # Dropped connections and timeouts are retried like an overloaded server
+            rate_limiter.slow_down()
+            if attempt < max_retries:
+                time.sleep(min(2 ** attempt, CDX_MAX_REQUEST_INTERVAL) * random.uniform(0.5, 1.5))
+                continue
+            raise
+        if response.status_code == 429 or response.status_code >= 500:
+            rate_limiter.slow_down()
+            if attempt < max_retries:
+                time.sleep(min(2 ** attempt, CDX_MAX_REQUEST_INTERVAL) * random.uniform(0.5, 1.5))
+                continue
+        response.raise_for_status()
+        rate_limiter.speed_up()
+        return response
+
+
+def fetch_cdx_json(session, params, rate_limiter, max_retries=CDX_MAX_RETRIES):
+    return request_with_backoff(session, CDX_URL, rate_limiter, params, max_retries).json()
+
+
+def get_cdx_checkpoint_dir(params):
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(CDX_CHECKPOINT_DIR, key)
+
+
+def load_cdx_page_checkpoint(checkpoint_dir, page):
+    path = os.path.join(checkpoint_dir, f"page_{page}.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as checkpoint_file:
+            return [tuple(row) for row in json.load(checkpoint_file)]
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def save_cdx_page_checkpoint(checkpoint_dir, page, rows):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = os.path.join(checkpoint_dir, f"page_{page}.json")
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as checkpoint_file:
+        json.dump(rows, checkpoint_file)
+    os.replace(temp_path, path)
+
+
+def clear_cdx_checkpoints(checkpoint_dir):
+    if not os.path.isdir(checkpoint_dir):
+        return
+    for name in os.listdir(checkpoint_dir):
+        os.remove(os.path.join(checkpoint_dir, name))
+    os.rmdir(checkpoint_dir)
+
+
+def fetch_cdx_page(session, params, page, rate_limiter, checkpoint_dir):
+    rows = load_cdx_page_checkpoint(checkpoint_dir, page)
+    if rows is not None:
+        return rows
+
+    data = fetch_cdx_json(session, {**params, "page": page}, rate_limiter)
+    # Pruned queries return no digest column
+    rows = [(clean_url(item[0]), item[1], item[2], item[3] if len(item) > 3 else '') for item in data[1:]]
+    save_cdx_page_checkpoint(checkpoint_dir, page, rows)
+    return rows
+
+
+class SnapshotStore:
+    # Snapshots held as typed columns instead of a list of string tuples: URLs dictionary encoded,
+    # timestamps parsed once, status codes as int16 (-1 when not numeric, such as '-') and digests as
+    # fixed-width bytes. Rows are turned back into strings only for the few that are displayed or exported.
+    STATUS_UNKNOWN = -1
+
+    def __init__(self, urls, timestamps, statuses, digests):
+        self.urls = urls
+        self.timestamps = timestamps
+        self.statuses = statuses
+        self.digests = digests
+        # Aggregates computed from the snapshots, kept so that Streamlit reruns do not recompute them
+        self.aggregates = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        if not rows:
+            return cls(pd.Categorical([]), np.array([], dtype='datetime64[s]'), np.array([], dtype=np.int16),
+                       np.array([], dtype='S32'))
+        urls, timestamps, statuses, digests = zip(*rows)
+        timestamps = pd.to_datetime(pd.Series(timestamps), format='%Y%m%d%H%M%S', errors='coerce')
+        statuses = pd.to_numeric(pd.Series(statuses), errors='coerce').fillna(cls.STATUS_UNKNOWN)
+        return cls(pd.Categorical(urls), timestamps.values.astype('datetime64[s]'), statuses.values.astype(np.int16),
+                   np.array(digests, dtype='S32'))
+
+    @classmethod
+    def concat(cls, stores):
+        if not stores:
+            return cls.from_rows([])
+        return cls(union_categoricals([store.urls for store in stores]),
+                   np.concatenate([store.timestamps for store in stores]),
+                   np.concatenate([store.statuses for store in stores]),
+                   np.concatenate([store.digests for store in stores]))
+
+    def __len__(self):
+        return len(self.urls)
+
+    def to_frame(self, columns=('url', 'timestamp', 'statuscode')):
+        data = {'url': self.urls, 'timestamp': self.timestamps, 'statuscode': self.statuses,
+                'digest': self.digests}
+        return pd.DataFrame({column: data[column] for column in columns})
+
+    def format_columns(self, positions=None):
+        # Converts the selected snapshots back into the strings the CDX server returned
+        positions = np.arange(len(self)) if positions is None else positions
+        timestamps = pd.DatetimeIndex(self.timestamps[positions])
+        # NaT fields are filled with 0 before the integer cast, those rows are blanked below
+        year, month, day, hour, minute, second = (
+            np.asarray(getattr(timestamps, field).fillna(0), dtype=np.int64)
+            for field in ('year', 'month', 'day', 'hour', 'minute', 'second'))
+        timestamp_numbers = (year * 10 ** 10 + month * 10 ** 8 + day * 10 ** 6 + hour * 10 ** 4 + minute * 100 +
+                             second)
+        statuses = self.statuses[positions]
+        return (np.asarray(self.urls[positions], dtype=object),
+                np.where(timestamps.isna(), '', timestamp_numbers.astype(str)),
+                np.where(statuses == self.STATUS_UNKNOWN, '-', statuses.astype(str)),
+                np.char.decode(self.digests[positions], 'ascii'))
+
+    def take(self, positions):
+        return SnapshotStore(self.urls[positions], self.timestamps[positions], self.statuses[positions],
+                             self.digests[positions])
+
+    def collapse(self, mode):
+        # Applies a fetch mode's deduplication across cache parts, which the CDX server cannot see together
+        if mode == 'full' or len(self) == 0:
+            return self
+        if mode == 'digest':
+            # Like collapse=digest on the CDX server, a capture is only dropped when its digest equals the
+            # previous capture of the same URL, so a page that changes back to an earlier digest keeps the revert
+            order = np.lexsort((self.timestamps.astype(np.int64), self.urls.codes))
+            codes, digests = self.urls.codes[order], self.digests[order]
+            repeated = np.zeros(len(order), dtype=bool)
+            repeated[1:] = (codes[1:] == codes[:-1]) & (digests[1:] == digests[:-1])
+            return self.take(np.sort(order[~repeated]))
+        keys = pd.DataFrame({'url': self.urls.codes})
+        if mode == 'yearly':
+            keys['year'] = pd.DatetimeIndex(self.timestamps).year
+        return self.take(np.flatnonzero(~keys.duplicated().values))
+
+    def newest_timestamp(self):
+        newest = pd.Series(self.timestamps).max()
+        return None if pd.isna(newest) else newest.strftime('%Y%m%d%H%M%S')
+
+    def to_parquet(self, path):
+        frame = self.to_frame(('url', 'timestamp', 'statuscode'))
+        frame['digest'] = self.digests.tolist()
+        frame.to_parquet(path, index=False)
+
+    @classmethod
+    def from_parquet(cls, path):
+        frame = pd.read_parquet(path)
+        return cls(pd.Categorical(frame['url']), frame['timestamp'].values.astype('datetime64[s]'),
+                   frame['statuscode'].values.astype(np.int16), np.array(frame['digest'].tolist(), dtype='S32'))
+
+    def rows(self, positions):
+        return list(zip(*self.format_columns(positions)))
+
+    def url_index(self):
+        if 'url_index' not in self.aggregates:
+            self.aggregates['url_index'] = UrlIndex(self)
+        return self.aggregates['url_index']
+
+    def to_csv_bytes(self, positions=None):
+        urls, timestamps, statuses, digests = self.format_columns(positions)
+        lines = pd.Series(urls, dtype=str).str.cat([timestamps, statuses, digests], sep=',')
+        csv_content = "URL,Timestamp,Status Code,Digest\n" + "\n".join(lines)
+        # UTF-8 with BOM, so Excel opens it with the right encoding
+        return csv_content.encode('utf-8-sig')
+
+
+class UrlIndex:
+    # Per-URL index over a SnapshotStore, built once after fetching. The snapshots of URL code c are
+    # order[offsets[c]:offsets[c + 1]], most recent first. Distinct digest counts and the change ranking are
+    # precomputed, and the sorted URLs answer prefix filters by bisection.
+    def __init__(self, snapshots):
+        codes = snapshots.urls.codes.astype(np.int64)
+        num_urls = len(snapshots.urls.categories)
+        # ~timestamp sorts descending without overflow, NaT sorts last
+        timestamps = snapshots.timestamps.astype(np.int64)
+        self.order = np.lexsort((~timestamps, codes))
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=num_urls))))
+        self.urls = snapshots.urls.categories
+
+        present_codes, first_positions = np.unique(codes, return_index=True)
+        self.first_positions = np.full(num_urls, -1, dtype=np.int64)
+        self.first_positions[present_codes] = first_positions
+
+        num_digests = 0
+        digest_codes = np.zeros(len(codes), dtype=np.int64)
+        if len(codes):
+            digests, digest_codes = np.unique(snapshots.digests, return_inverse=True)
+            num_digests = len(digests)
+        url_digest_pairs = np.unique(codes * max(num_digests, 1) + digest_codes)
+        self.digest_counts = np.bincount(url_digest_pairs // max(num_digests, 1), minlength=num_urls)
+
+        # Most distinct digests first, pages with the same count in the order they were first seen
+        self.change_ranking = present_codes[np.lexsort((first_positions, -self.digest_counts[present_codes]))]
+
+        self.sorted_codes = np.argsort(np.asarray(self.urls, dtype=object), kind='stable')
+        self.sorted_urls = np.asarray(self.urls, dtype=object)[self.sorted_codes]
+
+    def get_code(self, url):
+        position = np.searchsorted(self.sorted_urls, url)
+        if position < len(self.sorted_urls) and self.sorted_urls[position] == url:
+            return self.sorted_codes[position]
+        return None
+
+    def history(self, url, limit=None):
+        code = self.get_code(url)
+        if code is None:
+            return np.array([], dtype=np.int64)
+        start, end = self.offsets[code], self.offsets[code + 1]
+        return self.order[start:end if limit is None else min(end, start + limit)]
+
+    def top_changing_pages(self, top_n=10):
+        return [(self.urls[code], int(self.digest_counts[code])) for code in self.change_ranking[:top_n]]
+
+    def codes_with_prefix(self, prefix):
+        start = np.searchsorted(self.sorted_urls, prefix, side='left')
+        end = np.searchsorted(self.sorted_urls, prefix + '\U0010ffff', side='left')
+        return self.sorted_codes[start:end]
+
+    def codes_matching(self, pattern):
+        # Regular expressions are tested once per distinct URL, not per snapshot
+        return np.flatnonzero(pd.Series(self.urls, dtype=object).str.contains(pattern, regex=True).values)
+
+    def positions(self, codes, first_only=False):
+        # Snapshot positions of the given URLs, in the order the snapshots were fetched
+        codes = np.asarray(codes, dtype=np.int64)
+        if first_only:
+            positions = self.first_positions[codes]
+            return np.sort(positions[positions >= 0])
+        if len(codes) == len(self.urls):
+            return np.arange(self.offsets[-1])
+        # Gathers the index slices of all codes at once
+        starts, lengths = self.offsets[codes], self.offsets[codes + 1] - self.offsets[codes]
+        slice_starts = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return np.sort(self.order[slice_starts + np.arange(lengths.sum())])
+
+
+def fetch_cdx_pages(params, num_pages, workers=CDX_WORKERS, on_progress=None, on_error=None, convert_page=list,
+                    rate_limiter=None):
+    # Fetches every page of a CDX query concurrently and returns the converted pages in page order, exactly
+    # as a sequential fetch would, with the number of pages that failed. Callbacks run on the calling thread,
+    # so they may update the UI. Passing a rate limiter shares one request budget between several fetches.
+    checkpoint_dir = get_cdx_checkpoint_dir(params)
+    rate_limiter = rate_limiter or AdaptiveRateLimiter()
+    page_rows = [None] * num_pages
+    failed_pages = 0
+
+    with create_cdx_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_cdx_page, session, params, page, rate_limiter, checkpoint_dir): page
+                   for page in range(num_pages)}
+        for finished, future in enumerate(as_completed(futures), start=1):
+            page = futures[future]
+            try:
+                page_rows[page] = convert_page(future.result())
+            except (requests.exceptions.RequestException, ValueError) as e:
+                failed_pages += 1
+                if on_error:
+                    on_error(page, e)
+            if on_progress:
+                on_progress(finished, num_pages)
+
+    # Checkpoints are only kept while some pages are still missing
+    if failed_pages == 0:
+        clear_cdx_checkpoints(checkpoint_dir)
+    return [rows for rows in page_rows if rows is not None], failed_pages
+
+
+def parse_num_pages(data):
+    # showNumPages answers with a bare page count, older servers answered with a JSON table
+    if isinstance(data, int):
+        return data
+    return len(data) - 1
+
+
+def build_cdx_filters(mimetypes=(), statuses=()):
+    # CDX filters are regular expressions on a field, repeated filters must all match
+    filters = []
+    if mimetypes:
+        filters.append("mimetype:" + "|".join(MIMETYPE_FILTERS[mimetype] for mimetype in mimetypes))
+    if statuses:
+        filters.append("statuscode:" + "|".join(STATUS_FILTERS[status] for status in statuses))
+    return filters
+
+
+def report_to_streamlit(level, message, **fields):
+    # Default report callback: level is 'error', 'warning' or 'info', the fields are for structured logs
+    getattr(st, level)(message)
+
+
+def get_unique_urls(domain, from_timestamp=None, mode='full', filters=(), report=report_to_streamlit,
+                    on_progress=None, rate_limiter=None):
+    # Returns the snapshots and the number of CDX pages that could not be fetched. The snapshots are None when
+    # the CDX server could not be queried, and an empty store when it has no snapshots
     domain = domain.replace('http://', '').replace('https://', '').rstrip('/')
-    base_url = f"http://web.archive.org/cdx/search/cdx"
     params = {
         "url": f"{domain}/*",
         "output": "json",
@@ -42,49 +433,188 @@ def get_unique_urls(domain):
         "pageSize": 50000,
         "showNumPages": "true"
     }
-
-    response = requests.get(base_url, params=params)
-    if response.status_code != 200:
-        st.error(f"Error: Unable to fetch data. Status code: {response.status_code}")
-        return []
+    params.update(CDX_FETCH_MODES[mode])
+    if filters:
+        params["filter"] = list(filters)
+    if from_timestamp:
+        params["from"] = from_timestamp
+
+    # The page count query shares the retries and the request budget of the page fetches
+    rate_limiter = rate_limiter or AdaptiveRateLimiter()
+    try:
+        with create_cdx_session(1) as session:
+            response = request_with_backoff(session, CDX_URL, rate_limiter, params)
+    except requests.exceptions.RequestException as e:
+        status_code = e.response.status_code if e.response is not None else None
+        report('error', f"Error: Unable to fetch data. Status code: {status_code}" if status_code else
+               f"Error: Unable to fetch data. {e}", status_code=status_code)
+        return None, 0
 
     try:
         data = json.loads(response.text)
-        num_pages = len(data) - 1
-    except json.JSONDecodeError:
-        st.error("Error: Unable to parse the response from the server.")
-        return []
+        num_pages = parse_num_pages(data)
+    except (json.JSONDecodeError, TypeError):
+        report('error', "Error: Unable to parse the response from the server.")
+        return None, 0
 
     if num_pages == 0:
-        st.warning("No pages found for the given domain.")
-        return []
+        if not from_timestamp:
+            report('warning', "No pages found for the given domain.")
+        return SnapshotStore.from_rows([]), 0
 
-    st.info(f"Total pages to process: {num_pages}")
+    report('info', f"Total pages to process: {num_pages}", num_pages=num_pages)
 
-    unique_urls = []
-    for page in range(num_pages):
-        params["page"] = page
-        params.pop("showNumPages", None)
+    params.pop("showNumPages", None)
+    if on_progress is None:
+        progress_bar = st.progress(0.0)
+        on_progress = lambda finished, total: progress_bar.progress(finished / total)
+    # Each page is packed into typed arrays as soon as it arrives
+    pages, failed_pages = fetch_cdx_pages(
+        params, num_pages,
+        on_progress=on_progress,
+        on_error=lambda page, e: report('warning', f"Error fetching page {page}: {str(e)}", page=page),
+        convert_page=SnapshotStore.from_rows,
+        rate_limiter=rate_limiter)
 
-        try:
-            response = requests.get(base_url, params=params)
-            response.raise_for_status()
-            data = response.json()
+    return SnapshotStore.concat(pages), failed_pages
 
-            for item in data[1:]:
-                url = clean_url(item[0])
-                timestamp = item[1]
-                statuscode = item[2]
-                digest = item[3]
-                unique_urls.append((url, timestamp, statuscode, digest))
 
-            st.progress((page + 1) / num_pages)
-            time.sleep(1)
-        except requests.exceptions.RequestException as e:
-            st.warning(f"Error fetching page {page}: {str(e)}")
-            time.sleep(5)
+def get_domain_cache_dir(domain):
+    domain = domain.replace('http://', '').replace('https://', '').rstrip('/').lower()
+    safe_name = re.sub(r'[^a-z0-9._-]', '_', domain)[:100]
+    return os.path.join(CDX_CACHE_DIR, f"{safe_name}-{hashlib.sha1(domain.encode('utf-8')).hexdigest()[:8]}")
 
-    return unique_urls
+
+def load_cache_metadata(cache_dir, name):
+    path = os.path.join(cache_dir, f"{name}.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as metadata_file:
+            metadata = json.load(metadata_file)
+    except (OSError, json.JSONDecodeError):
+        return None
+    # The modification time of the metadata records when the domain was last used, for eviction
+    os.utime(path)
+    return metadata
+
+
+def save_cache_metadata(cache_dir, name, metadata):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{name}.json")
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as metadata_file:
+        json.dump(metadata, metadata_file)
+    os.replace(temp_path, path)
+
+
+def evict_cdx_cache(keep_dir=None, max_bytes=CDX_CACHE_MAX_BYTES):
+    with CDX_CACHE_EVICTION_LOCK:
+        evict_least_recently_used(keep_dir, max_bytes)
+
+
+def evict_least_recently_used(keep_dir, max_bytes):
+    if not os.path.isdir(CDX_CACHE_DIR):
+        return
+    domain_dirs = []
+    for name in os.listdir(CDX_CACHE_DIR):
+        path = os.path.join(CDX_CACHE_DIR, name)
+        # The robots.txt store is shared by every domain and is not a domain cache
+        if not os.path.isdir(path) or os.path.abspath(path) == os.path.abspath(ROBOTS_TXT_STORE_DIR):
+            continue
+        try:
+            files = [os.path.join(path, file_name) for file_name in os.listdir(path)]
+            size = sum(os.path.getsize(file_path) for file_path in files if os.path.isfile(file_path))
+            last_used = max((os.path.getmtime(file_path) for file_path in files), default=0)
+        except OSError:
+            # A metadata file was replaced while it was listed, the directory is in use
+            continue
+        domain_dirs.append((last_used, size, path))
+
+    total_size = sum(size for _, size, _ in domain_dirs)
+    for _, size, path in sorted(domain_dirs):
+        if total_size <= max_bytes:
+            break
+        if path == keep_dir:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total_size -= size
+
+
+def get_snapshot_cache_name(mode, filters):
+    # Every fetch mode and filter combination is cached separately
+    if mode == 'full' and not filters:
+        return 'snapshots'
+    filters_key = hashlib.sha1(json.dumps(list(filters)).encode('utf-8')).hexdigest()[:8] if filters else 'all'
+    return f"snapshots-{mode}-{filters_key}"
+
+
+def load_cached_snapshots(cache_dir, metadata):
+    parts = [SnapshotStore.from_parquet(os.path.join(cache_dir, part)) for part in metadata['parts']]
+    # A single part is exactly what the CDX server returned, it was already collapsed there
+    if len(parts) == 1:
+        return parts[0]
+    return SnapshotStore.concat(parts).collapse(metadata.get('mode', 'full'))
+
+
+def get_cached_unique_urls(domain, force_refresh=False, mode='full', filters=(), report=report_to_streamlit,
+                           on_progress=None, rate_limiter=None, evict=True):
+    # Serves the snapshots of a domain from the cache, fetching only the ones captured since the last fetch.
+    # Returns the snapshots and the number of CDX pages that failed. An incomplete fetch is returned but never
+    # cached, so the next call fetches the same range again and resumes from the page checkpoints.
+    # evict=False leaves the cache size to the caller, as the batch mode does once all domains are done.
+    cache_dir = get_domain_cache_dir(domain)
+    cache_name = get_snapshot_cache_name(mode, filters)
+    cached_metadata = load_cache_metadata(cache_dir, cache_name)
+    metadata = None if force_refresh else cached_metadata
+    if metadata and time.time() - metadata['fetched_at'] < CDX_CACHE_TTL:
+        return load_cached_snapshots(cache_dir, metadata), 0
+
+    fetched_at = time.time()
+    if metadata:
+        new_snapshots, failed_pages = get_unique_urls(domain, from_timestamp=metadata['newest_timestamp'], mode=mode,
+                                                      filters=filters, report=report, on_progress=on_progress,
+                                                      rate_limiter=rate_limiter)
+        if new_snapshots is None:
+            # The cached snapshots are still better than nothing when the CDX server is unavailable
+            report('warning', "Unable to refresh the cached URLs, showing the cached ones.")
+            return load_cached_snapshots(cache_dir, metadata), 0
+        # from= is inclusive, so the captures of the newest cached second are fetched again
+        newest = np.datetime64(pd.to_datetime(metadata['newest_timestamp'], format='%Y%m%d%H%M%S'), 's')
+        new_snapshots = new_snapshots.take(np.flatnonzero(new_snapshots.timestamps > newest))
+        if failed_pages:
+            report('warning', f"{failed_pages} pages could not be fetched, the new URLs are incomplete and were "
+                              "not cached.", failed_pages=failed_pages)
+            cached_snapshots = load_cached_snapshots(cache_dir, metadata)
+            return SnapshotStore.concat([cached_snapshots, new_snapshots]).collapse(mode), failed_pages
+        if len(new_snapshots):
+            part = f"{cache_name}-{len(metadata['parts']):05d}.parquet"
+            new_snapshots.to_parquet(os.path.join(cache_dir, part))
+            metadata['parts'].append(part)
+            metadata['newest_timestamp'] = new_snapshots.newest_timestamp()
+    else:
+        new_snapshots, failed_pages = get_unique_urls(domain, mode=mode, filters=filters, report=report,
+                                                      on_progress=on_progress, rate_limiter=rate_limiter)
+        if not new_snapshots:
+            return new_snapshots, failed_pages
+        if failed_pages:
+            # The previous cache, if any, is kept as it was
+            report('warning', f"{failed_pages} pages could not be fetched, the URLs are incomplete and were not "
+                              "cached.", failed_pages=failed_pages)
+            return new_snapshots, failed_pages
+        for part in (cached_metadata or {}).get('parts', []):
+            os.remove(os.path.join(cache_dir, part))
+        os.makedirs(cache_dir, exist_ok=True)
+        part = f"{cache_name}-00000.parquet"
+        new_snapshots.to_parquet(os.path.join(cache_dir, part))
+        metadata = {'domain': domain, 'mode': mode, 'filters': list(filters), 'parts': [part],
+                    'newest_timestamp': new_snapshots.newest_timestamp()}
+
+    metadata['fetched_at'] = fetched_at
+    save_cache_metadata(cache_dir, cache_name, metadata)
+    if evict:
+        evict_cdx_cache(keep_dir=cache_dir)
+    return load_cached_snapshots(cache_dir, metadata), 0
 
 
 def get_top_folder(url):
@@ -96,20 +626,43 @@ def get_top_folder(url):
     return f"/{top_folder}/"
 
 
-def visualize_folder_types_over_time(urls, chart_type):
-    df = pd.DataFrame(urls, columns=['url', 'timestamp', 'statuscode', 'digest'])
-    df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y%m%d%H%M%S')
-    df['year'] = df['timestamp'].dt.year.astype(str)
-    df['folder'] = df['url'].apply(get_top_folder)
+def get_top_folders(urls):
+    # Vectorised get_top_folder: the first path segment after the scheme and host. Like urlparse, a
+    # ';params' suffix is only split off when it ends the path.
+    parts = pd.Series(urls, dtype=object).str.extract(r'^(?:[^:/?#]+:)?(?://[^/?#]*)?/*([^/?#]*)(/?)')
+    segments = parts[0].where(parts[1] == '/', parts[0].str.replace(r';.*$', '', regex=True))
+    return np.where(segments == '', "Root", "/" + segments + "/")
+
+
+def get_snapshot_years(snapshots):
+    if 'years' not in snapshots.aggregates:
+        snapshots.aggregates['years'] = pd.Series(snapshots.timestamps).dt.year.astype(str).values
+    return snapshots.aggregates['years']
+
+
+def get_year_folder_table(snapshots, top_n):
+    key = ('year_folder', top_n)
+    if key in snapshots.aggregates:
+        return snapshots.aggregates[key]
+
+    # Each distinct URL is parsed once, then broadcast to its snapshots through the category codes
+    category_folders = get_top_folders(snapshots.urls.categories)
+    df = pd.DataFrame({'year': get_snapshot_years(snapshots), 'folder': category_folders[snapshots.urls.codes]})
 
     df_grouped = df.groupby(['year', 'folder']).size().unstack(fill_value=0)
     df_grouped = df_grouped.sort_index()
     folder_totals = df_grouped.sum().sort_values(ascending=False)
     df_grouped = df_grouped[folder_totals.index]
 
-    top_folders = folder_totals.nlargest(st.session_state.top_folders_count).index
+    top_folders = folder_totals.nlargest(top_n).index
     df_grouped['Other'] = df_grouped.loc[:, ~df_grouped.columns.isin(top_folders)].sum(axis=1)
     df_grouped = df_grouped[list(top_folders) + ['Other']]
+    snapshots.aggregates[key] = df_grouped
+    return df_grouped
+
+
+def visualize_folder_types_over_time(snapshots, chart_type, top_n=10):
+    df_grouped = get_year_folder_table(snapshots, top_n)
 
     if chart_type == "Stacked Bar Chart":
         fig = px.bar(df_grouped, x=df_grouped.index, y=df_grouped.columns,
@@ -156,20 +709,32 @@ def group_status_code(code):
     except ValueError:
         return 'Unknown'
 
-def visualize_status_codes_over_time(urls, chart_type):
-    df = pd.DataFrame(urls, columns=['url', 'timestamp', 'statuscode', 'digest'])
-    df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y%m%d%H%M%S')
-    df['year'] = df['timestamp'].dt.year.astype(str)
+def group_status_codes(statuses):
+    # Vectorised group_status_code over int16 status codes, -1 marks a non-numeric status
+    groups = pd.cut(statuses, bins=[-np.inf, 199, 299, 399, 499, np.inf],
+                    labels=['1xx', '2xx', '3xx', '4xx', '5xx']).astype(object)
+    return np.where(statuses == SnapshotStore.STATUS_UNKNOWN, 'Unknown', groups)
 
-    df['status_group'] = df['statuscode'].apply(group_status_code)
+
+def get_year_status_table(snapshots):
+    if 'year_status' in snapshots.aggregates:
+        return snapshots.aggregates['year_status']
+
+    df = pd.DataFrame({'year': get_snapshot_years(snapshots), 'status_group': group_status_codes(snapshots.statuses)})
     df_grouped = df.groupby(['year', 'status_group']).size().unstack(fill_value=0)
     df_grouped = df_grouped.sort_index()
 
     # Ensure all status groups are present
-    all_status_groups = ['1xx', '2xx', '3xx', '4xx', '5xx', 'Unknown']
-    for group in all_status_groups:
+    for group in STATUS_GROUPS:
         if group not in df_grouped.columns:
             df_grouped[group] = 0
+    snapshots.aggregates['year_status'] = df_grouped
+    return df_grouped
+
+
+def visualize_status_codes_over_time(snapshots, chart_type):
+    df_grouped = get_year_status_table(snapshots)
+    all_status_groups = STATUS_GROUPS
 
     if chart_type == "Stacked Bar Chart":
         fig = px.bar(df_grouped, x=df_grouped.index, y=all_status_groups,
@@ -199,7 +764,8 @@ def visualize_status_codes_over_time(urls, chart_type):
     fig.update_yaxes(title_text="Number of URLs")
     return fig
 
-def fetch_robots_txt_data(domain):
+def fetch_robots_txt_data(domain, from_timestamp=None):
+    # Returns None when the CDX server could not be queried
     domain = domain.replace('http://', '').replace('https://', '').rstrip('/')
     base_url = f"http://web.archive.org/cdx/search/cdx"
     params = {
@@ -210,18 +776,39 @@ def fetch_robots_txt_data(domain):
         "collapse": "digest",
         "sort": "timestamp"
     }
+    if from_timestamp:
+        params["from"] = from_timestamp
 
     response = requests.get(base_url, params=params)
     if response.status_code != 200:
         st.error(f"Error: Unable to fetch robots.txt data. Status code: {response.status_code}")
-        return []
+        return None
 
     try:
-        data = json.loads(response.text)
+        data = json.loads(response.text) if response.text.strip() else []
         return data[1:]  # Skip the header row
     except json.JSONDecodeError:
         st.error("Error: Unable to parse the response from the server.")
-        return []
+        return None
+
+
+def get_cached_robots_txt_data(domain, force_refresh=False):
+    cache_dir = get_domain_cache_dir(domain)
+    cached = None if force_refresh else load_cache_metadata(cache_dir, 'robots')
+    if cached and time.time() - cached['fetched_at'] < CDX_CACHE_TTL:
+        return cached['rows']
+
+    fetched_at = time.time()
+    newest_timestamp = max((row[0] for row in cached['rows']), default=None) if cached else None
+    new_rows = fetch_robots_txt_data(domain, from_timestamp=newest_timestamp)
+    if new_rows is None:
+        return cached['rows'] if cached else []
+
+    rows = cached['rows'] if cached else []
+    rows = rows + [row for row in new_rows if newest_timestamp is None or row[0] > newest_timestamp]
+    save_cache_metadata(cache_dir, 'robots', {'fetched_at': fetched_at, 'rows': rows})
+    evict_cdx_cache(keep_dir=cache_dir)
+    return rows
 
 
 def process_robots_txt_changes(robots_txt_data):
@@ -239,19 +826,124 @@ def process_robots_txt_changes(robots_txt_data):
     return sorted(changes.values(), key=lambda x: x[0])  # Sort by timestamp
 
 
-def compare_robots_txt(domain, old_version, new_version):
-    old_content = fetch_robots_txt_content(domain, old_version[0])
-    new_content = fetch_robots_txt_content(domain, new_version[0])
+def fetch_robots_txt_content(domain, timestamp):
+    url = f"https://web.archive.org/web/{timestamp}id_/{domain}/robots.txt"
+    response = requests.get(url)
+    if response.status_code == 200:
+        return response.text
+    else:
+        return None
+
+
+def get_robots_txt_store_path(digest):
+    return os.path.join(ROBOTS_TXT_STORE_DIR, digest[:2], f"{digest}.txt")
 
-    if old_content is None or new_content is None:
-        return "Error: Unable to fetch one or both versions of robots.txt"
 
+def load_stored_robots_txt(digest):
+    path = get_robots_txt_store_path(digest)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as content_file:
+        return content_file.read()
+
+
+def store_robots_txt(digest, content):
+    path = get_robots_txt_store_path(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as content_file:
+        content_file.write(content)
+    os.replace(temp_path, path)
+
+
+def get_robots_txt_content(domain, version, session=None, rate_limiter=None):
+    # version is a (timestamp, digest, original) tuple from process_robots_txt_changes
+    timestamp, digest, _ = version
+    content = load_stored_robots_txt(digest)
+    if content is not None:
+        return content
+
+    if session is None:
+        content = fetch_robots_txt_content(domain, timestamp)
+    else:
+        url = f"https://web.archive.org/web/{timestamp}id_/{domain}/robots.txt"
+        try:
+            content = request_with_backoff(session, url, rate_limiter).text
+        except requests.exceptions.RequestException:
+            content = None
+    if content is not None:
+        store_robots_txt(digest, content)
+    return content
+
+
+def fetch_robots_txt_versions(domain, changes, workers=CDX_WORKERS):
+    # Downloads every version missing from the store concurrently, returning the contents by digest
+    contents = {digest: load_stored_robots_txt(digest) for _, digest, _ in changes}
+    missing = [version for version in changes if contents[version[1]] is None]
+    if missing:
+        rate_limiter = AdaptiveRateLimiter()
+        with create_cdx_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(get_robots_txt_content, domain, version, session, rate_limiter): version
+                       for version in missing}
+            for future in as_completed(futures):
+                contents[futures[future][1]] = future.result()
+    return contents
+
+
+def diff_robots_txt_contents(old_content, new_content):
+    # Diffs whole lines, which keeps the output readable as a unified-style diff of directives
     dmp = diff_match_patch()
-    diffs = dmp.diff_main(old_content, new_content)
+    old_chars, new_chars, line_array = dmp.diff_linesToChars(old_content, new_content)
+    diffs = dmp.diff_main(old_chars, new_chars, False)
+    dmp.diff_charsToLines(diffs, line_array)
     dmp.diff_cleanupSemantic(diffs)
-
     return diffs
 
+
+def build_robots_txt_history(domain, changes):
+    # Fetches all versions once and diffs every consecutive pair in one batch
+    contents = fetch_robots_txt_versions(domain, changes)
+    consecutive_diffs = []
+    for old_version, new_version in zip(changes, changes[1:]):
+        old_content, new_content = contents[old_version[1]], contents[new_version[1]]
+        if old_content is None or new_content is None:
+            diffs = None
+        else:
+            diffs = diff_robots_txt_contents(old_content, new_content)
+        consecutive_diffs.append((old_version, new_version, diffs))
+    return {'contents': contents, 'consecutive_diffs': consecutive_diffs}
+
+
+def get_robots_txt_history(domain, changes):
+    key = (domain, tuple(digest for _, digest, _ in changes))
+    if key in st.session_state.robots_txt_history:
+        return st.session_state.robots_txt_history[key]
+    history = build_robots_txt_history(domain, changes)
+    # A history with versions that failed to download is not kept, so the next rerun retries them
+    if all(content is not None for content in history['contents'].values()):
+        st.session_state.robots_txt_history[key] = history
+    return history
+
+
+def format_robots_txt_diff(diffs):
+    lines = []
+    for operation, text in diffs:
+        if operation == 0:
+            continue
+        prefix = '+ ' if operation == 1 else '- '
+        lines.extend(prefix + line for line in text.strip('\n').split('\n'))
+    return '\n'.join(lines) if lines else "No changes in content"
+
+
+def compare_robots_txt(domain, old_version, new_version):
+    old_content = get_robots_txt_content(domain, old_version)
+    new_content = get_robots_txt_content(domain, new_version)
+
+    if old_content is None or new_content is None:
+        return "Error: Unable to fetch one or both versions of robots.txt"
+
+    return diff_robots_txt_contents(old_content, new_content)
+
 def visualize_robots_txt_changes(changes):
     df = pd.DataFrame(changes, columns=['timestamp', 'digest', 'content'])
     df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y%m%d%H%M%S')
@@ -327,16 +1019,8 @@ def visualize_robots_txt_changes(changes):
     return fig
 
 # New function to get top changing folders
-def get_top_changing_pages(urls, top_n=10):
-    page_changes = {}
-    for url, _, _, digest in urls:
-        if url not in page_changes:
-            page_changes[url] = set()
-        page_changes[url].add(digest)
-
-    page_change_counts = {url: len(changes) for url, changes in page_changes.items()}
-    sorted_pages = sorted(page_change_counts.items(), key=lambda x: x[1], reverse=True)
-    return sorted_pages[:top_n]
+def get_top_changing_pages(snapshots, top_n=10):
+    return snapshots.url_index().top_changing_pages(top_n)
 
 
 # New function to visualize top changing folders
@@ -372,14 +1056,40 @@ def update_vis_type():
 def on_tab_change():
     st.session_state.active_tab = st.session_state.tab_selector
 
+def get_analysis_fetch_mode(analysis):
+    if st.session_state.get('fetch_mode') == "Full history":
+        return 'full'
+    if analysis == "Download URLs" and st.session_state.get('unique_only'):
+        return 'urlkey'
+    return ANALYSIS_FETCH_MODES.get(analysis, 'full')
+
+
+def get_analysis_snapshots(analysis):
+    # Each analysis fetches only the captures it needs, the first time it is opened
+    mode = get_analysis_fetch_mode(analysis)
+    filters = build_cdx_filters(st.session_state.get('mimetype_filter', []),
+                                st.session_state.get('status_filter', []))
+    key = (st.session_state.domain, mode, tuple(filters))
+    if key not in st.session_state.snapshots:
+        with st.spinner("Fetching URLs... This may take a while for large websites."):
+            snapshots, failed_pages = get_cached_unique_urls(
+                st.session_state.domain, force_refresh=st.session_state.get('force_refresh', False), mode=mode,
+                filters=filters)
+        if not snapshots:
+            return None
+        if failed_pages:
+            st.warning("Some pages of the history are missing. Fetch the URLs again to retry them.")
+        st.session_state.snapshots[key] = snapshots
+    return st.session_state.snapshots[key]
+
+
 def fetch_urls():
     if st.session_state.domain:
-        with st.spinner("Fetching URLs... This may take a while for large websites."):
-            unique_urls = get_unique_urls(st.session_state.domain)
+        st.session_state.snapshots = {}
+        unique_urls = get_analysis_snapshots(st.session_state.active_tab)
 
         if unique_urls:
             st.success(f"Found {len(unique_urls)} URLs.")
-            st.session_state.unique_urls = unique_urls
             st.session_state.show_results = True
         else:
             st.warning("No URLs found. Check the domain name.")
@@ -387,53 +1097,25 @@ def fetch_urls():
         st.warning("Please enter a domain.")
 
 
-st.set_page_config(page_title="Internet Archive Analyser", page_icon="🕸️", layout="wide")
-
-# Sidebar content
-st.sidebar.image(
-    "https://upload.wikimedia.org/wikipedia/commons/thumb/0/01/Wayback_Machine_logo_2010.svg/1200px-Wayback_Machine_logo_2010.svg.png",
-    width=200)
-
-st.sidebar.markdown("---")
-
-st.sidebar.subheader("Visualisation Options")
+def init_session_state():
+    if 'vis_type' not in st.session_state:
+        st.session_state.vis_type = "Stacked Line Chart"
+    if 'show_results' not in st.session_state:
+        st.session_state.show_results = False
+    if 'snapshots' not in st.session_state:
+        st.session_state.snapshots = {}
+    if 'domain' not in st.session_state:
+        st.session_state.domain = ""
+    if 'active_tab' not in st.session_state:
+        st.session_state.active_tab = "Folder Visualisation"
+    if 'top_folders_count' not in st.session_state:
+        st.session_state.top_folders_count = 10
+    if 'robots_txt_history' not in st.session_state:
+        st.session_state.robots_txt_history = {}
+    if 'frequently_changed_pages' not in st.session_state:
+        st.session_state.frequently_changed_pages = []
 
-# Move Visualisation type selection to sidebar
-st.sidebar.radio(
-    "Select Visualisation type:",
-    ["Stacked Line Chart", "Stacked Bar Chart"],
-    key="vis_type_radio",
-    on_change=update_vis_type,
-    index=["Stacked Line Chart", "Stacked Bar Chart"].index(st.session_state.vis_type)
-)
 
-# Add slider for top folders count in sidebar
-st.session_state.top_folders_count = st.sidebar.slider(
-    "Number of top folders to display",
-    min_value=5,
-    max_value=50,
-    value=st.session_state.top_folders_count,
-    step=1
-)
-
-st.sidebar.markdown("---")
-
-st.sidebar.subheader("About")
-st.sidebar.info("""
-    This app leverages the Wayback Machine's CDX server to analyze and visualise the historical evolution of websites.
-
-    1. URL Retrieval: Fetches all archived URLs for a given domain from the Internet Archive.
-    2. Folder Structure Visualisation: Displays how the website's folder structure has changed over time.
-    3. Status Code Analysis: Shows the distribution of HTTP status codes across the site's history.
-    4. Frequently Changed Pages: Identifies and lists the pages that have been modified most often.
-    5. robots.txt Evolution: Tracks and visualises changes to the site's robots.txt file over time.
-    6. Rover from Failed Migrations
-""")
-
-# Main content
-st.title("🕸️ Wayback Machine URL Fetcher")
-
-st.write("Fetch and filter URLs from the Wayback Machine for any domain.")
 
 def handle_submit():
     if st.session_state.domain:
@@ -441,177 +1123,253 @@ def handle_submit():
     else:
         st.warning("Please enter a domain.")
 
-# Input form
-with st.form(key='url_form'):
-    st.session_state.domain = st.text_input(
-        "Enter a domain (e.g., example.com):",
-        help="You can enter the domain with or without 'http://' or 'https://'",
-        value=st.session_state.domain
-    )
-    submit_button = st.form_submit_button(label='Fetch URLs')
 
-if submit_button:
-    handle_submit()
+def main():
+    init_session_state()
 
-def fetch_robots_txt_content(domain, timestamp):
-    url = f"https://web.archive.org/web/{timestamp}id_/{domain}/robots.txt"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.text
-    else:
-        return None
+    st.set_page_config(page_title="Internet Archive Analyser", page_icon="🕸️", layout="wide")
 
+    # Sidebar content
+    st.sidebar.image(
+        "https://upload.wikimedia.org/wikipedia/commons/thumb/0/01/Wayback_Machine_logo_2010.svg/1200px-Wayback_Machine_logo_2010.svg.png",
+        width=200)
 
-# Display results after form submission
-if st.session_state.show_results:
-    # Create tabs
-    tab_names = ["Folder Visualisation", "Status Code Visualisation", "Frequently Changed Pages", "robots.txt Changes",
-                 "Download URLs"]
+    st.sidebar.markdown("---")
 
-    # Use a single selectbox to choose the active tab
-    selected_tab = st.selectbox("Select a tab:", tab_names, key="tab_selector", on_change=on_tab_change,
-                                index=tab_names.index(st.session_state.active_tab))
+    st.sidebar.subheader("Visualisation Options")
 
-    # Update active_tab based on selection
-    if selected_tab != st.session_state.active_tab:
-        st.session_state.active_tab = selected_tab
+    # Move Visualisation type selection to sidebar
+    st.sidebar.radio(
+        "Select Visualisation type:",
+        ["Stacked Line Chart", "Stacked Bar Chart"],
+        key="vis_type_radio",
+        on_change=update_vis_type,
+        index=["Stacked Line Chart", "Stacked Bar Chart"].index(st.session_state.vis_type)
+    )
 
-    # Display content based on the selected tab
-    if st.session_state.active_tab == "Folder Visualisation":
-        st.header("Folder Visualisation")
-        st.plotly_chart(visualize_folder_types_over_time(st.session_state.unique_urls, st.session_state.vis_type),
-                        use_container_width=True)
+    # Add slider for top folders count in sidebar
+    st.session_state.top_folders_count = st.sidebar.slider(
+        "Number of top folders to display",
+        min_value=5,
+        max_value=50,
+        value=st.session_state.top_folders_count,
+        step=1
+    )
 
-    elif st.session_state.active_tab == "Status Code Visualisation":
-        st.header("Status Code Visualisation")
-        st.plotly_chart(visualize_status_codes_over_time(st.session_state.unique_urls, st.session_state.vis_type),
-                        use_container_width=True)
+    st.sidebar.markdown("---")
 
-    elif st.session_state.active_tab == "Frequently Changed Pages":
-        # st.header("Frequently Changed Pages")
+    st.sidebar.subheader("About")
+    st.sidebar.info(ABOUT_TEXT)
 
-        top_changing_pages = get_top_changing_pages(st.session_state.unique_urls,
-                                                    top_n=st.session_state.top_folders_count)
+    # Main content
+    st.title("🕸️ Wayback Machine URL Fetcher")
 
-        # Visualisation
-        st.subheader(f"Top {st.session_state.top_folders_count} Frequently Changing Pages")
-        st.plotly_chart(visualize_top_changing_pages(top_changing_pages, st.session_state.vis_type),
-                        use_container_width=True)
+    st.write("Fetch and filter URLs from the Wayback Machine for any domain.")
 
-        # Dropdown menu
-        selected_page = st.selectbox(
-            "Select a frequently changing page:",
-            options=[f"{page} ({changes})" for page, changes in top_changing_pages],
-            format_func=lambda x: x
+    # Input form
+    with st.form(key='url_form'):
+        st.session_state.domain = st.text_input(
+            "Enter a domain (e.g., example.com):",
+            help="You can enter the domain with or without 'http://' or 'https://'",
+            value=st.session_state.domain
         )
-
-        if selected_page:
-            page = selected_page.split(" (")[0]
-            page_urls = [item for item in st.session_state.unique_urls if item[0] == page]
-            page_urls.sort(key=lambda x: x[1], reverse=True)  # Sort by timestamp, most recent first
-
-            st.subheader(f"Change History for {page}")
-            for i, (url, timestamp, statuscode, digest) in enumerate(page_urls[:50]):  # Show top 50 changes
-                with st.expander(f"{timestamp}"):
-                    col1, col2, col3 = st.columns([2, 1, 1])
-                    with col1:
-                        st.write(f"URL: {url}")
-                    with col2:
-                        st.write(f"Status: {statuscode}")
-                    with col3:
-                        wayback_url = f"https://web.archive.org/web/{timestamp}/{url}"
-                        st.markdown(f"[View Version]({wayback_url})")
-                    st.write(f"Digest: {digest}")
-
-            st.write("Note: Showing up to 50 most recent changes per page.")
-
-    elif st.session_state.active_tab == "robots.txt Changes":
-        st.header("robots.txt Changes")
-
-        robots_txt_data = fetch_robots_txt_data(st.session_state.domain)
-        if robots_txt_data:
-            changes = process_robots_txt_changes(robots_txt_data)
-            if changes:
-                fig = visualize_robots_txt_changes(changes)
-                st.plotly_chart(fig, use_container_width=True)
-
-                st.subheader("Compare unique robots.txt versions")
-                col1, col2 = st.columns(2)
-                with col1:
-                    date1 = st.selectbox("Select first version", options=changes,
-                                         format_func=lambda x: pd.to_datetime(x[0], format='%Y%m%d%H%M%S'), key="date1")
-                with col2:
-                    date2 = st.selectbox("Select second version", options=changes,
-                                         format_func=lambda x: pd.to_datetime(x[0], format='%Y%m%d%H%M%S'), index=1,
-                                         key="date2")
-
-                if st.button("Compare versions"):
-                    with st.spinner("Fetching and comparing robots.txt versions..."):
-                        diffs = compare_robots_txt(st.session_state.domain, date1, date2)
-
-                    # Display the full content of both versions
-                    st.subheader("Full content of selected versions")
+        st.selectbox("Fetch mode:", ["Automatic (per analysis)", "Full history"], key='fetch_mode',
+                     help="Automatic asks the CDX server for one capture per URL per year for the folder and status "
+                          "charts, and one capture per content change for the changed pages.")
+        filter_col1, filter_col2 = st.columns(2)
+        with filter_col1:
+            st.multiselect("Only fetch MIME types:", list(MIMETYPE_FILTERS), key='mimetype_filter')
+        with filter_col2:
+            st.multiselect("Only fetch status codes:", list(STATUS_FILTERS), key='status_filter')
+        st.checkbox("Ignore cached results and fetch the full history again", key='force_refresh')
+        submit_button = st.form_submit_button(label='Fetch URLs')
+
+    if submit_button:
+        handle_submit()
+
+    # Display results after form submission
+    if st.session_state.show_results:
+        # Create tabs
+        tab_names = ["Folder Visualisation", "Status Code Visualisation", "Frequently Changed Pages", "robots.txt Changes",
+                     "Download URLs"]
+
+        # Use a single selectbox to choose the active tab
+        selected_tab = st.selectbox("Select a tab:", tab_names, key="tab_selector", on_change=on_tab_change,
+                                    index=tab_names.index(st.session_state.active_tab))
+
+        # Update active_tab based on selection
+        if selected_tab != st.session_state.active_tab:
+            st.session_state.active_tab = selected_tab
+
+        # Display content based on the selected tab
+        if st.session_state.active_tab == "Folder Visualisation":
+            st.header("Folder Visualisation")
+            snapshots = get_analysis_snapshots(st.session_state.active_tab)
+            if snapshots:
+                st.plotly_chart(visualize_folder_types_over_time(snapshots, st.session_state.vis_type,
+                                                                 st.session_state.top_folders_count),
+                                use_container_width=True)
+
+        elif st.session_state.active_tab == "Status Code Visualisation":
+            st.header("Status Code Visualisation")
+            snapshots = get_analysis_snapshots(st.session_state.active_tab)
+            if snapshots:
+                st.plotly_chart(visualize_status_codes_over_time(snapshots, st.session_state.vis_type),
+                                use_container_width=True)
+
+        elif st.session_state.active_tab == "Frequently Changed Pages":
+            # st.header("Frequently Changed Pages")
+
+            snapshots = get_analysis_snapshots(st.session_state.active_tab) or SnapshotStore.from_rows([])
+            top_changing_pages = get_top_changing_pages(snapshots, top_n=st.session_state.top_folders_count)
+
+            # Visualisation
+            st.subheader(f"Top {st.session_state.top_folders_count} Frequently Changing Pages")
+            st.plotly_chart(visualize_top_changing_pages(top_changing_pages, st.session_state.vis_type),
+                            use_container_width=True)
+
+            # Dropdown menu
+            selected_page = st.selectbox(
+                "Select a frequently changing page:",
+                options=[f"{page} ({changes})" for page, changes in top_changing_pages],
+                format_func=lambda x: x
+            )
+
+            if selected_page:
+                page = selected_page.split(" (")[0]
+                # The index keeps each page's snapshots sorted by timestamp, most recent first
+                page_urls = snapshots.rows(snapshots.url_index().history(page, limit=50))
+
+                st.subheader(f"Change History for {page}")
+                for i, (url, timestamp, statuscode, digest) in enumerate(page_urls[:50]):  # Show top 50 changes
+                    with st.expander(f"{timestamp}"):
+                        col1, col2, col3 = st.columns([2, 1, 1])
+                        with col1:
+                            st.write(f"URL: {url}")
+                        with col2:
+                            st.write(f"Status: {statuscode}")
+                        with col3:
+                            wayback_url = f"https://web.archive.org/web/{timestamp}/{url}"
+                            st.markdown(f"[View Version]({wayback_url})")
+                        st.write(f"Digest: {digest}")
+
+                st.write("Note: Showing up to 50 most recent changes per page.")
+
+        elif st.session_state.active_tab == "robots.txt Changes":
+            st.header("robots.txt Changes")
+
+            robots_txt_data = get_cached_robots_txt_data(st.session_state.domain,
+                                                         force_refresh=st.session_state.get('force_refresh', False))
+            if robots_txt_data:
+                changes = process_robots_txt_changes(robots_txt_data)
+                if changes:
+                    fig = visualize_robots_txt_changes(changes)
+                    st.plotly_chart(fig, use_container_width=True)
+
+                    with st.spinner("Fetching all robots.txt versions..."):
+                        robots_txt_history = get_robots_txt_history(st.session_state.domain, changes)
+                    contents = robots_txt_history['contents']
+
+                    st.subheader("Changes between consecutive versions")
+                    for old_version, new_version, diffs in reversed(robots_txt_history['consecutive_diffs']):
+                        old_date = pd.to_datetime(old_version[0], format='%Y%m%d%H%M%S')
+                        new_date = pd.to_datetime(new_version[0], format='%Y%m%d%H%M%S')
+                        with st.expander(f"{old_date} → {new_date}"):
+                            if diffs is None:
+                                st.write("Unable to fetch one or both versions of robots.txt")
+                            else:
+                                st.code(format_robots_txt_diff(diffs), language="diff")
+
+                    st.subheader("Compare unique robots.txt versions")
                     col1, col2 = st.columns(2)
                     with col1:
-                        st.text(f"Version from {pd.to_datetime(date1[0], format='%Y%m%d%H%M%S')}")
-                        content1 = fetch_robots_txt_content(st.session_state.domain, date1[0])
-                        st.code(content1, language="text")
+                        date1 = st.selectbox("Select first version", options=changes,
+                                             format_func=lambda x: pd.to_datetime(x[0], format='%Y%m%d%H%M%S'), key="date1")
                     with col2:
-                        st.text(f"Version from {pd.to_datetime(date2[0], format='%Y%m%d%H%M%S')}")
-                        content2 = fetch_robots_txt_content(st.session_state.domain, date2[0])
-                        st.code(content2, language="text")
-
-    elif st.session_state.active_tab == "Download URLs":
-        st.header("Download URLs")
-
-        # Add filter options here
-        filter_option = st.radio(
-            "Select URL filter option:",
-            ["All (HTML, Images, CSS, JS, etc.)", "HTML only", "HTML + Images"],
-            index=0,
-            help="Choose which types of URLs to include in the download. 'HTML only' includes HTML files and robots.txt, but excludes .json, .xml, and other .txt files."
-        )
-
-        unique_only = st.checkbox("Export only unique URLs", value=False,
-                                  help="If checked, only one instance of each URL will be exported, regardless of how many times it was captured.")
-
-
-        # Function to apply filter
-        def apply_filter(url, option):
-            if option == "All (HTML, Images, CSS, JS, etc.)":
-                return True
-            elif option == "HTML only":
-                return url.endswith(('.html', '.htm', '/')) or url.endswith('robots.txt')
-            elif option == "HTML + Images":
-                return url.endswith(('.html', '.htm', '/', '.jpg', '.jpeg', '.png', '.gif', '.svg')) or url.endswith(
-                    'robots.txt')
-
-
-        # Filter URLs based on selected option
-        filtered_urls = [url for url in st.session_state.unique_urls if apply_filter(url[0], filter_option)]
-
-        # If unique_only is checked, keep only unique URLs
-        if unique_only:
-            unique_urls = {}
-            for url, timestamp, statuscode, digest in filtered_urls:
-                if url not in unique_urls:
-                    unique_urls[url] = (url, timestamp, statuscode, digest)
-            filtered_urls = list(unique_urls.values())
-
-        # Prepare CSV content with headers
-        csv_content = "URL,Timestamp,Status Code,Digest\n"
-        csv_content += "\n".join(
-            [f"{url},{timestamp},{statuscode},{digest}" for url, timestamp, statuscode, digest in filtered_urls])
-
-        # Convert to bytes with UTF-8-SIG encoding (UTF-8 with BOM)
-        csv_bytes = csv_content.encode('utf-8-sig')
-
-        st.download_button(
-            label="Download Filtered URLs",
-            data=csv_bytes,
-            file_name=f"{st.session_state.domain}_filtered_urls.csv",
-            mime="text/csv",
-            key="download"
-        )
-
-        st.write(f"Total URLs after filtering: {len(filtered_urls)}")
+                        date2 = st.selectbox("Select second version", options=changes,
+                                             format_func=lambda x: pd.to_datetime(x[0], format='%Y%m%d%H%M%S'), index=1,
+                                             key="date2")
+
+                    if st.button("Compare versions"):
+                        content1, content2 = contents[date1[1]], contents[date2[1]]
+                        if content1 is not None and content2 is not None:
+                            st.code(format_robots_txt_diff(diff_robots_txt_contents(content1, content2)),
+                                    language="diff")
+
+                        # Display the full content of both versions
+                        st.subheader("Full content of selected versions")
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            st.text(f"Version from {pd.to_datetime(date1[0], format='%Y%m%d%H%M%S')}")
+                            st.code(content1, language="text")
+                        with col2:
+                            st.text(f"Version from {pd.to_datetime(date2[0], format='%Y%m%d%H%M%S')}")
+                            st.code(content2, language="text")
+
+        elif st.session_state.active_tab == "Download URLs":
+            st.header("Download URLs")
+
+            # Add filter options here
+            filter_option = st.radio(
+                "Select URL filter option:",
+                ["All (HTML, Images, CSS, JS, etc.)", "HTML only", "HTML + Images"],
+                index=0,
+                help="Choose which types of URLs to include in the download. 'HTML only' includes HTML files and robots.txt, but excludes .json, .xml, and other .txt files."
+            )
+
+            unique_only = st.checkbox("Export only unique URLs", value=False, key='unique_only',
+                                      help="If checked, only one instance of each URL will be exported, regardless of how many times it was captured.")
+
+            prefix_col, regex_col = st.columns(2)
+            with prefix_col:
+                url_prefix = st.text_input("Only URLs starting with:", help="For example http://example.com/blog/")
+            with regex_col:
+                url_pattern = st.text_input("Only URLs matching the regular expression:")
+
+
+            # Function to apply filter
+            def apply_filter(url, option):
+                if option == "All (HTML, Images, CSS, JS, etc.)":
+                    return True
+                elif option == "HTML only":
+                    return url.endswith(('.html', '.htm', '/')) or url.endswith('robots.txt')
+                elif option == "HTML + Images":
+                    return url.endswith(('.html', '.htm', '/', '.jpg', '.jpeg', '.png', '.gif', '.svg')) or url.endswith(
+                        'robots.txt')
+
+
+            # Filter URLs based on selected option, each distinct URL is only tested once
+            snapshots = get_analysis_snapshots(st.session_state.active_tab) or SnapshotStore.from_rows([])
+            url_index = snapshots.url_index()
+            filter_key = ('url_filter', filter_option)
+            if filter_key not in snapshots.aggregates:
+                snapshots.aggregates[filter_key] = np.flatnonzero(
+                    [apply_filter(url, filter_option) for url in snapshots.urls.categories])
+            filtered_codes = snapshots.aggregates[filter_key]
+            if url_prefix:
+                filtered_codes = np.intersect1d(filtered_codes, url_index.codes_with_prefix(url_prefix))
+            if url_pattern:
+                try:
+                    filtered_codes = np.intersect1d(filtered_codes, url_index.codes_matching(url_pattern))
+                except re.error as e:
+                    st.error(f"Invalid regular expression: {e}")
+
+            # If unique_only is checked, keep only the first snapshot of each URL
+            filtered_positions = url_index.positions(filtered_codes, first_only=unique_only)
+
+            # Prepare CSV content with headers, as UTF-8 with BOM
+            csv_bytes = snapshots.to_csv_bytes(filtered_positions)
+
+            st.download_button(
+                label="Download Filtered URLs",
+                data=csv_bytes,
+                file_name=f"{st.session_state.domain}_filtered_urls.csv",
+                mime="text/csv",
+                key="download"
+            )
+
+            st.write(f"Total URLs after filtering: {len(filtered_positions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+""" Migration Mapper Mode Check | Confirms the serial, sharded and streamed runs of migration-mapper.py agree
+
+Generates synthetic live and staging crawls with the benchmark's generator, maps them with a serial Chunked TF-IDF
+run, a --workers run and a --chunk-rows run of migration-mapper.py, and compares the output CSVs byte for byte.
+Runs fully offline and exits with status 1 when any mode differs from the serial run.
+
+Usage:
+    python mapper-mode-check.py --sizes 1000 20000 --workers 4 --chunk-rows 3000
+"""
+
+import argparse
+import filecmp
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import pandas as pd
+
+BENCHMARK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migration-benchmark.py')
+MAPPER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python-script',
+                           'migration-mapper.py')
+
+SIZES = [1000, 20000]
+
+def load_benchmark(benchmark_path):
+    spec = importlib.util.spec_from_file_location('migration_benchmark', benchmark_path)
+    benchmark = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(benchmark)
+    return benchmark
+
+def run_mapper(mapper_path, live_path, staging_path, output_path, extra_args):
+    command = [sys.executable, mapper_path, '--live', live_path, '--staging', staging_path, '--output', output_path,
+               '--model', 'Chunked TF-IDF'] + extra_args
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+def count_differing_rows(expected_path, actual_path):
+    df_expected = pd.read_csv(expected_path, dtype=str, keep_default_na=False)
+    df_actual = pd.read_csv(actual_path, dtype=str, keep_default_na=False)
+    if df_expected.shape != df_actual.shape:
+        return max(len(df_expected), len(df_actual))
+    return int(df_expected.ne(df_actual).any(axis=1).sum())
+
+def check_modes(args):
+    benchmark = load_benchmark(BENCHMARK_PATH)
+    modes = {
+        'sharded': ['--workers', str(args.workers)],
+        'streamed': ['--chunk-rows', str(args.chunk_rows)],
+        'streamed + sharded': ['--chunk-rows', str(args.chunk_rows), '--workers', str(args.workers)],
+    }
+
+    all_match = True
+    with tempfile.TemporaryDirectory(prefix='mapper-mode-check-') as work_dir:
+        for num_rows in args.sizes:
+            df_live, df_staging = benchmark.generate_synthetic_crawls(num_rows, args.seed)
+            live_path = os.path.join(work_dir, f"live_{num_rows}.csv")
+            staging_path = os.path.join(work_dir, f"staging_{num_rows}.csv")
+            df_live.to_csv(live_path, index=False)
+            df_staging.to_csv(staging_path, index=False)
+
+            print(f"Mapping {num_rows} rows serially...")
+            serial_path = os.path.join(work_dir, f"serial_{num_rows}.csv")
+            run_mapper(args.mapper, live_path, staging_path, serial_path, [])
+
+            for mode, extra_args in modes.items():
+                print(f"Mapping {num_rows} rows {mode}...")
+                mode_path = os.path.join(work_dir, f"{mode.replace(' + ', '_')}_{num_rows}.csv")
+                run_mapper(args.mapper, live_path, staging_path, mode_path, extra_args)
+                if filecmp.cmp(serial_path, mode_path, shallow=False):
+                    print("  identical to the serial run")
+                else:
+                    all_match = False
+                    differing_rows = count_differing_rows(serial_path, mode_path)
+                    print(f"  {differing_rows} of {num_rows} rows differ from the serial run")
+    return all_match
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Check that every migration-mapper.py mode writes the same CSV.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="Rows per synthetic crawl")
+    parser.add_argument('--workers', type=int, default=4, help="Worker processes of the sharded runs")
+    parser.add_argument('--chunk-rows', type=int, default=3000, help="Live rows per chunk of the streamed runs")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic crawls")
+    parser.add_argument('--mapper', default=MAPPER_PATH, help="Path to migration-mapper.py")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    if not check_modes(args):
+        print("The sharded or streamed output differs from the serial run.")
+        sys.exit(1)
+    print("All modes wrote the same CSV.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+""" Website Migration Benchmark | Times the matching pipeline of the Streamlit app on synthetic crawls
+
+Generates live and staging crawls with realistic URL, H1 and title changes between them, runs each stage of the
+app's pipeline on them and records the time taken and the peak memory used. Runs fully offline.
+
+Usage:
+    python migration-benchmark.py --sizes 1000 10000 100000 500000 --models "TF-IDF" "Chunked TF-IDF"
+
+Each size and model combination runs in a fresh process, so the peak RSS of one run does not leak into the next.
+Models building a dense live x staging similarity matrix are skipped above --max-dense-rows.
+"""
+
+import argparse
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'streamlit-source', 'website-migration.py')
+
+SIZES = [1000, 10000, 100000, 500000]
+MODELS = ['TF-IDF', 'Edit Distance', 'RapidFuzz', 'Chunked TF-IDF', 'URL Structure']
+# These models score every live x staging pair, so they are only run up to --max-dense-rows
+DENSE_MODELS = {'TF-IDF', 'Edit Distance', 'RapidFuzz'}
+MATCHING_COLUMNS = ['Address', 'H1-1', 'Title 1']
+
+CATEGORIES = ['products', 'blog', 'news', 'guides', 'collections', 'support', 'brands', 'offers', 'stores', 'help']
+RENAMED_CATEGORIES = {'products': 'shop', 'blog': 'articles', 'collections': 'range', 'offers': 'deals'}
+
+
+# Synthetic crawls ----------------------------------------------------------------------------------------------------
+
+def build_vocabulary(rng, size=5000):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return sorted({''.join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)})
+
+def add_typo(rng, text):
+    # Swap two neighbouring characters, the most common kind of small edit in a rewritten H1
+    if len(text) < 4:
+        return text
+    position = rng.randint(0, len(text) - 2)
+    return text[:position] + text[position + 1] + text[position] + text[position + 2:]
+
+def generate_live_page(rng, vocabulary, page_id):
+    words = rng.sample(vocabulary, rng.randint(2, 5))
+    category = rng.choice(CATEGORIES)
+    address = f"https://www.example.com/{category}/{'-'.join(words)}"
+    if rng.random() < 0.3:
+        address += f"/{page_id}"
+    if rng.random() < 0.05:
+        address += f"?utm_source=newsletter&utm_campaign={rng.choice(words)}"
+    h1 = ' '.join(words).title()
+    return {'Address': address, 'H1-1': h1, 'Title 1': f"{h1} | Example Store"}
+
+def migrate_page(rng, vocabulary, page):
+    # Most pages keep their path, the rest get the kinds of changes a re-platform makes
+    path = page['Address'].split('?', 1)[0].replace('https://www.example.com', '')
+    segments = path.strip('/').split('/')
+    change = rng.random()
+    if change < 0.15:
+        segments[0] = RENAMED_CATEGORIES.get(segments[0], segments[0])
+    elif change < 0.25:
+        words = segments[1].split('-')
+        words[rng.randrange(len(words))] = rng.choice(vocabulary)
+        segments[1] = '-'.join(words)
+    elif change < 0.35 and len(segments) > 2:
+        segments = segments[:2]
+    path = '/' + '/'.join(segments)
+    suffix = rng.random()
+    if suffix < 0.1:
+        path += '/'
+    elif suffix < 0.15:
+        path += '.html'
+
+    h1 = page['H1-1']
+    rewrite = rng.random()
+    if rewrite < 0.2:
+        h1 = add_typo(rng, h1)
+    elif rewrite < 0.3:
+        h1 = f"{h1} {rng.choice(vocabulary).title()}"
+    title = f"{h1} | Example Store" if rng.random() < 0.5 else f"{h1} - Example"
+    return {'Address': f"https://staging.example.com{path}", 'H1-1': h1, 'Title 1': title}
+
+def generate_synthetic_crawls(num_rows, seed=0):
+    rng = random.Random(seed)
+    vocabulary = build_vocabulary(rng)
+    live_pages = [generate_live_page(rng, vocabulary, page_id) for page_id in range(num_rows)]
+
+    # 5% of the pages are removed in the migration and replaced by new ones
+    staging_pages = [migrate_page(rng, vocabulary, page) for page in live_pages if rng.random() >= 0.05]
+    while len(staging_pages) < num_rows:
+        new_page = generate_live_page(rng, vocabulary, num_rows + len(staging_pages))
+        staging_pages.append(migrate_page(rng, vocabulary, new_page))
+    rng.shuffle(staging_pages)
+    return pd.DataFrame(live_pages), pd.DataFrame(staging_pages)
+
+
+# Benchmark runs ------------------------------------------------------------------------------------------------------
+
+def load_app(app_path):
+    spec = importlib.util.spec_from_file_location('website_migration', app_path)
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    return app
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS, worker processes are counted separately
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(peak / scale, 1)
+
+def run_benchmark_case(app_path, num_rows, selected_model, matching_columns, export_mode, seed, work_dir):
+    app = load_app(app_path)
+    stages = []
+
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        stages.append({'stage': stage, 'seconds': round(time.perf_counter() - start, 3), 'peak_rss_mb': peak_rss_mb()})
+        return result
+
+    # The crawls of each size are generated once and shared by every model
+    live_path = os.path.join(work_dir, f"live_{num_rows}.csv")
+    staging_path = os.path.join(work_dir, f"staging_{num_rows}.csv")
+    if not os.path.exists(live_path):
+        df_live, df_staging = timed('generate', generate_synthetic_crawls, num_rows, seed)
+        df_live.to_csv(live_path, index=False)
+        df_staging.to_csv(staging_path, index=False)
+        del df_live, df_staging
+
+    def read_crawls():
+        # The app receives uploads as in-memory files
+        with open(live_path, 'rb') as live_file, open(staging_path, 'rb') as staging_file:
+            live_upload, staging_upload = io.BytesIO(live_file.read()), io.BytesIO(staging_file.read())
+        return (app.read_csv_file_with_detected_encoding(live_upload, 'str', usecols=matching_columns),
+                app.read_csv_file_with_detected_encoding(staging_upload, 'str', usecols=matching_columns))
+
+    df_live, df_staging = timed('read', read_crawls)
+    df_live, df_staging = timed('lowercase', lambda: (app.convert_dataframe_to_lowercase(df_live),
+                                                      app.convert_dataframe_to_lowercase(df_staging)))
+
+    model = app.setup_matching_model(selected_model)
+    matches_scores = {}
+    for col in matching_columns:
+        matches_scores.update(timed(f'match {col}', app.match_columns_and_compute_scores, model, df_live,
+                                    df_staging, [col]))
+
+    additional_columns = [col for col in matching_columns if col != 'Address']
+    df_final = timed('best match', app.finalise_match_results_processing, df_live, df_staging, matches_scores,
+                     matching_columns, additional_columns)
+
+    def export_excel():
+        score_data = app.generate_score_distribution_dataframe(df_final.copy())
+        excel_path = os.path.join(work_dir, f"migration_{num_rows}.xlsx")
+        if export_mode == 'Streaming Excel':
+            app.write_streaming_excel_file(df_final, score_data, excel_path)
+        else:
+            excel_writer = app.create_excel_with_dataframes(df_final, score_data, excel_path)
+            app.apply_formatting_to_excel_sheets(excel_writer, df_final)
+            app.add_chart_to_excel_sheet(excel_writer, score_data)
+            excel_writer.close()
+        os.remove(excel_path)
+
+    timed('excel export', export_excel)
+
+    timings = [stage for stage in stages if stage['stage'] != 'generate']
+    return {
+        'rows': num_rows,
+        'model': selected_model,
+        'status': 'ok',
+        'stages': stages,
+        'total_seconds': round(sum(stage['seconds'] for stage in timings), 3),
+        'peak_rss_mb': max(stage['peak_rss_mb'] for stage in stages),
+        'median_match_score': round(float(df_final['Median Match Score'].mean()), 4),
+    }
+
+def run_benchmarks(args):
+    results = []
+    # The synthetic crawls and exports can take hundreds of MB, they are removed once the runs are done
+    with tempfile.TemporaryDirectory(prefix='migration-benchmark-') as work_dir:
+        for num_rows in args.sizes:
+            for selected_model in args.models:
+                if selected_model in DENSE_MODELS and num_rows > args.max_dense_rows:
+                    print(f"Skipping {selected_model} at {num_rows} rows (over --max-dense-rows)")
+                    results.append({'rows': num_rows, 'model': selected_model, 'status': 'skipped'})
+                    continue
+
+                print(f"Benchmarking {selected_model} at {num_rows} rows...")
+                # A fresh process per run keeps the peak RSS of each run separate
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    future = executor.submit(run_benchmark_case, args.app, num_rows, selected_model, args.columns,
+                                             args.export_mode, args.seed, work_dir)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"Error benchmarking {selected_model} at {num_rows} rows: {e}")
+                        result = {'rows': num_rows, 'model': selected_model, 'status': 'failed', 'error': str(e)}
+                results.append(result)
+                if result['status'] == 'ok':
+                    print(f"  {result['total_seconds']}s, peak RSS {result['peak_rss_mb']} MB")
+    return results
+
+
+# Reports -------------------------------------------------------------------------------------------------------------
+
+def format_markdown_report(results, export_mode):
+    stage_names = []
+    for result in results:
+        for stage in result.get('stages', []):
+            if stage['stage'] != 'generate' and stage['stage'] not in stage_names:
+                stage_names.append(stage['stage'])
+
+    header = ['Rows', 'Model'] + [f"{stage} (s)" for stage in stage_names] + ['Total (s)', 'Peak RSS (MB)',
+                                                                              'Mean median score']
+    lines = ['# Website Migration Benchmark', '', f"Export mode: {export_mode}", '',
+             '| ' + ' | '.join(header) + ' |', '|' + '---|' * len(header)]
+    for result in results:
+        if result['status'] != 'ok':
+            cells = [f"{result['rows']:,}", result['model']] + [result['status']] * (len(header) - 2)
+        else:
+            seconds = {stage['stage']: stage['seconds'] for stage in result['stages']}
+            cells = ([f"{result['rows']:,}", result['model']] +
+                     [str(seconds.get(stage, '')) for stage in stage_names] +
+                     [str(result['total_seconds']), str(result['peak_rss_mb']), str(result['median_match_score'])])
+        lines.append('| ' + ' | '.join(cells) + ' |')
+    return '\n'.join(lines) + '\n'
+
+def write_reports(results, output_dir, export_mode):
+    os.makedirs(output_dir, exist_ok=True)
+    report_name = f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}"
+    json_path = os.path.join(output_dir, f"{report_name}.json")
+    markdown_path = os.path.join(output_dir, f"{report_name}.md")
+
+    with open(json_path, 'w', encoding='utf-8') as json_file:
+        json.dump({'export_mode': export_mode, 'python': sys.version.split()[0], 'cpu_count': os.cpu_count(),
+                   'results': results}, json_file, indent=2)
+    with open(markdown_path, 'w', encoding='utf-8') as markdown_file:
+        markdown_file.write(format_markdown_report(results, export_mode))
+    return json_path, markdown_path
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the website migration matching pipeline.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="Rows per synthetic crawl")
+    parser.add_argument('--models', nargs='+', default=MODELS, choices=MODELS, help="Matching models to run")
+    parser.add_argument('--columns', nargs='+', default=MATCHING_COLUMNS, help="Columns to match on")
+    parser.add_argument('--export-mode', default='Formatted Excel', choices=['Formatted Excel', 'Streaming Excel'],
+                        help="Excel export used for the export stage")
+    parser.add_argument('--max-dense-rows', type=int, default=20000,
+                        help="Largest crawl to run the dense TF-IDF, Edit Distance and RapidFuzz models on")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic crawls")
+    parser.add_argument('--output-dir', default='benchmark-results', help="Directory for the JSON/Markdown reports")
+    parser.add_argument('--app', default=APP_PATH, help="Path to website-migration.py")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    results = run_benchmarks(args)
+    json_path, markdown_path = write_reports(results, args.output_dir, args.export_mode)
+    print(f"Reports written to {json_path} and {markdown_path}")
+
+if __name__ == "__main__":
+    main()
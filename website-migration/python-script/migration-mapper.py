@@ -1,79 +1,339 @@
 """ Automatic Website Migration Tool V5 | 06/12/2023 
 
 Uses a grid search to find the highest scoring match between columns specified in the matching_columns variable.
+
+Usage:
+    python migration-mapper.py --live live.csv --staging staging.csv --output output.csv --workers 8
+
+--model picks the matching model of a serial run. With --workers greater than 1 the live crawl is split into
+contiguous shards that are matched in parallel against a shared, read-only staging index built with the Chunked
+TF-IDF engine. With --chunk-rows the live crawl is streamed through the same engine and written out chunk by
+chunk. Both modes use Chunked TF-IDF whatever --model is set to, and write the same CSV as a serial run with
+--model "Chunked TF-IDF", which benchmark/mapper-mode-check.py verifies on synthetic crawls.
 """
 
+import argparse
+import codecs
 import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 from polyfuzz import PolyFuzz
+from polyfuzz.models import BaseMatcher
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
 from tqdm import tqdm
 import chardet
 
+# Matching model: "TF-IDF" builds the full live x staging similarity matrix through PolyFuzz,
+# "Chunked TF-IDF" scores in row chunks and keeps memory bounded on very large crawls.
+MATCHING_MODEL = "TF-IDF"
+MATCHING_MODELS = ["TF-IDF", "Chunked TF-IDF"]
+TOP_K = 1
+MIN_SIMILARITY = 0.75
+CHUNK_SIZE = 1000
+
+LIVE_PATH = '/python_scripts/migration_mapper/live.csv'
+STAGING_PATH = '/python_scripts/migration_mapper/staging.csv'
+OUTPUT_PATH = '/python_scripts/migration_mapper_output.csv'
+
+# Define the list of columns to match on including 'Address'
+MATCHING_COLUMNS = ['Address', 'H1-1', 'Title 1']  # Example columns
+
+# Query parameters dropped before exact matching, they only track campaigns and never identify a page
+TRACKING_QUERY_PARAMS = r'utm_[^=&]*|gclid|fbclid|msclkid|dclid|yclid|mc_cid|mc_eid|_ga|_gl'
+
+# Encoding detection only reads the start of each crawl, so multi-GB exports are never fully scanned
+ENCODING_SAMPLE_SIZE = 1024 * 1024
+BYTE_ORDER_MARKS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
 def file_exists(file_path):
     if not os.path.isfile(file_path):
         print(f"File not found: {file_path}")
         return False
     return True
 
-def read_csv_with_encoding(file_path, dtype):
-    print(f"Detecting encoding for {file_path}...")
+def detect_encoding_from_sample(file_path, sample_size=ENCODING_SAMPLE_SIZE):
+    """Detect a file's encoding from its byte order mark, or with chardet on a bounded prefix sample."""
     with open(file_path, 'rb') as file:
-        result = chardet.detect(file.read())
-        encoding = result['encoding']
+        sample = file.read(sample_size)
+
+    for byte_order_mark, encoding in BYTE_ORDER_MARKS:
+        if sample.startswith(byte_order_mark):
+            return encoding
+
+    encoding = chardet.detect(sample)['encoding'] or 'utf-8'
+    # An ASCII-only sample says nothing about the rest of the file, UTF-8 is a safe superset
+    if encoding.lower() == 'ascii':
+        encoding = 'utf-8'
+
+    # Fall back when the sample does not decode, it may end part way through a character
+    for candidate in (encoding, 'utf-8'):
+        try:
+            codecs.getincrementaldecoder(candidate)().decode(sample, final=False)
+            return candidate
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return 'latin-1'
+
+def read_csv_with_encoding(file_path, dtype, usecols=None, chunksize=None):
+    print(f"Detecting encoding for {file_path}...")
+    encoding = detect_encoding_from_sample(file_path)
 
     print(f"Reading {file_path} with encoding {encoding}...")
     try:
-        return pd.read_csv(file_path, dtype=dtype, encoding=encoding, on_bad_lines='skip')
+        # Undecodable bytes deep into the file are replaced instead of failing the whole read
+        return pd.read_csv(file_path, dtype=dtype, encoding=encoding, encoding_errors='replace',
+                           on_bad_lines='skip', usecols=usecols, chunksize=chunksize)
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
         return pd.DataFrame()
 
-# Check if files exist before loading
-if file_exists('/python_scripts/migration_mapper/live.csv') and file_exists('/python_scripts/migration_mapper/staging.csv'):
-    df_live = read_csv_with_encoding('/python_scripts/migration_mapper/live.csv', dtype="str")
-    df_staging = read_csv_with_encoding('/python_scripts/migration_mapper/staging.csv', dtype="str")
-else:
-    raise FileNotFoundError("One or more input files are missing.")
-
-# Check if DataFrames are empty
-if df_live.empty or df_staging.empty:
-    raise ValueError("One or more input DataFrames are empty after reading CSV files.")
-
-# Convert to lowercase for case-insensitive matching
-print("Preprocessing data...")
-try:
-    df_live = df_live.apply(lambda col: col.str.lower())
-    df_staging = df_staging.apply(lambda col: col.str.lower())
-except Exception as e:
-    print(f"Error during preprocessing: {e}")
+def compute_chunked_top_k_cosine(from_matrix, to_matrix, top_k=1, min_similarity=0.75, chunk_size=1000):
+    """Top-k cosine similarity between two L2-normalised sparse matrices, computed one row chunk at a time.
 
-# Define the list of columns to match on including 'Address'
-matching_columns = ['Address', 'H1-1', 'Title 1']  # Example columns
+    Returns a (rows x top_k) array of 'to' indices (-1 where there is no match) and their similarities.
+    """
+    num_rows = from_matrix.shape[0]
+    top_indices = np.full((num_rows, top_k), -1, dtype=np.int64)
+    top_similarities = np.zeros((num_rows, top_k), dtype=np.float32)
+    to_matrix_t = to_matrix.T.tocsr()
+
+    for start in range(0, num_rows, chunk_size):
+        end = min(start + chunk_size, num_rows)
+        chunk = (from_matrix[start:end] @ to_matrix_t).tocsr()
+        # Similarities under 0.001 round to 0 and are treated as no match, as PolyFuzz does
+        chunk.data[chunk.data < max(min_similarity, 0.001)] = 0
+        chunk.eliminate_zeros()
+
+        # Sort the non-zero entries by row, then by descending similarity, and keep the first k of each row
+        row_ids = np.repeat(np.arange(end - start), np.diff(chunk.indptr))
+        order = np.lexsort((-chunk.data, row_ids))
+        rank = np.arange(order.size) - chunk.indptr[row_ids[order]]
+        keep = order[rank < top_k]
+        kept_rows = row_ids[keep]
+        kept_ranks = rank[rank < top_k]
+        top_indices[start + kept_rows, kept_ranks] = chunk.indices[keep]
+        top_similarities[start + kept_rows, kept_ranks] = chunk.data[keep]
+
+    return top_indices, top_similarities
+
+def create_top_k_matches_dataframe(from_list, to_list, top_indices, top_similarities):
+    """Convert top-k match indices and similarities into a PolyFuzz style matches DataFrame."""
+    to_array = np.array(list(to_list) + [None], dtype=object)
+    matches = pd.DataFrame({'From': from_list})
+    for rank in range(top_indices.shape[1]):
+        suffix = '' if rank == 0 else f'_{rank + 1}'
+        matches[f'To{suffix}'] = to_array[top_indices[:, rank]]
+        matches[f'Similarity{suffix}'] = np.round(top_similarities[:, rank].astype(float), 3)
+    return matches
+
+def count_document_frequencies(strings, n_gram_range=(3, 3)):
+    """Count how many of the strings hold each character n-gram."""
+    vectorizer = CountVectorizer(analyzer='char', ngram_range=n_gram_range, lowercase=True, binary=True)
+    try:
+        counts = vectorizer.fit_transform(strings)
+    except ValueError:
+        # None of the strings is long enough to hold an n-gram
+        return Counter()
+    return Counter(dict(zip(vectorizer.get_feature_names_out().tolist(),
+                            np.asarray(counts.sum(axis=0)).ravel().tolist())))
+
+def count_column_frequencies(column_strings, frequencies=None, n_gram_range=(3, 3)):
+    """Add the n-gram document frequencies and the number of strings of each column to frequencies.
+
+    Counts add up one block of rows at a time, so a crawl streamed in chunks gets the same IDF weighting
+    as one held in memory.
+    """
+    frequencies = {} if frequencies is None else frequencies
+    for col, strings in column_strings.items():
+        column_frequencies, num_documents = frequencies.get(col, (Counter(), 0))
+        column_frequencies.update(count_document_frequencies(strings, n_gram_range))
+        frequencies[col] = (column_frequencies, num_documents + len(strings))
+    return frequencies
 
-# Create a PolyFuzz model
-print("Initializing PolyFuzz model...")
-model = PolyFuzz("TF-IDF")
+def fit_column_vectorisers(frequencies, n_gram_range=(3, 3)):
+    """Build one CountVectorizer over the n-grams of every column and a separate IDF per column.
+
+    The IDF is smoothed as in sklearn's TfidfTransformer. Returns the CountVectorizer and each column's IDF.
+    """
+    vocabulary = sorted(set().union(*(column_frequencies for column_frequencies, _ in frequencies.values())))
+    count_vectorizer = CountVectorizer(analyzer='char', ngram_range=n_gram_range, lowercase=True, dtype=np.float32,
+                                       vocabulary=vocabulary)
+    idfs = {}
+    for col, (column_frequencies, num_documents) in frequencies.items():
+        document_counts = np.array([column_frequencies.get(term, 0) for term in vocabulary], dtype=np.float64)
+        idfs[col] = np.log((num_documents + 1) / (document_counts + 1)) + 1
+    return count_vectorizer, idfs
+
+def transform_column(count_vectorizer, idf, strings):
+    """TF-IDF weight strings with a column's IDF vector and L2 normalise each row."""
+    return normalize(count_vectorizer.transform(strings).multiply(idf).tocsr()).astype(np.float32)
+
+def vectorise_columns(column_lists, frequencies=None, n_gram_range=(3, 3)):
+    """Vectorise the live and staging lists of every column with one CountVectorizer.
+
+    Each column's IDF comes from frequencies when given, otherwise it is counted over both of its lists.
+    Returns a list of (live_matrix, staging_matrix) TF-IDF pairs in the order of column_lists.
+    """
+    if frequencies is None:
+        frequencies = count_column_frequencies({col: list(staging_list) + list(live_list)
+                                                for col, (live_list, staging_list) in column_lists.items()},
+                                               n_gram_range=n_gram_range)
+    count_vectorizer, idfs = fit_column_vectorisers(frequencies, n_gram_range)
+    return [(transform_column(count_vectorizer, idfs[col], list(live_list)),
+             transform_column(count_vectorizer, idfs[col], list(staging_list)))
+            for col, (live_list, staging_list) in column_lists.items()]
+
+class ChunkedTFIDF(BaseMatcher):
+    """Character n-gram TF-IDF matcher that keeps only the top-k matches per row.
+
+    The vectorizer is fitted once over both lists and the sparse matrices are multiplied in row chunks,
+    so memory is bounded by the chunk size rather than by the live x staging product.
+    """
+
+    def __init__(self, n_gram_range=(3, 3), min_similarity=0.75, top_k=1, chunk_size=1000,
+                 model_id="Chunked TF-IDF"):
+        super().__init__(model_id)
+        self.type = "Chunked TF-IDF"
+        self.n_gram_range = n_gram_range
+        self.min_similarity = min_similarity
+        self.top_k = top_k
+        self.chunk_size = chunk_size
+
+    def match(self, from_list, to_list=None, **kwargs):
+        to_list = from_list if to_list is None else to_list
+        [(from_matrix, to_matrix)] = vectorise_columns({'to': (from_list, to_list)}, n_gram_range=self.n_gram_range)
+        top_indices, top_similarities = compute_chunked_top_k_cosine(
+            from_matrix, to_matrix, self.top_k, self.min_similarity, self.chunk_size)
+        return create_top_k_matches_dataframe(from_list, to_list, top_indices, top_similarities)
+
+    def match_columns(self, column_lists, max_workers=None, frequencies=None):
+        """Match several columns at once, tokenising every column in a single pass.
+
+        One vectorizer counts the n-grams of all columns, each column then gets its own IDF weighting
+        so the scores equal a separate match() per column, unless frequencies counted over other rows
+        are passed in. The columns are matched in worker processes.
+        """
+        match_arguments = vectorise_columns(column_lists, frequencies, self.n_gram_range)
+
+        if max_workers is None:
+            max_workers = min(len(match_arguments), os.cpu_count() or 1)
+
+        if max_workers > 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(compute_chunked_top_k_cosine, from_matrix, to_matrix, self.top_k,
+                                           self.min_similarity, self.chunk_size)
+                           for from_matrix, to_matrix in match_arguments]
+                results = [future.result() for future in tqdm(futures, desc="Matching columns")]
+        else:
+            results = [compute_chunked_top_k_cosine(from_matrix, to_matrix, self.top_k, self.min_similarity,
+                                                    self.chunk_size)
+                       for from_matrix, to_matrix in tqdm(match_arguments, desc="Matching columns")]
+
+        return {col: create_top_k_matches_dataframe(live_list, staging_list, top_indices, top_similarities)
+                for (col, (live_list, staging_list)), (top_indices, top_similarities)
+                in zip(column_lists.items(), results)}
+
+def create_model(matching_model=MATCHING_MODEL):
+    print(f"Initializing PolyFuzz model ({matching_model})...")
+    if matching_model == "Chunked TF-IDF":
+        return PolyFuzz(ChunkedTFIDF(min_similarity=MIN_SIMILARITY, top_k=TOP_K, chunk_size=CHUNK_SIZE))
+    return PolyFuzz("TF-IDF")
+
+# Normalise values so that URLs or headings only differing by formatting can be joined exactly
+def normalise_for_exact_match(values, col):
+    stripped = pd.Series(values, dtype=object).fillna('').astype(str).str.strip().str.lower()
+    normalised = stripped
+    if col == 'Address':
+        # Drop the scheme, domain, fragment, tracking parameters and trailing slash
+        normalised = normalised.str.replace(r'^(?:[a-z][a-z0-9+.-]*:)?//[^/?#]*', '', regex=True)
+        normalised = normalised.str.replace(r'#.*$', '', regex=True)
+        normalised = normalised.str.replace(rf'(?<=[?&])(?:{TRACKING_QUERY_PARAMS})(?:=[^&]*)?(?:&|$)', '',
+                                            regex=True)
+        normalised = normalised.str.replace(r'[?&]+$', '', regex=True)
+        normalised = normalised.str.replace(r'/+(?=\?|$)', '', regex=True)
+        normalised = normalised.mask(normalised.eq('') & stripped.ne(''), '/')
+    else:
+        normalised = normalised.str.replace(r'\s+', ' ', regex=True)
+    return normalised
+
+# Map each normalised staging value to the first staging value it came from, for the exact match join
+def build_exact_match_lookup(staging_list, col):
+    staging_keys = normalise_for_exact_match(staging_list, col)
+    staging_lookup = pd.Series(staging_list, index=staging_keys.values, dtype=object)
+    return staging_lookup[~staging_lookup.index.duplicated(keep='first') & (staging_lookup.index != '')]
+
+# Hash join live values to staging values on their normalised form, returning the exact matches
+# and the unique live values that still need the fuzzy model
+def split_exact_matches(live_list, staging_list, col):
+    return split_exact_matches_on_lookup(live_list, build_exact_match_lookup(staging_list, col), col)
+
+# As split_exact_matches, against a staging lookup built once by build_exact_match_lookup
+def split_exact_matches_on_lookup(live_list, staging_lookup, col):
+    live_values = pd.Series(pd.unique(pd.Series(live_list, dtype=object)), dtype=object)
+    live_keys = normalise_for_exact_match(live_values.tolist(), col)
+    matched_to = live_keys.map(staging_lookup)
+    is_exact = matched_to.notna() & live_keys.ne('')
+
+    exact_matches = pd.DataFrame({'From': live_values[is_exact].values, 'To': matched_to[is_exact].values,
+                                  'Similarity': 1.0})
+    return exact_matches, live_values[~is_exact].tolist()
+
+def combine_exact_and_fuzzy_matches(exact_matches, fuzzy_matches):
+    if fuzzy_matches is None or fuzzy_matches.empty:
+        return exact_matches
+    if exact_matches.empty:
+        return fuzzy_matches
+    return pd.concat([exact_matches, fuzzy_matches], ignore_index=True)
 
 # Function to match and score each column
-def match_and_score(col):
+def match_and_score(model, df_live, df_staging, col):
     # Handle NaN values by replacing them with an empty string
     live_list = df_live[col].fillna('').tolist()
     staging_list = df_staging[col].fillna('').tolist()
 
     # Perform matching only if both lists have content
     if live_list and staging_list:
-        print(f"Matching {col}...")
-        model.match(live_list, staging_list)
-        return model.get_matches()
+        exact_matches, remaining_live_list = split_exact_matches(live_list, staging_list, col)
+        print(f"Matching {col}: {len(exact_matches)} exact, {len(remaining_live_list)} fuzzy...")
+        if not remaining_live_list:
+            return exact_matches
+        model.match(remaining_live_list, staging_list)
+        return combine_exact_and_fuzzy_matches(exact_matches, model.get_matches())
     else:
         return pd.DataFrame(columns=['From', 'To', 'Similarity'])
 
-# Match each column and collect scores
-print("Matching columns and collecting scores...")
-matches_scores = {col: match_and_score(col) for col in tqdm(matching_columns, desc="Matching columns")}
+def match_all_columns(model, df_live, df_staging, matching_columns):
+    # The chunked TF-IDF engine vectorises every column in one pass and matches them in parallel,
+    # only the values without a normalised exact match are sent to it
+    if isinstance(model.method, ChunkedTFIDF) and not (df_live.empty or df_staging.empty):
+        # The IDF is counted over every live row, not only the fuzzy ones, so sharded and streamed runs agree
+        frequencies = count_column_frequencies({col: df_staging[col].fillna('').tolist() +
+                                                df_live[col].fillna('').tolist() for col in matching_columns})
+        exact_matches = {}
+        column_lists = {}
+        for col in matching_columns:
+            staging_list = df_staging[col].fillna('').tolist()
+            exact_matches[col], remaining_live_list = split_exact_matches(df_live[col].fillna('').tolist(),
+                                                                          staging_list, col)
+            if remaining_live_list:
+                column_lists[col] = (remaining_live_list, staging_list)
+        fuzzy_matches = model.method.match_columns(column_lists, frequencies=frequencies) if column_lists else {}
+        return {col: combine_exact_and_fuzzy_matches(exact_matches[col], fuzzy_matches.get(col))
+                for col in matching_columns}
+    return {col: match_and_score(model, df_live, df_staging, col)
+            for col in tqdm(matching_columns, desc="Matching columns")}
 
 # Function to find the overall best match for each row
-def find_best_overall_match(row):
+def find_best_overall_match(row, matches_scores, matching_columns, df_staging):
     best_match_info = {
         'Best Match on': None,
         'Highest Matching URL': None,
@@ -93,28 +353,234 @@ def find_best_overall_match(row):
 
     return pd.Series(best_match_info)
 
-# Apply the function to find the best overall match
-print("Applying match function to each row...")
-try:
-    match_results = df_live.apply(find_best_overall_match, axis=1)
-except Exception as e:
-    print(f"Error during matching process: {e}")
-
-# Concatenate the match results with the original dataframe
-# Ensure to not include 'Address' from matching_columns in the final DataFrame as it is already present in df_live
-print("Compiling final results...")
-try:
+# Sharded matching ----------------------------------------------------------------------------------------------------
+# Each worker process receives the staging index once, then matches contiguous blocks of live rows against it.
+
+_STAGING_INDEX = None
+
+def build_staging_index(df_staging, live_frequencies, matching_columns):
+    """Index the staging side for sharded matching.
+
+    Each column keeps its staging values with their normalised lookup for the exact match join, its IDF counted
+    over the staging and live crawls with the staging TF-IDF matrix, and the Address of the first staging row
+    holding each value. The staging side is only normalised and vectorised here, never per shard.
+    """
+    staging_lists = {col: df_staging[col].fillna('').tolist() for col in matching_columns}
+    count_vectorizer, idfs = fit_column_vectorisers(count_column_frequencies(staging_lists, live_frequencies))
+    staging_index = {'count_vectorizer': count_vectorizer, 'columns': {}}
+    addresses = df_staging['Address'].to_numpy(dtype=object)
+    for col in matching_columns:
+        # The best match URL is the Address of the first staging row holding the matched value
+        first_addresses = pd.Series(addresses, index=df_staging[col].to_numpy(dtype=object))
+        first_addresses = first_addresses[~first_addresses.index.duplicated(keep='first')]
+        staging_index['columns'][col] = {'values': staging_lists[col],
+                                         'exact_lookup': build_exact_match_lookup(staging_lists[col], col),
+                                         'idf': idfs[col],
+                                         'matrix': transform_column(count_vectorizer, idfs[col],
+                                                                    staging_lists[col]),
+                                         'addresses': first_addresses}
+    return staging_index
+
+def init_shard_worker(staging_index):
+    global _STAGING_INDEX
+    _STAGING_INDEX = staging_index
+
+def match_live_shard(shard_values, matching_columns, min_similarity=MIN_SIMILARITY, chunk_size=CHUNK_SIZE):
+    """Match one block of live rows against the staging index and resolve the best overall match per row.
+
+    As in a serial run, each column joins its normalised exact matches first and only vectorises the
+    remaining unique live values for the chunked TF-IDF engine.
+    """
+    num_rows = len(next(iter(shard_values.values())))
+    score_matrix = np.zeros((num_rows, len(matching_columns)))
+    url_matrix = np.full((num_rows, len(matching_columns)), None, dtype=object)
+
+    for i, col in enumerate(matching_columns):
+        staging = _STAGING_INDEX['columns'][col]
+        live_values = pd.Series(shard_values[col], dtype=object).fillna('')
+        exact_matches, remaining_live_list = split_exact_matches_on_lookup(live_values.tolist(),
+                                                                           staging['exact_lookup'], col)
+        fuzzy_matches = None
+        if remaining_live_list:
+            live_matrix = transform_column(_STAGING_INDEX['count_vectorizer'], staging['idf'], remaining_live_list)
+            top_indices, top_similarities = compute_chunked_top_k_cosine(
+                live_matrix, staging['matrix'], 1, min_similarity, chunk_size)
+            fuzzy_matches = create_top_k_matches_dataframe(remaining_live_list, staging['values'], top_indices,
+                                                           top_similarities)
+        matches = combine_exact_and_fuzzy_matches(exact_matches, fuzzy_matches).set_index('From')
+
+        scores = live_values.map(matches['Similarity']).fillna(0).to_numpy(dtype=float)
+        urls = live_values.map(matches['To']).map(staging['addresses']).to_numpy(dtype=object)
+        score_matrix[:, i] = scores
+        url_matrix[:, i] = np.where(scores > 0, urls, None)
+
+    # A column only wins when it beats a score of 0, ties go to the first column in matching order
+    rows = np.arange(num_rows)
+    best_col_index = score_matrix.argmax(axis=1)
+    has_best_match = score_matrix[rows, best_col_index] > 0
+    return pd.DataFrame({
+        'Best Match on': np.where(has_best_match, np.array(matching_columns, dtype=object)[best_col_index], None),
+        'Highest Matching URL': np.where(has_best_match, url_matrix[rows, best_col_index], None),
+        'Highest Similarity Score': np.where(has_best_match, score_matrix[rows, best_col_index], 0),
+    })
+
+def match_live_rows(executor, df_rows, matching_columns, num_shards):
+    """Split live rows into contiguous shards, match them and merge the results in order."""
+    if executor is None:
+        # Without a pool there is nothing to balance, the rows are matched as one shard
+        num_shards = 1
+    boundaries = np.linspace(0, len(df_rows), min(len(df_rows), num_shards) + 1, dtype=int)
+    shards = [{col: df_rows[col].iloc[start:end].tolist() for col in matching_columns}
+              for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start]
+
+    if executor is None:
+        shard_results = [match_live_shard(shard, matching_columns) for shard in shards]
+    else:
+        futures = [executor.submit(match_live_shard, shard, matching_columns) for shard in shards]
+        shard_results = [future.result() for future in futures]
+    match_results = pd.concat(shard_results, ignore_index=True)
+    match_results.index = df_rows.index
+    return match_results
+
+def match_live_in_shards(df_live, df_staging, matching_columns, workers):
+    print("Building the shared staging index...")
+    live_frequencies = count_column_frequencies({col: df_live[col].fillna('').tolist() for col in matching_columns})
+    staging_index = build_staging_index(df_staging, live_frequencies, matching_columns)
+
+    # Several contiguous shards per worker keep the pool busy when some blocks match faster than others
+    print(f"Matching live rows across {workers} workers...")
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_shard_worker,
+                             initargs=(staging_index,)) as executor:
+        return match_live_rows(executor, df_live, matching_columns, workers * 4)
+
+def match_live_stream(live_path, df_staging, matching_columns, workers, output_path, chunk_rows):
+    """Match a live crawl read in chunks against the staging index, appending each chunk to the output CSV.
+
+    The live crawl is read twice, first to count its n-grams for the IDF weighting and then to match it,
+    so memory stays bounded by the chunk size.
+    """
+    print("Counting the live n-grams...")
+    live_frequencies = None
+    for df_chunk in read_csv_with_encoding(live_path, dtype="str", usecols=matching_columns, chunksize=chunk_rows):
+        live_frequencies = count_column_frequencies({col: df_chunk[col].fillna('').tolist()
+                                                     for col in matching_columns}, live_frequencies)
+
+    print("Building the shared staging index...")
+    staging_index = build_staging_index(df_staging, live_frequencies, matching_columns)
+    live_chunks = read_csv_with_encoding(live_path, dtype="str", usecols=matching_columns, chunksize=chunk_rows)
+
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_shard_worker, initargs=(staging_index,))
+    else:
+        init_shard_worker(staging_index)
+
     final_columns = ['Address'] + [col for col in matching_columns if col != 'Address']
-    df_final = pd.concat([df_live[final_columns], match_results], axis=1)
-except Exception as e:
-    print(f"Error during DataFrame operations: {e}")
-
-# Export the results
-output_path = '/python_scripts/migration_mapper_output.csv'
-print(f"Exporting results to {output_path}...")
-try:
-    df_final.to_csv(output_path, index=False, encoding='utf-8-sig')
-except Exception as e:
-    print(f"Error exporting data: {e}")
-
-print("All operations completed successfully.")
+    rows_written = 0
+    try:
+        for df_chunk in tqdm(live_chunks, desc="Matching live chunks"):
+            df_chunk = df_chunk.apply(lambda col: col.str.lower())
+            match_results = match_live_rows(executor, df_chunk, matching_columns, workers * 4)
+
+            df_final = pd.concat([df_chunk[final_columns], match_results], axis=1)
+            # Only the first chunk writes the header and the byte order mark
+            df_final.to_csv(output_path, index=False, mode='w' if rows_written == 0 else 'a',
+                            header=rows_written == 0, encoding='utf-8-sig' if rows_written == 0 else 'utf-8')
+            rows_written += len(df_final)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return rows_written
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Map live URLs to their closest staging URLs.")
+    parser.add_argument('--live', default=LIVE_PATH, help="Path to the live crawl CSV.")
+    parser.add_argument('--staging', default=STAGING_PATH, help="Path to the staging crawl CSV.")
+    parser.add_argument('--output', default=OUTPUT_PATH, help="Path where the output CSV will be saved.")
+    parser.add_argument('--model', default=MATCHING_MODEL, choices=MATCHING_MODELS,
+                        help="Matching model of a serial run. --workers above 1 and --chunk-rows always use "
+                             "Chunked TF-IDF.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes. Above 1, the live crawl is matched in parallel shards "
+                             "with the Chunked TF-IDF engine.")
+    parser.add_argument('--chunk-rows', type=int, default=None,
+                        help="Stream the live crawl in chunks of this many rows, writing each chunk's matches "
+                             "to the output as it goes. Uses the Chunked TF-IDF engine.")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+
+    matching_columns = MATCHING_COLUMNS
+
+    # The sharded and streamed modes share a staging index, which only the Chunked TF-IDF engine can build
+    if (args.workers > 1 or args.chunk_rows) and args.model != "Chunked TF-IDF":
+        print(f"Warning: --workers and --chunk-rows match with the Chunked TF-IDF engine, not {args.model}. "
+              f"Pass --model \"Chunked TF-IDF\" for a serial run with the same engine.")
+
+    # Check if files exist before loading, only the matching columns are read
+    if file_exists(args.live) and file_exists(args.staging):
+        df_staging = read_csv_with_encoding(args.staging, dtype="str", usecols=matching_columns)
+        if args.chunk_rows:
+            if df_staging.empty:
+                raise ValueError("The staging DataFrame is empty after reading the CSV file.")
+            df_staging = df_staging.apply(lambda col: col.str.lower())
+            rows_written = match_live_stream(args.live, df_staging, matching_columns, args.workers, args.output,
+                                             args.chunk_rows)
+            print(f"Exported {rows_written} rows to {args.output}.")
+            print("All operations completed successfully.")
+            return
+        df_live = read_csv_with_encoding(args.live, dtype="str", usecols=matching_columns)
+    else:
+        raise FileNotFoundError("One or more input files are missing.")
+
+    # Check if DataFrames are empty
+    if df_live.empty or df_staging.empty:
+        raise ValueError("One or more input DataFrames are empty after reading CSV files.")
+
+    # Convert to lowercase for case-insensitive matching
+    print("Preprocessing data...")
+    try:
+        df_live = df_live.apply(lambda col: col.str.lower())
+        df_staging = df_staging.apply(lambda col: col.str.lower())
+    except Exception as e:
+        print(f"Error during preprocessing: {e}")
+
+    if args.workers > 1:
+        match_results = match_live_in_shards(df_live, df_staging, matching_columns, args.workers)
+    else:
+        # Create a PolyFuzz model
+        model = create_model(args.model)
+
+        # Match each column and collect scores
+        print("Matching columns and collecting scores...")
+        matches_scores = match_all_columns(model, df_live, df_staging, matching_columns)
+
+        # Apply the function to find the best overall match
+        print("Applying match function to each row...")
+        try:
+            match_results = df_live.apply(find_best_overall_match, axis=1,
+                                          args=(matches_scores, matching_columns, df_staging))
+        except Exception as e:
+            print(f"Error during matching process: {e}")
+
+    # Concatenate the match results with the original dataframe
+    # Ensure to not include 'Address' from matching_columns in the final DataFrame as it is already present in df_live
+    print("Compiling final results...")
+    try:
+        final_columns = ['Address'] + [col for col in matching_columns if col != 'Address']
+        df_final = pd.concat([df_live[final_columns], match_results], axis=1)
+    except Exception as e:
+        print(f"Error during DataFrame operations: {e}")
+
+    # Export the results
+    print(f"Exporting results to {args.output}...")
+    try:
+        df_final.to_csv(args.output, index=False, encoding='utf-8-sig')
+    except Exception as e:
+        print(f"Error exporting data: {e}")
+
+    print("All operations completed successfully.")
+
+if __name__ == "__main__":
+    main()
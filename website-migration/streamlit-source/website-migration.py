@@ -1,16 +1,54 @@
 import base64
+import codecs
+import hashlib
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
 import chardet
 import numpy as np
 import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
 from polyfuzz import PolyFuzz
-from polyfuzz.models import TFIDF, EditDistance, RapidFuzz
+from polyfuzz.models import BaseMatcher, TFIDF, EditDistance, RapidFuzz
 import plotly.graph_objects as go
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer, TfidfVectorizer
 import xlsxwriter
 
 # Created on 10th December 2023
 
+# On-disk cache of per-column match results, evicted least recently used first once it outgrows the size limit
+MATCH_CACHE_DIR = os.environ.get('MIGRATION_MATCH_CACHE_DIR',
+                                 os.path.join(os.path.expanduser('~'), '.cache', 'website-migration', 'matches'))
+MATCH_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Bump when the matching logic changes so stale cached results are not reused
+MATCH_CACHE_VERSION = 2
+
+# Feature groups of the URL structure matcher: slug tokens, directories and numeric IDs
+URL_STRUCTURE_GROUPS = ['s', 'd', 'i']
+
+# Query parameters dropped before exact matching, they only track campaigns and never identify a page
+TRACKING_QUERY_PARAMS = r'utm_[^=&]*|gclid|fbclid|msclkid|dclid|yclid|mc_cid|mc_eid|_ga|_gl'
+
+# Export settings: Excel sheets hold at most 1,048,576 rows, larger results are also offered as Parquet/CSV.gz
+EXCEL_MAX_DATA_ROWS = 1048575
+LARGE_RESULT_ROWS = 1000000
+COLUMN_WIDTH_SAMPLE_SIZE = 10000
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), 'website-migration-exports')
+
+# Encoding detection only looks at the start of an upload, so multi-GB crawls are never fully scanned
+ENCODING_SAMPLE_SIZE = 1024 * 1024
+BYTE_ORDER_MARKS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
 # Streamlit Interface Setup and Utilities ------------------------------------------------------------------------------
 
 def setup_streamlit_interface():
@@ -111,7 +149,8 @@ def validate_uploaded_files(file1, file2):
     Returns:
     bool: True if validation passes, False otherwise.
     """
-    if not file1 or not file2 or file1.getvalue() == file2.getvalue():
+    # Comparing the buffers directly avoids copying both uploads into new bytes objects
+    if not file1 or not file2 or (file1.size == file2.size and file1.getbuffer() == file2.getbuffer()):
         show_warning_message(
             "Warning: The same file has been uploaded for both live and staging. Please upload different files.")
         return False
@@ -134,7 +173,7 @@ def create_file_uploader_widgets():
 
 
 def handle_data_matching_and_processing(df_live, df_staging, address_column, selected_additional_columns,
-                                        selected_model):
+                                        selected_model, file_hashes=None):
     """
     Handles the process of data matching and processing between live and staging dataframes.
 
@@ -144,6 +183,7 @@ def handle_data_matching_and_processing(df_live, df_staging, address_column, sel
     address_column (str): The name of the address column to use for matching.
     selected_additional_columns (list): Additional columns selected for matching.
     selected_model (str): The name of the matching model to use.
+    file_hashes (tuple, optional): The content hashes of the live and staging files, used to cache match results.
 
     Returns:
     pd.DataFrame: The final processed dataframe after matching.
@@ -155,43 +195,109 @@ def handle_data_matching_and_processing(df_live, df_staging, address_column, sel
     rename_dataframe_column(df_staging, address_column, 'Address')
 
     all_selected_columns = ['Address'] + selected_additional_columns
+    column_sources = {'Address': address_column, **{col: col for col in selected_additional_columns}}
     progress_bar = st.progress(0)
     df_final = process_uploaded_files_and_match_data(df_live, df_staging, all_selected_columns, progress_bar,
                                                      message_placeholder,
-                                                     selected_additional_columns, selected_model)
+                                                     selected_additional_columns, selected_model,
+                                                     file_hashes, column_sources)
     return df_final
 
 
 # File Reading and Data Preparation ------------------------------------------------------------------------------------
 
-def read_excel_file(file, dtype):
+def read_excel_file(file, dtype, usecols=None, nrows=None):
     """
     Reads an Excel file into a Pandas DataFrame.
 
     Args:
     file (UploadedFile): The Excel file to read.
     dtype (str): Data type to use for the DataFrame.
+    usecols (list, optional): The columns to read. Defaults to all columns.
+    nrows (int, optional): The number of rows to read. Defaults to all rows.
 
     Returns:
     pd.DataFrame: DataFrame containing the data from the Excel file.
     """
-    return pd.read_excel_file(file, dtype=dtype)
+    file.seek(0)
+    return pd.read_excel(file, dtype=dtype, usecols=usecols, nrows=nrows)
+
+
+def detect_encoding_from_sample(file, sample_size=ENCODING_SAMPLE_SIZE):
+    """
+    Detects the encoding of a file from a bounded sample at the start of the file.
+
+    A byte order mark is trusted first, otherwise chardet inspects the sample. If the sample does not
+    decode with the detected encoding, UTF-8 and then Latin-1 are used instead.
 
+    Args:
+    file (UploadedFile): The file to inspect.
+    sample_size (int): The maximum number of bytes to sample.
 
-def read_csv_file_with_detected_encoding(file, dtype):
+    Returns:
+    str: The detected encoding.
+    """
+    file.seek(0)
+    sample = file.read(sample_size)
+    file.seek(0)
+
+    for byte_order_mark, encoding in BYTE_ORDER_MARKS:
+        if sample.startswith(byte_order_mark):
+            return encoding
+
+    encoding = chardet.detect(sample)['encoding'] or 'utf-8'
+    # An ASCII-only sample says nothing about the rest of the file, UTF-8 is a safe superset
+    if encoding.lower() == 'ascii':
+        encoding = 'utf-8'
+
+    for candidate in (encoding, 'utf-8'):
+        try:
+            # The sample may end part way through a character, so it is decoded incrementally
+            codecs.getincrementaldecoder(candidate)().decode(sample, final=False)
+            return candidate
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return 'latin-1'
+
+
+def read_csv_file_with_detected_encoding(file, dtype, usecols=None, nrows=None, chunksize=None):
     """
     Reads a CSV file with automatically detected encoding into a Pandas DataFrame.
 
+    The encoding is detected from a sample of the file, undecodable bytes further into the file are
+    replaced rather than failing the whole read.
+
     Args:
     file (UploadedFile): The CSV file to read.
     dtype (str): Data type to use for the DataFrame.
+    usecols (list, optional): The columns to read. Defaults to all columns.
+    nrows (int, optional): The number of rows to read. Defaults to all rows.
+    chunksize (int, optional): When set, an iterator of DataFrames with this many rows is returned.
 
     Returns:
-    pd.DataFrame: DataFrame containing the data from the CSV file.
+    pd.DataFrame: DataFrame containing the data from the CSV file, or an iterator of DataFrames.
     """
-    result = chardet.detect(file.getvalue())
-    encoding = result['encoding']
-    return pd.read_csv(file, dtype=dtype, encoding=encoding, on_bad_lines='skip')
+    encoding = detect_encoding_from_sample(file)
+    return pd.read_csv(file, dtype=dtype, encoding=encoding, encoding_errors='replace', on_bad_lines='skip',
+                       usecols=usecols, nrows=nrows, chunksize=chunksize)
+
+
+def read_uploaded_file(file, dtype, usecols=None, nrows=None):
+    """
+    Reads an uploaded CSV or Excel file into a Pandas DataFrame.
+
+    Args:
+    file (UploadedFile): The file to read.
+    dtype (str): Data type to use for the DataFrame.
+    usecols (list, optional): The columns to read. Defaults to all columns.
+    nrows (int, optional): The number of rows to read. Defaults to all rows.
+
+    Returns:
+    pd.DataFrame: DataFrame containing the data from the file.
+    """
+    if file.name.endswith('.csv'):
+        return read_csv_file_with_detected_encoding(file, dtype, usecols=usecols, nrows=nrows)
+    return read_excel_file(file, dtype, usecols=usecols, nrows=nrows)
 
 
 def convert_dataframe_to_lowercase(df):
@@ -222,28 +328,37 @@ def rename_dataframe_column(df, old_name, new_name):
     df.rename(columns={old_name: new_name}, inplace=True)
 
 
-def process_and_validate_uploaded_files(file_live, file_staging):
+def read_uploaded_file_headers(file_live, file_staging):
+    """
+    Validates the uploaded live and staging files and reads only their header rows.
+
+    Args:
+    file_live (UploadedFile): The live file uploaded by the user.
+    file_staging (UploadedFile): The staging file uploaded by the user.
+
+    Returns:
+    tuple: A tuple containing an empty DataFrame with the live columns and one with the staging columns.
+    """
+    if validate_uploaded_files(file_live, file_staging):
+        return read_uploaded_file(file_live, "str", nrows=0), read_uploaded_file(file_staging, "str", nrows=0)
+    return None, None
+
+
+def process_and_validate_uploaded_files(file_live, file_staging, usecols=None):
     """
     Processes and validates the uploaded live and staging files.
 
     Args:
     file_live (UploadedFile): The live file uploaded by the user.
     file_staging (UploadedFile): The staging file uploaded by the user.
+    usecols (list, optional): The columns to read from both files. Defaults to all columns.
 
     Returns:
     tuple: A tuple containing the DataFrame for the live file and the DataFrame for the staging file.
     """
     if validate_uploaded_files(file_live, file_staging):
-        # Determine file type and read accordingly
-        if file_live.name.endswith('.csv'):
-            df_live = read_csv_file_with_detected_encoding(file_live, "str")
-        else:  # Excel file
-            df_live = read_excel_file(file_live, "str")
-
-        if file_staging.name.endswith('.csv'):
-            df_staging = read_csv_file_with_detected_encoding(file_staging, "str")
-        else:  # Excel file
-            df_staging = read_excel_file(file_staging, "str")
+        df_live = read_uploaded_file(file_live, "str", usecols=usecols)
+        df_staging = read_uploaded_file(file_staging, "str", usecols=usecols)
 
         # Check if dataframes are empty
         if df_live.empty or df_staging.empty:
@@ -254,6 +369,554 @@ def process_and_validate_uploaded_files(file_live, file_staging):
     return None, None
 
 
+# Matching Models ------------------------------------------------------------------------------------------------------
+
+def compute_chunked_top_k_cosine(from_matrix, to_matrix, top_k=1, min_similarity=0.75, chunk_size=1000,
+                                 exclude_self=False):
+    """
+    Computes the top-k cosine similarities between two L2-normalised sparse matrices, one row chunk at a time.
+
+    Only a (chunk_size x staging rows) block of the similarity matrix is held in memory at once, and only the
+    top-k entries at or above min_similarity are kept from each block.
+
+    Args:
+    from_matrix (scipy.sparse.csr_matrix): The L2-normalised vectors to match from.
+    to_matrix (scipy.sparse.csr_matrix): The L2-normalised vectors to match to.
+    top_k (int): The number of matches to keep per row.
+    min_similarity (float): The minimum similarity for a match to be kept.
+    chunk_size (int): The number of 'from' rows to multiply at once.
+    exclude_self (bool): Whether to ignore the diagonal, used when matching a list against itself.
+
+    Returns:
+    tuple: A (rows x top_k) array of 'to' indices (-1 where there is no match) and an array of their similarities.
+    """
+    num_rows = from_matrix.shape[0]
+    top_indices = np.full((num_rows, top_k), -1, dtype=np.int64)
+    top_similarities = np.zeros((num_rows, top_k), dtype=np.float32)
+    to_matrix_t = to_matrix.T.tocsr()
+
+    for start in range(0, num_rows, chunk_size):
+        end = min(start + chunk_size, num_rows)
+        chunk = (from_matrix[start:end] @ to_matrix_t).tocsr()
+        row_ids = np.repeat(np.arange(end - start), np.diff(chunk.indptr))
+        # Similarities under 0.001 round to 0 and are treated as no match, as PolyFuzz does
+        chunk.data[chunk.data < max(min_similarity, 0.001)] = 0
+        if exclude_self:
+            chunk.data[chunk.indices == row_ids + start] = 0
+        chunk.eliminate_zeros()
+
+        kept_rows, kept_ranks, kept_indices, kept_similarities = select_top_k_per_row(chunk, top_k)
+        top_indices[start + kept_rows, kept_ranks] = kept_indices
+        top_similarities[start + kept_rows, kept_ranks] = kept_similarities
+
+    return top_indices, top_similarities
+
+
+def select_top_k_per_row(chunk, top_k):
+    """
+    Selects the k highest non-zero entries of each row of a sparse similarity block.
+
+    Args:
+    chunk (scipy.sparse.csr_matrix): A block of similarities, zero where there is no match.
+    top_k (int): The number of entries to keep per row.
+
+    Returns:
+    tuple: The row, rank, column index and similarity of every kept entry.
+    """
+    # Sort the non-zero entries by row, then by descending similarity, and keep the first k of each row
+    row_ids = np.repeat(np.arange(chunk.shape[0]), np.diff(chunk.indptr))
+    order = np.lexsort((-chunk.data, row_ids))
+    rank = np.arange(order.size) - chunk.indptr[row_ids[order]]
+    keep = order[rank < top_k]
+    return row_ids[keep], rank[rank < top_k], chunk.indices[keep], chunk.data[keep]
+
+
+def create_top_k_matches_dataframe(from_list, to_list, top_indices, top_similarities):
+    """
+    Converts top-k match indices and similarities into a PolyFuzz style matches DataFrame.
+
+    Args:
+    from_list (list): The strings matched from.
+    to_list (list): The strings matched to.
+    top_indices (np.ndarray): A (rows x top_k) array of 'to' indices, -1 where there is no match.
+    top_similarities (np.ndarray): A (rows x top_k) array of similarities.
+
+    Returns:
+    pd.DataFrame: Matches with 'From', 'To' and 'Similarity' columns, plus 'To_n'/'Similarity_n' when top_k > 1.
+    """
+    to_array = np.array(list(to_list) + [None], dtype=object)
+    matches = pd.DataFrame({'From': from_list})
+    for rank in range(top_indices.shape[1]):
+        suffix = '' if rank == 0 else f'_{rank + 1}'
+        matches[f'To{suffix}'] = to_array[top_indices[:, rank]]
+        matches[f'Similarity{suffix}'] = np.round(top_similarities[:, rank].astype(float), 3)
+    return matches
+
+
+class ChunkedTFIDF(BaseMatcher):
+    """
+    A character n-gram TF-IDF matcher that keeps only the top-k matches per row.
+
+    The vectorizer is fitted once over both lists, and the cosine similarities are computed by multiplying
+    the sparse matrices in row chunks, so memory is bounded by the chunk size rather than by the size of
+    the full live x staging similarity matrix.
+
+    Args:
+    n_gram_range (tuple): The character n-gram range used by the vectorizer.
+    min_similarity (float): The minimum similarity for a match, lower scoring rows get a similarity of 0.
+    top_k (int): The number of matches to return per row.
+    chunk_size (int): The number of rows multiplied at once.
+    model_id (str): The name of the model, used by PolyFuzz.
+    """
+
+    def __init__(self, n_gram_range=(3, 3), min_similarity=0.75, top_k=1, chunk_size=1000,
+                 model_id="Chunked TF-IDF"):
+        super().__init__(model_id)
+        self.type = "Chunked TF-IDF"
+        self.n_gram_range = n_gram_range
+        self.min_similarity = min_similarity
+        self.top_k = top_k
+        self.chunk_size = chunk_size
+
+    def create_vectorizer(self):
+        """
+        Creates the character n-gram TF-IDF vectorizer used by the matcher.
+
+        Returns:
+        TfidfVectorizer: An unfitted vectorizer producing L2-normalised float32 vectors.
+        """
+        return TfidfVectorizer(analyzer='char', ngram_range=self.n_gram_range, lowercase=True, dtype=np.float32)
+
+    def match(self, from_list, to_list=None, **kwargs):
+        """
+        Matches each string in from_list to its top-k most similar strings in to_list.
+
+        Args:
+        from_list (list): The strings to match from.
+        to_list (list, optional): The strings to match to. Defaults to matching from_list against itself.
+
+        Returns:
+        pd.DataFrame: Matches with 'From', 'To' and 'Similarity' columns.
+        """
+        exclude_self = to_list is None
+        to_list = from_list if to_list is None else to_list
+        vectorizer = self.create_vectorizer().fit(list(to_list) + list(from_list))
+        top_indices, top_similarities = compute_chunked_top_k_cosine(
+            vectorizer.transform(from_list), vectorizer.transform(to_list), self.top_k, self.min_similarity,
+            self.chunk_size, exclude_self)
+        return create_top_k_matches_dataframe(from_list, to_list, top_indices, top_similarities)
+
+    def match_columns(self, column_lists, max_workers=None):
+        """
+        Matches several columns at once, tokenising every column in a single pass.
+
+        The character n-grams of all columns are counted by one vectorizer, each column then gets its own
+        IDF weighting so the scores equal a separate match() per column. The per-column matches run in
+        parallel worker processes.
+
+        Args:
+        column_lists (dict): A dictionary mapping each column name to a (live_list, staging_list) tuple.
+        max_workers (int, optional): The number of worker processes. Defaults to one per column, capped by the CPU count.
+
+        Returns:
+        dict: A dictionary mapping each column name to its matches DataFrame.
+        """
+        all_strings = []
+        column_offsets = {}
+        for col, (live_list, staging_list) in column_lists.items():
+            column_offsets[col] = (len(all_strings), len(staging_list), len(live_list))
+            all_strings.extend(staging_list)
+            all_strings.extend(live_list)
+
+        counts = CountVectorizer(analyzer='char', ngram_range=self.n_gram_range, lowercase=True,
+                                 dtype=np.float32).fit_transform(all_strings).tocsr()
+
+        match_arguments = []
+        for col, (offset, num_staging, num_live) in column_offsets.items():
+            column_counts = counts[offset:offset + num_staging + num_live]
+            tf_idf = TfidfTransformer().fit_transform(column_counts).astype(np.float32).tocsr()
+            match_arguments.append((tf_idf[num_staging:], tf_idf[:num_staging]))
+
+        if max_workers is None:
+            max_workers = min(len(match_arguments), os.cpu_count() or 1)
+
+        if max_workers > 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(compute_chunked_top_k_cosine, from_matrix, to_matrix, self.top_k,
+                                           self.min_similarity, self.chunk_size)
+                           for from_matrix, to_matrix in match_arguments]
+                results = [future.result() for future in futures]
+        else:
+            results = [compute_chunked_top_k_cosine(from_matrix, to_matrix, self.top_k, self.min_similarity,
+                                                    self.chunk_size)
+                       for from_matrix, to_matrix in match_arguments]
+
+        return {col: create_top_k_matches_dataframe(live_list, staging_list, top_indices, top_similarities)
+                for (col, (live_list, staging_list)), (top_indices, top_similarities)
+                in zip(column_lists.items(), results)}
+
+
+def parse_url_structure(url):
+    """
+    Parses a URL into its host, directory segments, slug tokens and numeric IDs.
+
+    Values that are not URLs, such as H1s or titles, are parsed as a slug without directories.
+
+    Args:
+    url (str): The URL to parse.
+
+    Returns:
+    dict: The 'host', 'directories', 'slug_tokens' and 'ids' of the URL.
+    """
+    url = str(url).strip().lower()
+    if '://' in url or url.startswith('//'):
+        parts = urlsplit(url)
+        host, path = parts.hostname or '', parts.path
+    else:
+        host, path = '', url.split('?', 1)[0].split('#', 1)[0]
+
+    segments = [segment for segment in path.split('/') if segment]
+    slug = re.sub(r'\.(?:html?|php|aspx?|jsp)$', '', segments[-1]) if segments else ''
+    directories = segments[:-1]
+    slug_tokens = [token for token in re.split(r'[^a-z0-9]+', slug) if token]
+
+    return {
+        'host': host,
+        'directories': [directory for directory in directories if not directory.isdigit()],
+        'slug_tokens': [token for token in slug_tokens if not token.isdigit()],
+        'ids': [token for token in directories + slug_tokens if token.isdigit()],
+    }
+
+
+def extract_url_structure_tokens(url):
+    """
+    Converts a URL into prefixed tokens, one prefix per feature group of URL_STRUCTURE_GROUPS.
+
+    The host is left out, live and staging URLs are usually served from different hosts.
+
+    Args:
+    url (str): The URL to tokenise.
+
+    Returns:
+    list: The tokens of the URL.
+    """
+    structure = parse_url_structure(url)
+    return ([f's:{token}' for token in structure['slug_tokens']] +
+            [f'd:{directory}' for directory in structure['directories']] +
+            [f'i:{url_id}' for url_id in structure['ids']])
+
+
+def compute_url_structure_top_k(from_tokens, to_tokens, group_matrix, weights, top_k=1, min_similarity=0,
+                                chunk_size=1000, max_token_postings=1000, exclude_self=False):
+    """
+    Scores URL pairs by the weighted Jaccard similarity of their slug tokens, directories and IDs.
+
+    Candidate pairs come from an inverted index of the staging URLs by token, so only URLs sharing a token
+    are ever scored. Tokens held by more than max_token_postings staging URLs, such as a shared '/products/'
+    directory, are still scored but do not generate candidates.
+
+    Args:
+    from_tokens (scipy.sparse.csr_matrix): The binary token matrix of the URLs to match from.
+    to_tokens (scipy.sparse.csr_matrix): The binary token matrix of the URLs to match to.
+    group_matrix (scipy.sparse.csr_matrix): A (tokens x groups) matrix assigning each token to its group.
+    weights (np.ndarray): The weight of each group.
+    top_k (int): The number of matches to keep per row.
+    min_similarity (float): The minimum similarity for a match to be kept.
+    chunk_size (int): The number of 'from' rows scored at once.
+    max_token_postings (int): The most staging URLs a token may hold and still generate candidates.
+    exclude_self (bool): Whether to ignore the diagonal, used when matching a list against itself.
+
+    Returns:
+    tuple: A (rows x top_k) array of 'to' indices (-1 where there is no match) and an array of their similarities.
+    """
+    num_rows = from_tokens.shape[0]
+    top_indices = np.full((num_rows, top_k), -1, dtype=np.int64)
+    top_similarities = np.zeros((num_rows, top_k), dtype=np.float32)
+
+    from_sizes = (from_tokens @ group_matrix).toarray()
+    to_sizes = (to_tokens @ group_matrix).toarray()
+
+    # Inverted index: row t lists the staging URLs holding candidate token t
+    postings = np.diff(to_tokens.tocsc().indptr)
+    candidate_tokens = np.flatnonzero((postings > 0) & (postings <= max_token_postings))
+    inverted_index = to_tokens[:, candidate_tokens].T.tocsr()
+    from_candidate_tokens = from_tokens[:, candidate_tokens].tocsr()
+
+    for start in range(0, num_rows, chunk_size):
+        end = min(start + chunk_size, num_rows)
+        candidates = (from_candidate_tokens[start:end] @ inverted_index).tocoo()
+        rows, cols = candidates.row, candidates.col
+        if exclude_self:
+            rows, cols = rows[rows + start != cols], cols[rows + start != cols]
+        if rows.size == 0:
+            continue
+
+        # Jaccard similarity per group, groups that neither URL has do not count towards the score
+        overlap = (from_tokens[start + rows].multiply(to_tokens[cols]) @ group_matrix).toarray()
+        union = from_sizes[start + rows] + to_sizes[cols] - overlap
+        has_group = union > 0
+        jaccard = np.divide(overlap, union, out=np.zeros_like(overlap), where=has_group)
+        total_weight = has_group @ weights
+        scores = np.divide(jaccard @ weights, total_weight, out=np.zeros_like(total_weight), where=total_weight > 0)
+        scores[scores < max(min_similarity, 0.001)] = 0
+
+        chunk = csr_matrix((scores.astype(np.float32), (rows, cols)), shape=(end - start, to_tokens.shape[0]))
+        chunk.eliminate_zeros()
+        kept_rows, kept_ranks, kept_indices, kept_similarities = select_top_k_per_row(chunk, top_k)
+        top_indices[start + kept_rows, kept_ranks] = kept_indices
+        top_similarities[start + kept_rows, kept_ranks] = kept_similarities
+
+    return top_indices, top_similarities
+
+
+class URLStructureMatcher(BaseMatcher):
+    """
+    A URL matcher comparing slug tokens, directories and numeric IDs instead of the raw Address string.
+
+    Scheme, host and query string are ignored, so they do not dominate the similarity the way they do for
+    character based models. Staging URLs are indexed by token so large sites are not scored pairwise.
+
+    Args:
+    weights (tuple): The weights of the slug token, directory and ID similarities.
+    min_similarity (float): The minimum similarity for a match, lower scoring rows get a similarity of 0.
+    top_k (int): The number of matches to return per row.
+    chunk_size (int): The number of rows scored at once.
+    max_token_postings (int): The most staging URLs a token may hold and still generate candidates.
+    model_id (str): The name of the model, used by PolyFuzz.
+    """
+
+    def __init__(self, weights=(0.6, 0.25, 0.15), min_similarity=0, top_k=1, chunk_size=1000,
+                 max_token_postings=1000, model_id="URL Structure"):
+        super().__init__(model_id)
+        self.type = "URL Structure"
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.min_similarity = min_similarity
+        self.top_k = top_k
+        self.chunk_size = chunk_size
+        self.max_token_postings = max_token_postings
+
+    def match(self, from_list, to_list=None, **kwargs):
+        """
+        Matches each URL in from_list to its top-k most similar URLs in to_list.
+
+        Args:
+        from_list (list): The URLs to match from.
+        to_list (list, optional): The URLs to match to. Defaults to matching from_list against itself.
+
+        Returns:
+        pd.DataFrame: Matches with 'From', 'To' and 'Similarity' columns.
+        """
+        exclude_self = to_list is None
+        to_list = from_list if to_list is None else to_list
+        vectorizer = CountVectorizer(analyzer=extract_url_structure_tokens, binary=True, dtype=np.float64)
+        try:
+            # Each URL is parsed once, staging rows first
+            tokens = vectorizer.fit_transform(list(to_list) + list(from_list)).tocsr()
+        except ValueError:
+            # None of the values hold a token, so nothing can match
+            top_indices = np.full((len(from_list), self.top_k), -1, dtype=np.int64)
+            return create_top_k_matches_dataframe(from_list, to_list, top_indices,
+                                                  np.zeros((len(from_list), self.top_k), dtype=np.float32))
+
+        token_groups = [URL_STRUCTURE_GROUPS.index(token[0]) for token in vectorizer.get_feature_names_out()]
+        group_matrix = csr_matrix((np.ones(len(token_groups)), (np.arange(len(token_groups)), token_groups)),
+                                  shape=(len(token_groups), len(URL_STRUCTURE_GROUPS)))
+        top_indices, top_similarities = compute_url_structure_top_k(
+            tokens[len(to_list):], tokens[:len(to_list)], group_matrix,
+            self.weights, self.top_k, self.min_similarity, self.chunk_size, self.max_token_postings, exclude_self)
+        return create_top_k_matches_dataframe(from_list, to_list, top_indices, top_similarities)
+
+
+# Match Result Cache ---------------------------------------------------------------------------------------------------
+
+def compute_file_content_hash(file):
+    """
+    Computes a SHA-256 hash of an uploaded file's content.
+
+    Args:
+    file (UploadedFile): The uploaded file to hash.
+
+    Returns:
+    str: The hex digest of the file content.
+    """
+    return hashlib.sha256(file.getbuffer()).hexdigest()
+
+
+def build_match_cache_keys(live_hash, staging_hash, column_sources, selected_model, min_similarity):
+    """
+    Builds the cache key of each matching column.
+
+    Args:
+    live_hash (str): The content hash of the live file.
+    staging_hash (str): The content hash of the staging file.
+    column_sources (dict): A dictionary mapping each matching column to its column name in the uploaded files.
+    selected_model (str): The name of the matching model.
+    min_similarity (float): The minimum similarity used by the model, or None if it has none.
+
+    Returns:
+    dict: A dictionary mapping each matching column to its cache key.
+    """
+    return {
+        col: hashlib.sha256(
+            f"{MATCH_CACHE_VERSION}|{live_hash}|{staging_hash}|{source}|{selected_model}|{min_similarity}".encode()
+        ).hexdigest()
+        for col, source in column_sources.items()
+    }
+
+
+def get_match_cache_path(cache_key):
+    """
+    Returns the Parquet file path for a cache key.
+
+    Args:
+    cache_key (str): The cache key of a column's match results.
+
+    Returns:
+    str: The path of the cached Parquet file.
+    """
+    return os.path.join(MATCH_CACHE_DIR, f"{cache_key}.parquet")
+
+
+def load_cached_matches(cache_key):
+    """
+    Loads a column's match results from the cache and marks them as recently used.
+
+    Args:
+    cache_key (str): The cache key of a column's match results.
+
+    Returns:
+    pd.DataFrame: The cached match results, or None if they are not cached.
+    """
+    cache_path = get_match_cache_path(cache_key)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        matches = pd.read_parquet(cache_path)
+    except (OSError, ValueError):
+        return None
+    os.utime(cache_path)
+    return matches.astype({col: object for col in matches.columns if col == 'To' or col.startswith('To_')})
+
+
+def evict_match_cache(max_bytes=MATCH_CACHE_MAX_BYTES):
+    """
+    Removes the least recently used cached match results until the cache fits within max_bytes.
+
+    Args:
+    max_bytes (int): The maximum total size of the cache in bytes.
+    """
+    cache_files = []
+    for entry in os.scandir(MATCH_CACHE_DIR):
+        if entry.is_file() and entry.name.endswith('.parquet'):
+            stat = entry.stat()
+            cache_files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_bytes = sum(size for _, size, _ in cache_files)
+    for _, size, path in sorted(cache_files):
+        if total_bytes <= max_bytes:
+            break
+        os.remove(path)
+        total_bytes -= size
+
+
+def store_cached_matches(cache_key, matches):
+    """
+    Stores a column's match results in the cache as Parquet, then enforces the cache size limit.
+
+    Args:
+    cache_key (str): The cache key of the column's match results.
+    matches (pd.DataFrame): The match results to store.
+    """
+    os.makedirs(MATCH_CACHE_DIR, exist_ok=True)
+    cache_path = get_match_cache_path(cache_key)
+    # Write to a temporary file first so an interrupted write never leaves a truncated cache entry
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    matches.to_parquet(temp_path, index=False)
+    os.replace(temp_path, cache_path)
+    evict_match_cache()
+
+
+# Exact Matching ------------------------------------------------------------------------------------------------------
+
+def normalise_values_for_exact_match(values, col):
+    """
+    Normalises column values so that values only differing by formatting can be joined exactly.
+
+    Addresses lose their scheme, domain, fragment, tracking parameters and trailing slash. Other columns
+    have their whitespace collapsed. All values are lowercased.
+
+    Args:
+    values (list): The column values to normalise.
+    col (str): The name of the column the values belong to.
+
+    Returns:
+    pd.Series: The normalised values, in the order of the input.
+    """
+    stripped = pd.Series(values, dtype=object).fillna('').astype(str).str.strip().str.lower()
+    normalised = stripped
+    if col == 'Address':
+        normalised = normalised.str.replace(r'^(?:[a-z][a-z0-9+.-]*:)?//[^/?#]*', '', regex=True)
+        normalised = normalised.str.replace(r'#.*$', '', regex=True)
+        normalised = normalised.str.replace(rf'(?<=[?&])(?:{TRACKING_QUERY_PARAMS})(?:=[^&]*)?(?:&|$)', '',
+                                            regex=True)
+        normalised = normalised.str.replace(r'[?&]+$', '', regex=True)
+        normalised = normalised.str.replace(r'/+(?=\?|$)', '', regex=True)
+        # The home page is left empty by the steps above
+        normalised = normalised.mask(normalised.eq('') & stripped.ne(''), '/')
+    else:
+        normalised = normalised.str.replace(r'\s+', ' ', regex=True)
+    return normalised
+
+
+def split_exact_matches(live_list, staging_list, col):
+    """
+    Joins live values to staging values on their normalised form and returns the live values left unmatched.
+
+    Args:
+    live_list (list): The live values of the column.
+    staging_list (list): The staging values of the column.
+    col (str): The name of the column.
+
+    Returns:
+    tuple: A DataFrame with 'From', 'To' and 'Similarity' columns for the exact matches, and the list of
+    unique live values that still need fuzzy matching.
+    """
+    live_values = pd.Series(pd.unique(pd.Series(live_list, dtype=object)), dtype=object)
+    live_keys = normalise_values_for_exact_match(live_values.tolist(), col)
+    staging_keys = normalise_values_for_exact_match(staging_list, col)
+
+    # The first staging value with a given normalised form is the one a fuzzy match would report first
+    staging_lookup = pd.Series(staging_list, index=staging_keys.values, dtype=object)
+    staging_lookup = staging_lookup[~staging_lookup.index.duplicated(keep='first') & (staging_lookup.index != '')]
+    matched_to = live_keys.map(staging_lookup)
+    is_exact = matched_to.notna() & live_keys.ne('')
+
+    exact_matches = pd.DataFrame({
+        'From': live_values[is_exact].values,
+        'To': matched_to[is_exact].values,
+        'Similarity': 1.0
+    })
+    return exact_matches, live_values[~is_exact].tolist()
+
+
+def combine_exact_and_fuzzy_matches(exact_matches, fuzzy_matches):
+    """
+    Combines the exact matches of a column with the fuzzy matches of its remaining live values.
+
+    Args:
+    exact_matches (pd.DataFrame): The exact matches of the column.
+    fuzzy_matches (pd.DataFrame or None): The fuzzy matches, None when every live value matched exactly.
+
+    Returns:
+    pd.DataFrame: The match results of the column.
+    """
+    if fuzzy_matches is None or fuzzy_matches.empty:
+        return exact_matches
+    if exact_matches.empty:
+        return fuzzy_matches
+    return pd.concat([exact_matches, fuzzy_matches], ignore_index=True)
+
+
 # Data Matching and Analysis -------------------------------------------------------------------------------------------
 
 def initialise_matching_model(selected_model="TF-IDF"):
@@ -272,6 +935,10 @@ def initialise_matching_model(selected_model="TF-IDF"):
     elif selected_model == "RapidFuzz":
         from polyfuzz.models import RapidFuzz
         model = RapidFuzz()
+    elif selected_model == "Chunked TF-IDF":
+        model = ChunkedTFIDF(min_similarity=0)
+    elif selected_model == "URL Structure":
+        model = URLStructureMatcher()
     else:  # Default to TF-IDF
         from polyfuzz.models import TFIDF
         model = TFIDF(min_similarity=0)
@@ -292,6 +959,10 @@ def setup_matching_model(selected_model):
         model = PolyFuzz(EditDistance())
     elif selected_model == "RapidFuzz":
         model = PolyFuzz(RapidFuzz())
+    elif selected_model == "Chunked TF-IDF":
+        model = PolyFuzz(ChunkedTFIDF())
+    elif selected_model == "URL Structure":
+        model = PolyFuzz(URLStructureMatcher())
     else:  # Default to TF-IDF
         model = PolyFuzz(TFIDF())
     return model
@@ -301,6 +972,10 @@ def match_columns_and_compute_scores(model, df_live, df_staging, matching_column
     """
     Matches columns between two DataFrames (df_live and df_staging) and computes similarity scores.
 
+    Live values that match a staging value exactly once normalised are joined first, only the rest are
+    passed to the model. When the model is a ChunkedTFIDF, all columns are vectorised in one pass and
+    matched in parallel worker processes.
+
     Args:
         model: The matching model to use for matching (e.g., PolyFuzz).
         df_live (pd.DataFrame): The DataFrame containing live data.
@@ -310,7 +985,7 @@ def match_columns_and_compute_scores(model, df_live, df_staging, matching_column
     Returns:
         dict: A dictionary containing match scores for each column.
     """
-    matches_scores = {}
+    column_lists = {}
     for col in matching_columns:
         # Check if the column exists in both dataframes
         if col in df_live.columns and col in df_staging.columns:
@@ -318,75 +993,84 @@ def match_columns_and_compute_scores(model, df_live, df_staging, matching_column
             if isinstance(df_live[col], pd.Series) and isinstance(df_staging[col], pd.Series):
                 live_list = df_live[col].fillna('').tolist()
                 staging_list = df_staging[col].fillna('').tolist()
-
-                # Here's the matching logic:
-                model.match(live_list, staging_list)
-                matches = model.get_matches()
-                matches_scores[col] = matches
+                column_lists[col] = (live_list, staging_list)
 
             else:
                 st.warning(f"The column '{col}' in either the live or staging data is not a valid series.")
         else:
             st.warning(f"The column '{col}' does not exist in both the live and staging data.")
 
+    # Values that match exactly once normalised skip the fuzzy model
+    exact_matches = {}
+    fuzzy_column_lists = {}
+    for col, (live_list, staging_list) in column_lists.items():
+        exact_matches[col], remaining_live_list = split_exact_matches(live_list, staging_list, col)
+        if remaining_live_list and staging_list:
+            fuzzy_column_lists[col] = (remaining_live_list, staging_list)
+
+    if isinstance(model.method, ChunkedTFIDF):
+        fuzzy_matches = model.method.match_columns(fuzzy_column_lists) if fuzzy_column_lists else {}
+    else:
+        fuzzy_matches = {}
+        for col, (live_list, staging_list) in fuzzy_column_lists.items():
+            # Here's the matching logic:
+            model.match(live_list, staging_list)
+            fuzzy_matches[col] = model.get_matches()
+
+    matches_scores = {}
+    for col in column_lists:
+        matches_scores[col] = combine_exact_and_fuzzy_matches(exact_matches[col], fuzzy_matches.get(col))
+
     return matches_scores
 
 
-def identify_best_matching_url(row, matches_scores, matching_columns, df_staging):
+def build_match_lookup_tables(matches):
     """
-    Identifies the best matching URL for a given row in the DataFrame.
+    Builds hash-indexed lookup tables from the match results of a single column.
 
     Args:
-    row (pd.Series): A row from the DataFrame.
-    matches_scores (dict): Dictionary containing match scores for columns.
-    matching_columns (list): List of column names used for matching.
-    df_staging (pd.DataFrame): The DataFrame containing staging data.
+    matches (pd.DataFrame): The 'From', 'To' and 'Similarity' match results for a column.
 
     Returns:
-    tuple: A tuple containing best match information and similarity scores.
+    tuple: Two Series indexed by the 'From' value, holding the matched 'To' value and its similarity score.
     """
-    best_match_info = {'Best Match on': None, 'Highest Matching URL': None,
-                       'Highest Similarity Score': 0, 'Best Match Content': None}
-    similarities = []
+    # Only the first match for each 'From' value is ever used, mirroring a row-by-row .loc lookup
+    unique_matches = matches.drop_duplicates(subset='From', keep='first').set_index('From')
+    return unique_matches['To'], unique_matches['Similarity'].astype(float)
 
-    for col in matching_columns:
-        matches = matches_scores.get(col, pd.DataFrame())
-        if not matches.empty:
-            match_row = matches.loc[matches['From'] == row[col]]
-            if not match_row.empty:
-                similarity_score = match_row.iloc[0]['Similarity']
-                similarities.append(similarity_score)
-                if similarity_score > best_match_info['Highest Similarity Score']:
-                    best_match_info.update({
-                        'Best Match on': col,
-                        'Highest Matching URL':
-                            df_staging.loc[df_staging[col] == match_row.iloc[0]['To'], 'Address'].values[0],
-                        'Highest Similarity Score': similarity_score,
-                        'Best Match Content': match_row.iloc[0]['To']
-                    })
 
-    best_match_info['Median Match Score'] = np.median(similarities) if similarities else None
-    return best_match_info, similarities
+def build_staging_address_lookup(df_staging, col):
+    """
+    Builds a lookup table from a staging column value to the first staging Address holding that value.
+
+    Args:
+    df_staging (pd.DataFrame): The DataFrame containing staging data.
+    col (str): The staging column to index.
+
+    Returns:
+    pd.Series: A Series of staging Addresses indexed by the values of the given column.
+    """
+    staging_values = df_staging[[col, 'Address']] if col != 'Address' else df_staging[['Address']]
+    staging_values = staging_values.dropna(subset=[col]).drop_duplicates(subset=col, keep='first')
+    return pd.Series(staging_values['Address'].values, index=staging_values[col].values)
 
 
-def add_additional_info_to_match_results(best_match_info, df_staging, selected_additional_columns):
+def format_all_column_match_scores(score_matrix, matching_columns):
     """
-    Adds additional information to the best match results.
+    Formats the per-column similarity scores of every row as a list of (column, percentage) tuples.
 
     Args:
-    best_match_info (dict): Dictionary containing information about the best match.
-    df_staging (pd.DataFrame): The DataFrame containing staging data.
-    selected_additional_columns (list): List of additional columns selected for matching.
+    score_matrix (np.ndarray): A (rows x columns) matrix of similarity scores, NaN where no match was found.
+    matching_columns (list): List of column names used for matching.
 
     Returns:
-    dict: Updated best match information with additional details.
+    list: A list holding the formatted column scores for each row.
     """
-    for additional_col in selected_additional_columns:
-        if additional_col in df_staging.columns:
-            staging_value = df_staging.loc[
-                df_staging['Address'] == best_match_info['Highest Matching URL'], additional_col].values
-            best_match_info[f'Staging {additional_col}'] = staging_value[0] if staging_value.size > 0 else None
-    return best_match_info
+    formatted_scores = []
+    for row_scores in score_matrix:
+        similarities = row_scores[~np.isnan(row_scores)]
+        formatted_scores.append([(col, f"{round(score * 100)}%") for col, score in zip(matching_columns, similarities)])
+    return formatted_scores
 
 
 def identify_best_matching_url_and_median(df_live, df_staging, matches_scores, matching_columns,
@@ -394,6 +1078,10 @@ def identify_best_matching_url_and_median(df_live, df_staging, matches_scores, m
     """
     Identifies the best matching URLs and computes median match scores for the entire DataFrame.
 
+    The match results and the staging data are indexed once per column, so each live row is resolved with
+    hash lookups rather than scans. The best column, highest score and median are then taken across a
+    (rows x columns) score matrix.
+
     Args:
     df_live (pd.DataFrame): The DataFrame containing live data.
     df_staging (pd.DataFrame): The DataFrame containing staging data.
@@ -404,18 +1092,46 @@ def identify_best_matching_url_and_median(df_live, df_staging, matches_scores, m
     Returns:
     pd.DataFrame: DataFrame with best match URLs and median scores.
     """
+    num_rows = len(df_live)
+    num_cols = len(matching_columns)
+    score_matrix = np.full((num_rows, num_cols), np.nan)
+    content_matrix = np.full((num_rows, num_cols), None, dtype=object)
+    url_matrix = np.full((num_rows, num_cols), None, dtype=object)
 
-    def process_row(row):
-        best_match_info, similarities = identify_best_matching_url(row, matches_scores, matching_columns, df_staging)
-        best_match_info = add_additional_info_to_match_results(best_match_info, df_staging, selected_additional_columns)
-        # Convert scores to percentage format with '%' sign
-        best_match_info['All Column Match Scores'] = [
-            (col, f"{round(score * 100)}%" if not pd.isna(score) else "NaN%")
-            for col, score in zip(matching_columns, similarities)
-        ]
-        return pd.Series(best_match_info)
+    for i, col in enumerate(matching_columns):
+        matches = matches_scores.get(col, pd.DataFrame())
+        if matches.empty:
+            continue
+        to_lookup, similarity_lookup = build_match_lookup_tables(matches)
+        live_values = df_live[col]
+        score_matrix[:, i] = live_values.map(similarity_lookup).to_numpy(dtype=float, na_value=np.nan)
+        matched_content = live_values.map(to_lookup)
+        content_matrix[:, i] = matched_content.to_numpy(dtype=object)
+        url_matrix[:, i] = matched_content.map(build_staging_address_lookup(df_staging, col)).to_numpy(dtype=object)
+
+    # A column only wins when it beats a score of 0, ties go to the first column in matching order
+    rows = np.arange(num_rows)
+    filled_scores = np.where(np.isnan(score_matrix), -np.inf, score_matrix)
+    best_col_index = filled_scores.argmax(axis=1)
+    has_best_match = filled_scores[rows, best_col_index] > 0
+
+    match_results = pd.DataFrame({
+        'Best Match on': np.where(has_best_match, np.array(matching_columns, dtype=object)[best_col_index], None),
+        'Highest Matching URL': np.where(has_best_match, url_matrix[rows, best_col_index], None),
+        'Highest Similarity Score': np.where(has_best_match, score_matrix[rows, best_col_index], 0),
+        'Best Match Content': np.where(has_best_match, content_matrix[rows, best_col_index], None),
+        'Median Match Score': pd.DataFrame(score_matrix).median(axis=1, skipna=True).to_numpy(),
+    }, index=df_live.index)
+
+    staging_by_address = df_staging.dropna(subset=['Address']).drop_duplicates(subset='Address', keep='first')
+    staging_by_address = staging_by_address.set_index('Address')
+    for additional_col in selected_additional_columns:
+        if additional_col in staging_by_address.columns:
+            match_results[f'Staging {additional_col}'] = \
+                match_results['Highest Matching URL'].map(staging_by_address[additional_col])
 
-    return df_live.apply(process_row, axis=1)
+    match_results['All Column Match Scores'] = format_all_column_match_scores(score_matrix, matching_columns)
+    return match_results
 
 
 def finalise_match_results_processing(df_live, df_staging, matches_scores, matching_columns,
@@ -441,7 +1157,7 @@ def finalise_match_results_processing(df_live, df_staging, matches_scores, match
 
 def process_uploaded_files_and_match_data(df_live, df_staging, matching_columns, progress_bar, message_placeholder,
                                           selected_additional_columns,
-                                          selected_model):
+                                          selected_model, file_hashes=None, column_sources=None):
     """
     Processes the uploaded files and performs data matching using the specified model.
 
@@ -453,6 +1169,8 @@ def process_uploaded_files_and_match_data(df_live, df_staging, matching_columns,
     message_placeholder (streamlit.empty): Streamlit placeholder for messages.
     selected_additional_columns (list): Additional columns selected for matching.
     selected_model (str): The name of the matching model to use.
+    file_hashes (tuple, optional): The content hashes of the live and staging files, used to cache match results.
+    column_sources (dict, optional): A dictionary mapping each matching column to its name in the uploaded files.
 
     Returns:
     pd.DataFrame: The final DataFrame after processing and matching data.
@@ -461,7 +1179,13 @@ def process_uploaded_files_and_match_data(df_live, df_staging, matching_columns,
     df_staging = convert_dataframe_to_lowercase(df_staging)
 
     model = setup_matching_model(selected_model)
-    matches_scores = process_column_matches_and_scores(model, df_live, df_staging, matching_columns)
+    column_cache_keys = None
+    if file_hashes is not None:
+        column_sources = column_sources or {col: col for col in matching_columns}
+        column_cache_keys = build_match_cache_keys(file_hashes[0], file_hashes[1], column_sources, selected_model,
+                                                   getattr(model.method, 'min_similarity', None))
+    matches_scores = process_column_matches_and_scores(model, df_live, df_staging, matching_columns,
+                                                       column_cache_keys)
 
     for index, _ in enumerate(matching_columns):
         progress = (index + 1) / len(matching_columns)
@@ -564,20 +1288,40 @@ def select_columns_for_matching(df_live, df_staging):
     return address_column, selected_additional_columns
 
 
-def process_column_matches_and_scores(model, df_live, df_staging, matching_columns):
+def process_column_matches_and_scores(model, df_live, df_staging, matching_columns, column_cache_keys=None):
     """
     Processes and computes the scores for column matches between live and staging dataframes.
 
+    Columns with results in the match cache are loaded from it, only the remaining columns are matched.
+
     Args:
     model (PolyFuzz model): The matching model to use.
     df_live (pd.DataFrame): The live dataframe.
     df_staging (pd.DataFrame): The staging dataframe.
     matching_columns (list): A list of columns to match between the dataframes.
+    column_cache_keys (dict, optional): A dictionary mapping each column to its cache key. Defaults to no caching.
 
     Returns:
     dict: A dictionary containing the match scores for each column.
     """
-    return match_columns_and_compute_scores(model, df_live, df_staging, matching_columns)
+    if not column_cache_keys:
+        return match_columns_and_compute_scores(model, df_live, df_staging, matching_columns)
+
+    cached_scores = {}
+    for col in matching_columns:
+        cached_matches = load_cached_matches(column_cache_keys[col])
+        if cached_matches is not None:
+            cached_scores[col] = cached_matches
+
+    columns_to_match = [col for col in matching_columns if col not in cached_scores]
+    computed_scores = {}
+    if columns_to_match:
+        computed_scores = match_columns_and_compute_scores(model, df_live, df_staging, columns_to_match)
+        for col, matches in computed_scores.items():
+            store_cached_matches(column_cache_keys[col], matches)
+
+    return {col: cached_scores[col] if col in cached_scores else computed_scores[col]
+            for col in matching_columns if col in cached_scores or col in computed_scores}
 
 
 # Data Visualization and Reporting -------------------------------------------------------------------------------------
@@ -698,34 +1442,66 @@ def apply_formatting_to_excel_sheets(excel_writer, df):
     workbook = excel_writer.book
     worksheet1 = excel_writer.sheets['Mapped URLs']
 
-    # Formats
-    left_align_format = workbook.add_format({'align': 'left'})
-    percentage_format = workbook.add_format({'num_format': '0.00%', 'align': 'center'})
-
     num_rows = len(df)
     num_cols = len(df.columns)
     worksheet1.add_table(0, 0, num_rows, num_cols - 1, {'columns': [{'header': col} for col in df.columns]})
     worksheet1.freeze_panes(1, 0)
 
-    max_col_width = 80
-    for i, col in enumerate(df.columns):
-        col_width = max(len(col), max(df[col].astype(str).apply(len).max(), 10)) + 2
-        col_width = min(col_width, max_col_width)
+    apply_column_formats_to_worksheet(workbook, worksheet1, df.columns, calculate_column_widths(df), num_rows)
 
+    return workbook
+
+
+def calculate_column_widths(df, sample_size=None, max_col_width=80):
+    """
+    Calculates Excel column widths from the length of the values in each column.
+
+    Args:
+    df (pd.DataFrame): The dataframe whose columns are measured.
+    sample_size (int, optional): When set, only a random sample of this many rows is measured.
+    max_col_width (int): The maximum width of a column.
+
+    Returns:
+    list: The width of each column.
+    """
+    if sample_size is not None and len(df) > sample_size:
+        df = df.sample(n=sample_size, random_state=0)
+
+    col_widths = []
+    for col in df.columns:
+        longest_value = df[col].astype(str).str.len().max() if len(df) else 0
+        col_widths.append(min(max(len(col), max(longest_value, 10)) + 2, max_col_width))
+    return col_widths
+
+
+def apply_column_formats_to_worksheet(workbook, worksheet, columns, col_widths, num_rows):
+    """
+    Sets the column widths and formats of the 'Mapped URLs' worksheet, with color scales on the score columns.
+
+    Args:
+    workbook (xlsxwriter.Workbook): The workbook holding the worksheet.
+    worksheet (xlsxwriter.Worksheet): The worksheet to format.
+    columns (list): The column names of the worksheet.
+    col_widths (list): The width of each column.
+    num_rows (int): The number of data rows in the worksheet.
+    """
+    # Formats
+    left_align_format = workbook.add_format({'align': 'left'})
+    percentage_format = workbook.add_format({'num_format': '0.00%', 'align': 'center'})
+
+    for i, (col, col_width) in enumerate(zip(columns, col_widths)):
         # Apply specific formatting for columns 'E', 'F', and 'H' (indices 4, 5, and 7)
         if i in [3, 5, 7]:  # Adjusting the indices for columns E, F, and H
-            worksheet1.set_column(i, i, col_width, percentage_format)
+            worksheet.set_column(i, i, col_width, percentage_format)
             # Apply 3-color scale formatting with specified colors
-            worksheet1.conditional_format(1, i, num_rows, i, {
+            worksheet.conditional_format(1, i, num_rows, i, {
                 'type': '3_color_scale',
                 'min_color': "#f8696b",  # Custom red for lowest values
                 'mid_color': "#ffeb84",  # Custom yellow for middle values
                 'max_color': "#63be7b"  # Custom green for highest values
             })
         else:
-            worksheet1.set_column(i, i, col_width, left_align_format)
-
-    return workbook
+            worksheet.set_column(i, i, col_width, left_align_format)
 
 
 def add_chart_to_excel_sheet(excel_writer, score_data):
@@ -736,8 +1512,18 @@ def add_chart_to_excel_sheet(excel_writer, score_data):
     excel_writer (pd.ExcelWriter): The Excel writer object.
     score_data (pd.DataFrame): The dataframe containing score distribution data to be plotted.
     """
-    workbook = excel_writer.book
-    worksheet2 = excel_writer.sheets['Median Score Distribution']
+    add_chart_to_worksheet(excel_writer.book, excel_writer.sheets['Median Score Distribution'], score_data)
+
+
+def add_chart_to_worksheet(workbook, worksheet, score_data):
+    """
+    Adds the median score distribution chart to a worksheet.
+
+    Args:
+    workbook (xlsxwriter.Workbook): The workbook holding the worksheet.
+    worksheet (xlsxwriter.Worksheet): The 'Median Score Distribution' worksheet.
+    score_data (pd.DataFrame): The dataframe containing score distribution data to be plotted.
+    """
     chart = workbook.add_chart({'type': 'column'})
     max_row = len(score_data) + 1
 
@@ -750,7 +1536,105 @@ def add_chart_to_excel_sheet(excel_writer, score_data):
     chart.set_title({'name': 'Distribution of Median Match Scores'})
     chart.set_x_axis({'name': 'Median Match Score Brackets'})
     chart.set_y_axis({'name': 'URL Count'})
-    worksheet2.insert_chart('D2', chart)
+    worksheet.insert_chart('D2', chart)
+
+
+def write_dataframe_rows_to_worksheet(worksheet, df, header_format=None):
+    """
+    Writes a dataframe to a worksheet row by row, as required by xlsxwriter's constant_memory mode.
+
+    Args:
+    worksheet (xlsxwriter.Worksheet): The worksheet to write to.
+    df (pd.DataFrame): The dataframe to write.
+    header_format (xlsxwriter.Format, optional): The format of the header row.
+    """
+    worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+    for row_index, values in enumerate(df.itertuples(index=False, name=None), start=1):
+        # Missing values are written as blank cells, Excel cannot store NaN
+        worksheet.write_row(row_index, 0, [None if pd.isna(value) else value for value in values])
+
+
+def write_streaming_excel_file(df, score_data, path):
+    """
+    Writes the final results to an Excel file with xlsxwriter's constant_memory mode.
+
+    Rows are flushed to disk as they are written and the column widths are measured on a sample, so memory
+    does not grow with the number of results. Tables are not available in this mode, an autofilter is used.
+
+    Args:
+    df (pd.DataFrame): The main dataframe to be included in the Excel file.
+    score_data (pd.DataFrame): The dataframe containing score distribution data.
+    path (str): The path of the output Excel file.
+    """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'strings_to_urls': False})
+    header_format = workbook.add_format({'bold': True})
+
+    worksheet1 = workbook.add_worksheet('Mapped URLs')
+    num_rows = len(df)
+    col_widths = calculate_column_widths(df, sample_size=COLUMN_WIDTH_SAMPLE_SIZE)
+    apply_column_formats_to_worksheet(workbook, worksheet1, df.columns, col_widths, num_rows)
+    worksheet1.freeze_panes(1, 0)
+    worksheet1.autofilter(0, 0, num_rows, len(df.columns) - 1)
+    write_dataframe_rows_to_worksheet(worksheet1, df, header_format)
+
+    worksheet2 = workbook.add_worksheet('Median Score Distribution')
+    write_dataframe_rows_to_worksheet(worksheet2, score_data.astype({'Score Bracket': str}), header_format)
+    add_chart_to_worksheet(workbook, worksheet2, score_data)
+    workbook.close()
+
+
+def get_session_export_dir():
+    """
+    Returns the export directory of the current browser session, creating it on first use.
+
+    Every session writes its downloads to its own subdirectory of EXPORT_DIR, so concurrent sessions never
+    overwrite each other's files.
+
+    Returns:
+    str: The path of the session's export directory.
+    """
+    if 'export_dir' not in st.session_state:
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        st.session_state['export_dir'] = tempfile.mkdtemp(prefix='session-', dir=EXPORT_DIR)
+    # The temporary directory may have been cleaned up while the session was idle
+    os.makedirs(st.session_state['export_dir'], exist_ok=True)
+    return st.session_state['export_dir']
+
+
+def show_download_button_for_file(path, filename, mime, label):
+    """
+    Serves a file written to disk through a Streamlit download button.
+
+    Args:
+    path (str): The path of the file to serve.
+    filename (str): The file name offered to the user.
+    mime (str): The MIME type of the file.
+    label (str): The label of the download button.
+    """
+    with open(path, 'rb') as file:
+        st.download_button(label=label, data=file, file_name=filename, mime=mime, key=f"download_{filename}")
+
+
+def show_large_result_download_buttons(df, filename):
+    """
+    Writes the results as Parquet and gzipped CSV and offers both for download.
+
+    Args:
+    df (pd.DataFrame): The final dataframe.
+    filename (str): The name of the output Excel file, used as the base name of both files.
+    """
+    base_name = os.path.splitext(filename)[0]
+    export_dir = get_session_export_dir()
+
+    parquet_path = os.path.join(export_dir, f"{base_name}.parquet")
+    df.to_parquet(parquet_path, index=False)
+    show_download_button_for_file(parquet_path, f"{base_name}.parquet", 'application/octet-stream',
+                                  f"Download {base_name}.parquet")
+
+    csv_path = os.path.join(export_dir, f"{base_name}.csv.gz")
+    df.to_csv(csv_path, index=False, compression='gzip')
+    show_download_button_for_file(csv_path, f"{base_name}.csv.gz", 'application/gzip',
+                                  f"Download {base_name}.csv.gz")
 
 
 def create_excel_download_link(filename):
@@ -758,17 +1642,18 @@ def create_excel_download_link(filename):
     Creates a download link for an Excel file.
 
     Args:
-    filename (str): The name of the file for which the download link is created.
+    filename (str): The path of the file for which the download link is created.
 
     Returns:
     str: A HTML hyperlink for downloading the Excel file.
     """
     with open(filename, 'rb') as file:
         b64 = base64.b64encode(file.read()).decode()
+    download_name = os.path.basename(filename)
     download_link = (
         f'<a href="data:application/vnd.openxmlformats-officedocument.'
-        f'spreadsheetml.sheet;base64,{b64}" download="{filename}">'
-        f'Click here to download {filename}</a>'
+        f'spreadsheetml.sheet;base64,{b64}" download="{download_name}">'
+        f'Click here to download {download_name}</a>'
     )
     return download_link
 
@@ -782,12 +1667,13 @@ def generate_excel_download_and_display_link(df, filename, score_data):
     filename (str): The name of the output Excel file.
     score_data (pd.DataFrame): Additional score data to be included in the Excel file.
     """
-    excel_writer = create_excel_with_dataframes(df, score_data, filename)
+    excel_path = os.path.join(get_session_export_dir(), filename)
+    excel_writer = create_excel_with_dataframes(df, score_data, excel_path)
     apply_formatting_to_excel_sheets(excel_writer, df)
     add_chart_to_excel_sheet(excel_writer, score_data)
     excel_writer.close()
 
-    download_link = create_excel_download_link(filename)
+    download_link = create_excel_download_link(excel_path)
     st.markdown(download_link, unsafe_allow_html=True)
 
 
@@ -795,6 +1681,10 @@ def show_download_link_for_final_excel(df_final, filename):
     """
     Displays the download link for the final Excel file.
 
+    The export mode chosen in the advanced settings decides between the formatted Excel file served as a
+    link and the streaming Excel file served through a download button. Results over LARGE_RESULT_ROWS are
+    also offered as Parquet and CSV.gz, and are not written to Excel at all once they exceed a sheet's rows.
+
     Args:
     df_final (pd.DataFrame): The final dataframe to be included in the Excel file.
     filename (str): The name of the output Excel file.
@@ -802,7 +1692,23 @@ def show_download_link_for_final_excel(df_final, filename):
     df_for_score_data = df_final.drop(['Median Match Score Scaled', 'Score Bracket'], axis=1, inplace=False,
                                       errors='ignore')
     score_data = generate_score_distribution_dataframe(df_for_score_data)
-    generate_excel_download_and_display_link(df_final, 'migration_mapping_data.xlsx', score_data)
+
+    export_mode = st.session_state.get('export_mode', 'Formatted Excel')
+    if len(df_final) > LARGE_RESULT_ROWS:
+        show_large_result_download_buttons(df_final, filename)
+        if len(df_final) > EXCEL_MAX_DATA_ROWS:
+            st.info("The results have more rows than an Excel sheet can hold, download them as Parquet or CSV.gz.")
+            return
+        export_mode = 'Streaming Excel'
+
+    if export_mode == 'Streaming Excel':
+        excel_path = os.path.join(get_session_export_dir(), filename)
+        write_streaming_excel_file(df_final, score_data, excel_path)
+        show_download_button_for_file(excel_path, filename,
+                                      'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                                      f"Download {filename}")
+    else:
+        generate_excel_download_and_display_link(df_final, 'migration_mapping_data.xlsx', score_data)
 
 
 # Main Function and Additional Utilities -------------------------------------------------------------------------------
@@ -863,7 +1769,7 @@ def main():
 
     # Advanced settings expander for model selection
     with st.expander("Advanced Settings"):
-        model_options = ['TF-IDF', 'Edit Distance', 'RapidFuzz']
+        model_options = ['TF-IDF', 'Edit Distance', 'RapidFuzz', 'Chunked TF-IDF', 'URL Structure']
         selected_model = st.selectbox("Select Matching Model", model_options)
 
         if selected_model == "TF-IDF":
@@ -873,17 +1779,33 @@ def main():
                 "Edit Distance is useful for matching based on character-level differences, such as small text variations.")
         elif selected_model == "RapidFuzz":
             st.write("RapidFuzz is efficient for large datasets, offering fast and approximate string matching.")
+        elif selected_model == "Chunked TF-IDF":
+            st.write("Chunked TF-IDF keeps memory bounded on very large crawls by scoring URLs in batches and "
+                     "keeping only the best match for each one.")
+        elif selected_model == "URL Structure":
+            st.write("URL Structure compares slug words, folders and numeric IDs while ignoring the domain and "
+                     "query string, suited to re-platforms that keep readable URLs.")
+
+        export_options = ['Formatted Excel', 'Streaming Excel']
+        st.selectbox("Select Export Mode", export_options, key='export_mode')
+        st.write("Streaming Excel writes large results row by row with low memory use, without the Excel table "
+                 f"styling. Results over {LARGE_RESULT_ROWS:,} rows are also offered as Parquet and CSV.gz.")
 
     file_live, file_staging = create_file_uploader_widgets()
     if file_live and file_staging:
-        df_live, df_staging = process_and_validate_uploaded_files(file_live, file_staging)
-        if df_live is not None and df_staging is not None:
-            address_column, selected_additional_columns = select_columns_for_matching(df_live,
-                                                                                      df_staging)
+        df_live_headers, df_staging_headers = read_uploaded_file_headers(file_live, file_staging)
+        if df_live_headers is not None and df_staging_headers is not None:
+            address_column, selected_additional_columns = select_columns_for_matching(df_live_headers,
+                                                                                      df_staging_headers)
             if st.button("Process Files"):
-                df_final = handle_data_matching_and_processing(df_live, df_staging, address_column,
-                                                               selected_additional_columns,
-                                                               selected_model)
+                # Only the columns used for matching are read from the uploads
+                df_live, df_staging = process_and_validate_uploaded_files(
+                    file_live, file_staging, usecols=[address_column] + selected_additional_columns)
+                if df_live is not None and df_staging is not None:
+                    file_hashes = (compute_file_content_hash(file_live), compute_file_content_hash(file_staging))
+                    df_final = handle_data_matching_and_processing(df_live, df_staging, address_column,
+                                                                   selected_additional_columns,
+                                                                   selected_model, file_hashes)
 
     create_page_footer_with_contact_info()
 